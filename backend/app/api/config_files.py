@@ -1,11 +1,11 @@
 """配置文件管理 API"""
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlalchemy.orm import Session
 from typing import List
 import os
 
 from ..database import get_db
-from .. import models, schemas
+from .. import models, schemas, versioning
 from ..auth import get_current_user
 
 router = APIRouter(prefix="/api/servers/{server_id}/config-files", tags=["config-files"])
@@ -13,15 +13,22 @@ router = APIRouter(prefix="/api/servers/{server_id}/config-files", tags=["config
 @router.get("", response_model=List[schemas.ConfigFile])
 def list_config_files(
     server_id: str,
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
-    """获取服务器的所有配置文件"""
-    server = db.query(models.MCPServer).filter(models.MCPServer.id == server_id).first()
-    if not server:
+    """获取服务器的所有配置文件（配置文件修改会递增服务器版本号，据此生成 ETag）"""
+    version = versioning.server_version(db, server_id)
+    if version is None:
         raise HTTPException(status_code=404, detail="Server not found")
-    
-    return server.config_files
+    etag = versioning.make_etag(server_id, version, "config-files")
+    cached = versioning.not_modified(request, etag)
+    if cached:
+        return cached
+    response.headers["ETag"] = etag
+
+    return db.query(models.ConfigFile).filter(models.ConfigFile.server_id == server_id).all()
 
 @router.post("", response_model=schemas.ConfigFile)
 def create_config_file(
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
 from datetime import datetime, timedelta
@@ -13,6 +13,8 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30 * 24 * 60 # 30天过期
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/token")
+# 浏览器的 EventSource/WebSocket 无法设置请求头，允许通过查询参数传递 token
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="/api/auth/token", auto_error=False)
 
 # 模拟用户数据库 (MVP阶段直接硬编码)
 # 默认用户: admin / admin123
@@ -57,25 +59,45 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+def authenticate_token(token: Optional[str]) -> Optional[UserInDB]:
+    """校验 token，返回对应用户，无效时返回 None"""
+    if not token:
+        return None
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
-            raise credentials_exception
+            return None
         token_data = TokenData(username=username)
     except JWTError:
-        raise credentials_exception
-    user = get_user(FAKE_USERS_DB, username=token_data.username)
+        return None
+    return get_user(FAKE_USERS_DB, username=token_data.username)
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    user = authenticate_token(token)
     if user is None:
         raise credentials_exception
     return user
 
+async def get_stream_user(
+    header_token: Optional[str] = Depends(oauth2_scheme_optional),
+    token: Optional[str] = Query(None)
+):
+    """流式接口的认证：优先使用 Authorization 头，其次使用 ?token= 参数"""
+    user = authenticate_token(header_token or token)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
+
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
 @router.post("/token", response_model=Token)
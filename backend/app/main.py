@@ -1,19 +1,44 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Body
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Body, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
+from typing import List, Optional, Union
+from datetime import datetime
+import asyncio
+import base64
+import fnmatch
+import hashlib
+import re
 import uuid
 import os
 import shutil
 import logging
 import json
-import zipfile
-import tarfile
 
-from .database import engine, Base, get_db
-from . import models, schemas
-from .services.docker_manager import docker_manager
-from .auth import router as auth_router, get_current_user
+from .database import engine, Base, get_db, SessionLocal
+from . import models, schemas, versioning
+from .services.docker_manager import docker_manager, CONTAINER_NETWORK, BASE_IMAGE
+from .services.docker_executor import (
+    docker_executor, DockerBusyError, DockerTimeoutError
+)
+from .services.docker_state import docker_state
+from .services.reconciler import reconciler
+from .services import lifecycle, archive, port_reservations
+from .services.code_store import code_store, validate_manifest, ManifestError, SHA256_RE
+from .services.releases import releases, ReleaseError
+from .services.dep_layers import dep_layers
+from .services.wheelhouse import wheelhouse
+from .services.bytecode import bytecode_compiler
+from .services.jobs import job_manager, JobState
+from .services.warm_pool import warm_pool
+from .services.log_hub import log_hub, parse_log_time
+from .services.log_store import log_capture
+from .services.gateway import gateway, RESERVED_NAMES
+from .services.port_allocator import port_allocator, PortAllocator, PORT_POOL_START, PORT_POOL_END
+from .auth import router as auth_router, get_current_user, get_stream_user, authenticate_token
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -25,6 +50,9 @@ Base.metadata.create_all(bind=engine)
 # 版本号定义
 VERSION = "1.0.0"
 
+# 批量操作的最大并发数
+BULK_MAX_PARALLELISM = int(os.getenv("BULK_MAX_PARALLELISM", "16"))
+
 app = FastAPI(title="EMCP Platform", version=VERSION)
 
 # 注册认证路由
@@ -45,8 +73,34 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
+@app.exception_handler(DockerBusyError)
+async def docker_busy_handler(request, exc: DockerBusyError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+@app.exception_handler(DockerTimeoutError)
+async def docker_timeout_handler(request, exc: DockerTimeoutError):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+@app.on_event("startup")
+def start_docker_state():
+    docker_state.start()
+    reconciler.start()
+
+@app.on_event("shutdown")
+async def shutdown_lifecycle_jobs():
+    # 需在 Docker 线程池关闭之前取消进行中的任务
+    await job_manager.shutdown()
+
+@app.on_event("shutdown")
+def shutdown_docker_executor():
+    warm_pool.stop()
+    reconciler.stop()
+    docker_state.stop()
+    docker_executor.shutdown()
+
 def get_data_root():
     """
     确定数据存储根目录
@@ -76,26 +130,233 @@ def get_data_root():
 DATA_ROOT = get_data_root()
 logger.info(f"Using Data Root: {DATA_ROOT}")
 
+def load_port_reservations(db: Session):
+    """
+    从数据库和 Docker 实际绑定重建端口分配表
+    数据库中的记录优先，其余被容器占用的端口记为外部占用
+    """
+    reservations = db.query(models.PortReservation.port, models.PortReservation.server_id).all()
+    reservations += db.query(models.MCPServer.host_port, models.MCPServer.id).filter(
+        models.MCPServer.host_port.isnot(None)
+    ).all()
+    for host_port, container_name in docker_manager.list_bound_host_ports():
+        reservations.append((host_port, f"docker:{container_name}"))
+    port_allocator.rebuild(reservations)
+
+@app.on_event("startup")
+def init_fleet_state():
+    db = SessionLocal()
+    try:
+        versioning.ensure_fleet_state(db)
+    finally:
+        db.close()
+
+@app.on_event("startup")
+def init_port_allocator():
+    db = SessionLocal()
+    try:
+        port_reservations.backfill_legacy(db)
+        load_port_reservations(db)
+    finally:
+        db.close()
+
+@app.on_event("startup")
+def start_wheelhouse():
+    # 需在预热容器池之前注册共享挂载（startup 按注册顺序执行）
+    wheelhouse.start(DATA_ROOT)
+
+@app.on_event("startup")
+def start_warm_pool():
+    # 依赖端口分配表，需在其初始化之后启动
+    warm_pool.start(DATA_ROOT)
+
+@app.on_event("startup")
+def start_code_store():
+    db = SessionLocal()
+    try:
+        base_paths = [path for (path,) in db.query(models.MCPServer.source_code_path).all() if path]
+    finally:
+        db.close()
+    # 旧版本的 app 普通目录转换为第一个代码版本
+    for base_path in base_paths:
+        try:
+            releases.migrate(base_path)
+        except OSError as e:
+            logger.error(f"Failed to migrate code releases in {base_path}: {e}")
+    code_store.start(DATA_ROOT, [os.path.join(path, "app") for path in base_paths])
+
+@app.on_event("startup")
+def start_dep_layers():
+    dep_layers.start(DATA_ROOT)
+
+@app.on_event("startup")
+def start_log_capture():
+    db = SessionLocal()
+    try:
+        running = db.query(models.MCPServer.id, models.MCPServer.container_id).filter(
+            models.MCPServer.status == models.ServerStatus.RUNNING,
+            models.MCPServer.container_id.isnot(None)
+        ).all()
+    finally:
+        db.close()
+    log_capture.start(DATA_ROOT, running)
+
+@app.on_event("shutdown")
+def stop_log_capture():
+    log_capture.stop()
+
+def describe_port_owner(db: Session, owner: str) -> str:
+    """将端口归属标识转换为可读描述"""
+    if owner == PortAllocator.SYSTEM_OWNER:
+        return "系统"
+    if owner.startswith("warm:"):
+        return "预热容器"
+    if owner.startswith("docker:"):
+        return f"容器 '{owner[len('docker:'):]}'"
+    other_server = db.query(models.MCPServer).filter(models.MCPServer.id == owner).first()
+    return f"服务器 '{other_server.name}'" if other_server else "其他服务器"
+
 @app.get("/api/images")
-def list_images(current_user = Depends(get_current_user)):
+async def list_images(current_user = Depends(get_current_user)):
     """获取本地 Docker 镜像列表"""
     try:
-        images = docker_manager.list_images()
+        images = await docker_executor.run(docker_manager.list_images)
         return {"images": images}
+    except (DockerBusyError, DockerTimeoutError):
+        raise
     except Exception as e:
         logger.error(f"Failed to list images: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to list images: {str(e)}")
 
-@app.get("/api/servers", response_model=List[schemas.MCPServer])
-def list_servers(db: Session = Depends(get_db), current_user = Depends(get_current_user)):
-    return db.query(models.MCPServer).all()
+# 服务器列表可用的排序字段，相同取值按 id 排序，保证游标分页的顺序稳定
+SERVER_SORT_FIELDS = {
+    "name": models.MCPServer.name,
+    "created_at": models.MCPServer.created_at,
+    "updated_at": models.MCPServer.updated_at,
+    "status": models.MCPServer.status,
+}
+SERVER_LIST_MAX_LIMIT = 500
+
+def encode_server_cursor(server: models.MCPServer, sort_field: str) -> str:
+    value = getattr(server, sort_field)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    elif isinstance(value, models.ServerStatus):
+        value = value.name
+    raw = json.dumps([value, server.id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_server_cursor(cursor: str, sort_field: str):
+    """解析游标，返回上一页最后一条记录的 (排序字段值, id)"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, server_id = json.loads(raw)
+        if value is None or not isinstance(server_id, str):
+            raise ValueError(cursor)
+        if sort_field in ("created_at", "updated_at"):
+            value = datetime.fromisoformat(value)
+        elif sort_field == "status":
+            value = models.ServerStatus[value]
+        return value, server_id
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/api/servers", response_model=List[Union[schemas.MCPServer, schemas.MCPServerSummary]])
+def list_servers(
+    request: Request,
+    response: Response,
+    status: Optional[List[models.ServerStatus]] = Query(None),
+    image: Optional[str] = None,
+    name_prefix: Optional[str] = None,
+    sort: str = "name",
+    limit: Optional[int] = Query(None, ge=1, le=SERVER_LIST_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    view: str = "summary",
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    列出服务器。
+
+    - 过滤：status（可重复）、image、name_prefix
+    - 排序：sort=name|created_at|updated_at|status，前缀 "-" 表示倒序
+    - 分页：指定 limit 后按游标分页，还有下一页时在 X-Next-Cursor 响应头返回游标；不指定 limit 返回全部
+    - view=summary（默认）不返回环境变量和配置文件内容，view=full 返回完整结构
+    - ETag 由全局版本号和查询参数生成，If-None-Match 匹配时返回 304
+    """
+    descending = sort.startswith("-")
+    sort_field = sort.lstrip("-")
+    if sort_field not in SERVER_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Invalid sort field, expected one of: {', '.join(SERVER_SORT_FIELDS)}")
+    if view not in ("summary", "full"):
+        raise HTTPException(status_code=400, detail="Invalid view, expected 'summary' or 'full'")
+
+    # 先读版本号再查询数据：期间有修改时下次请求的 ETag 会不同，不会缓存旧数据
+    etag = versioning.make_etag("fleet", versioning.fleet_version(db), versioning.query_digest(request))
+    cached = versioning.not_modified(request, etag)
+    if cached:
+        return cached
+    response.headers["ETag"] = etag
+
+    query = db.query(models.MCPServer)
+    if status:
+        query = query.filter(models.MCPServer.status.in_(status))
+    if image:
+        query = query.filter(models.MCPServer.image == image)
+    if name_prefix:
+        query = query.filter(models.MCPServer.name.startswith(name_prefix, autoescape=True))
+
+    column = SERVER_SORT_FIELDS[sort_field]
+    if cursor:
+        value, server_id = decode_server_cursor(cursor, sort_field)
+        if descending:
+            query = query.filter(or_(column < value, and_(column == value, models.MCPServer.id < server_id)))
+        else:
+            query = query.filter(or_(column > value, and_(column == value, models.MCPServer.id > server_id)))
+    if descending:
+        query = query.order_by(column.desc(), models.MCPServer.id.desc())
+    else:
+        query = query.order_by(column, models.MCPServer.id)
+
+    # 关联数据按页批量加载（每个关联一条 IN 查询），避免逐个服务器懒加载；ports 由端口预留生成
+    query = query.options(selectinload(models.MCPServer.port_reservations))
+    if view == "full":
+        query = query.options(selectinload(models.MCPServer.env_vars), selectinload(models.MCPServer.config_files))
+    else:
+        query = query.options(
+            selectinload(models.MCPServer.config_files).load_only(
+                models.ConfigFile.id, models.ConfigFile.filename, models.ConfigFile.updated_at
+            )
+        )
+
+    if limit:
+        servers = query.limit(limit + 1).all()
+        if len(servers) > limit:
+            servers = servers[:limit]
+            response.headers["X-Next-Cursor"] = encode_server_cursor(servers[-1], sort_field)
+    else:
+        servers = query.all()
+
+    schema = schemas.MCPServer if view == "full" else schemas.MCPServerSummary
+    return [schema.model_validate(server) for server in servers]
 
 @app.get("/api/servers/{server_id}", response_model=schemas.MCPServer)
-def get_server(server_id: str, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
-    server = db.query(models.MCPServer).filter(models.MCPServer.id == server_id).first()
-    if not server:
+def get_server(
+    server_id: str,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    version = versioning.server_version(db, server_id)
+    if version is None:
         raise HTTPException(status_code=404, detail="Server not found")
-    return server
+    etag = versioning.make_etag(server_id, version)
+    cached = versioning.not_modified(request, etag)
+    if cached:
+        return cached
+    response.headers["ETag"] = etag
+    return db.query(models.MCPServer).filter(models.MCPServer.id == server_id).first()
 
 @app.post("/api/servers", response_model=schemas.MCPServer)
 async def create_server(
@@ -115,78 +376,83 @@ async def create_server(
     # 1. 检查名称唯一性
     if db.query(models.MCPServer).filter(models.MCPServer.name == name).first():
         raise HTTPException(status_code=400, detail="Server name already exists")
+    if name in RESERVED_NAMES:
+        raise HTTPException(status_code=400, detail=f"Server name '{name}' is reserved")
 
     # 2. 生成 ID 和 路径
     server_id = str(uuid.uuid4())
     
     # 使用 DATA_ROOT 作为基准
     base_path = os.path.join(DATA_ROOT, server_id)
-    app_path = os.path.join(base_path, "app")
-    os.makedirs(app_path, exist_ok=True)
+    release_id, release_path = releases.create(base_path)
     
     # 3. 保存并处理文件 (支持 .py, .zip, .tar, .tar.gz)
-    filename = file.filename
-    file_ext = os.path.splitext(filename)[1].lower()
-    file_location = os.path.join(app_path, filename)
-    
-    with open(file_location, "wb+") as file_object:
-        shutil.copyfileobj(file.file, file_object)
-
-    # 解压逻辑
-    if file_ext == ".zip":
-        try:
-            with zipfile.ZipFile(file_location, 'r') as zip_ref:
-                zip_ref.extractall(app_path)
-            os.remove(file_location) # 删除压缩包
-        except zipfile.BadZipFile:
-             raise HTTPException(status_code=400, detail="Invalid zip file")
-    elif file_ext in [".tar", ".gz", ".tgz"]:
-        try:
-            # tarfile open supports compression automatic detection
-            if filename.endswith("tar.gz") or filename.endswith(".tgz") or filename.endswith(".tar"):
-                 with tarfile.open(file_location, "r:*") as tar_ref:
-                    tar_ref.extractall(app_path)
-                 os.remove(file_location)
-        except tarfile.ReadError:
-             raise HTTPException(status_code=400, detail="Invalid tar file")
+    # 直接从上传文件解压，不再先落盘一份压缩包；解压在线程池中执行，避免阻塞事件循环
+    try:
+        await run_in_threadpool(archive.extract_upload, file.file, file.filename, release_path)
+    except archive.ArchiveError as e:
+        shutil.rmtree(base_path, ignore_errors=True)
+        raise HTTPException(status_code=400, detail=str(e))
+    # 代码文件入库去重，版本目录中的文件替换为指向对象库的硬链接
+    await run_in_threadpool(code_store.ingest, release_path)
+    releases.activate(base_path, release_id)
+    # 后台预编译字节码；新代码可能带来新的依赖，提前预取到 wheelhouse
+    bytecode_compiler.submit(release_path, image)
+    wheelhouse.schedule()
 
     # 4. 预分配端口（如果用户指定了端口）
-    allocated_ports = None
+    allocated_ports = []
     if ports:
         try:
             # 解析用户指定的端口
             requested_ports = [int(p.strip()) for p in ports.split(',') if p.strip()]
-            # 检查端口是否可用
-            for port in requested_ports:
-                if not docker_manager._is_port_free(port):
-                    raise HTTPException(
-                        status_code=409,
-                        detail=f"端口 {port} 已被占用，请选择其他端口"
-                    )
-            allocated_ports = ports  # 用户指定的端口
         except ValueError:
             raise HTTPException(status_code=400, detail="端口格式错误，请使用逗号分隔的数字")
-    else:
-        # 自动分配一个端口
-        auto_port = docker_manager._find_free_port()
+        # 检查端口是否可用（先查分配表，再探测该端口）
+        for port in requested_ports:
+            if port_allocator.owner_of(port) is not None or not docker_manager._is_port_free(port):
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"端口 {port} 已被占用，请选择其他端口"
+                )
+        for port in requested_ports:
+            # 检查与预留之间可能被并发请求抢占
+            if not port_allocator.reserve(port, server_id):
+                port_allocator.release_owner(server_id)
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"端口 {port} 已被占用，请选择其他端口"
+                )
+        allocated_ports = requested_ports  # 用户指定的端口
+    elif not CONTAINER_NETWORK:
+        # 自动分配一个端口（容器网络模式下经网关访问，无需宿主机端口）
+        auto_port = port_allocator.allocate(server_id)
         if auto_port:
-            allocated_ports = str(auto_port)
+            allocated_ports = [auto_port]
     
-    # 5. 写入数据库
+    # 5. 写入数据库（端口预留与服务器记录在同一事务中提交）
     db_server = models.MCPServer(
         id=server_id,
         name=name,
         description=description,
         source_code_path=base_path,
         entry_object=entry_object,
-        ports=allocated_ports,  # 保存分配的端口
         command=command,
         args=args,
         image=image,  # 保存基础镜像
         status=models.ServerStatus.STOPPED
     )
     db.add(db_server)
-    db.commit()
+    try:
+        port_reservations.set_configured(db, db_server, allocated_ports, auto_assigned=not ports)
+        db.commit()
+    except (port_reservations.PortConflictError, IntegrityError) as e:
+        db.rollback()
+        port_allocator.release_owner(server_id)
+        shutil.rmtree(base_path, ignore_errors=True)
+        if isinstance(e, IntegrityError) and not port_reservations.is_conflict(e):
+            raise
+        raise HTTPException(status_code=409, detail="端口已被占用，请选择其他端口")
     
     # 6. 处理配置文件（上传模式）
     if config_files:
@@ -240,55 +506,170 @@ async def upload_code(
     current_user = Depends(get_current_user)
 ):
     """重新上传代码包"""
+    server = get_code_editable_server(db, server_id)
+
+    # 新代码解压为新版本，成功后切换到该版本；失败时当前版本保持不变
+    release_id, release_path = releases.create(server.source_code_path)
+    try:
+        await run_in_threadpool(archive.extract_upload, file.file, file.filename, release_path)
+        await run_in_threadpool(code_store.ingest, release_path)
+        await run_in_threadpool(releases.activate, server.source_code_path, release_id)
+        bytecode_compiler.submit(release_path, server.image or BASE_IMAGE)
+        wheelhouse.schedule()
+        return {"message": "代码上传成功，请重启服务器", "release_id": release_id}
+    except Exception as e:
+        releases.discard(server.source_code_path, release_id)
+        if isinstance(e, archive.ArchiveError):
+            raise HTTPException(status_code=400, detail=f"上传失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
+
+def get_code_editable_server(db: Session, server_id: str) -> models.MCPServer:
+    """获取可以更新代码的服务器（运行中或启动中不允许更新）"""
     server = db.query(models.MCPServer).filter(models.MCPServer.id == server_id).first()
     if not server:
         raise HTTPException(status_code=404, detail="Server not found")
-    
     if server.status == models.ServerStatus.RUNNING:
         raise HTTPException(status_code=400, detail="请先停止服务器再上传代码")
-    
-    # 备份旧代码
-    app_path = os.path.join(server.source_code_path, "app")
-    backup_path = os.path.join(server.source_code_path, "app.backup")
-    if os.path.exists(app_path):
-        if os.path.exists(backup_path):
-            shutil.rmtree(backup_path)
-        shutil.move(app_path, backup_path)
-    
-    os.makedirs(app_path, exist_ok=True)
-    
+    if server.status == models.ServerStatus.BUILDING:
+        raise HTTPException(status_code=409, detail="服务器正在启动中，请稍后再试")
+    return server
+
+def parse_code_manifest(manifest: schemas.CodeManifest) -> dict:
+    data = manifest.model_dump()
     try:
-        # 保存并解压新代码
-        filename = file.filename
-        file_ext = os.path.splitext(filename)[1].lower()
-        file_location = os.path.join(app_path, filename)
-        
-        with open(file_location, "wb+") as file_object:
-            shutil.copyfileobj(file.file, file_object)
-        
-        # 解压逻辑
-        if file_ext == ".zip":
-            with zipfile.ZipFile(file_location, 'r') as zip_ref:
-                zip_ref.extractall(app_path)
-            os.remove(file_location)
-        elif file_ext in [".tar", ".gz", ".tgz"]:
-            with tarfile.open(file_location, "r:*") as tar_ref:
-                tar_ref.extractall(app_path)
-            os.remove(file_location)
-        
-        # 删除备份
-        if os.path.exists(backup_path):
-            shutil.rmtree(backup_path)
-        
-        return {"message": "代码上传成功，请重启服务器"}
-    
-    except Exception as e:
-        # 恢复备份
-        if os.path.exists(backup_path):
-            if os.path.exists(app_path):
-                shutil.rmtree(app_path)
-            shutil.move(backup_path, app_path)
-        raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
+        validate_manifest(data)
+    except ManifestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return data
+
+@app.post("/api/servers/{server_id}/code/sync")
+def sync_code_manifest(
+    server_id: str,
+    manifest: schemas.CodeManifest,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    增量上传第一步：提交新代码的清单，返回对象库中缺少、需要上传的内容哈希
+    之后通过 PUT /code/blobs/{sha256} 上传缺少的文件，再调用 /code/commit 切换代码
+    """
+    server = db.query(models.MCPServer).filter(models.MCPServer.id == server_id).first()
+    if not server:
+        raise HTTPException(status_code=404, detail="Server not found")
+    data = parse_code_manifest(manifest)
+    current = code_store.load_manifest(os.path.join(server.source_code_path, "app")) or {"files": {}}
+    changed = [
+        path for path, entry in data["files"].items()
+        if current["files"].get(path, {}).get("sha256") != entry["sha256"]
+    ]
+    removed = [path for path in current["files"] if path not in data["files"]]
+    return {"missing": code_store.missing(data), "changed": changed, "removed": removed}
+
+@app.put("/api/servers/{server_id}/code/blobs/{digest}")
+async def upload_code_blob(
+    server_id: str,
+    digest: str,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """增量上传第二步：以请求体原始内容上传单个文件，服务端校验 sha256"""
+    if not SHA256_RE.match(digest):
+        raise HTTPException(status_code=400, detail="Invalid sha256")
+    if db.query(models.MCPServer.id).filter(models.MCPServer.id == server_id).first() is None:
+        raise HTTPException(status_code=404, detail="Server not found")
+    # 已有的对象可能尚未被任何服务器引用，刷新修改时间，避免在 commit 之前被 gc 回收
+    if await run_in_threadpool(code_store.touch_content, digest):
+        return {"sha256": digest, "stored": False}
+
+    tmp_path = await run_in_threadpool(code_store.new_blob_path)
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        # 文件读写放到线程池，不阻塞事件循环
+        f = await run_in_threadpool(open, tmp_path, "wb")
+        try:
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > archive.MAX_EXTRACTED_BYTES:
+                    raise HTTPException(status_code=413, detail="File too large")
+                hasher.update(chunk)
+                await run_in_threadpool(f.write, chunk)
+        finally:
+            await run_in_threadpool(f.close)
+        if hasher.hexdigest() != digest:
+            raise HTTPException(status_code=400, detail="Content does not match sha256")
+        await run_in_threadpool(code_store.put_blob, tmp_path, digest)
+    finally:
+        if os.path.exists(tmp_path):
+            await run_in_threadpool(os.remove, tmp_path)
+    return {"sha256": digest, "stored": True, "size": size}
+
+@app.post("/api/servers/{server_id}/code/commit")
+async def commit_code_manifest(
+    server_id: str,
+    manifest: schemas.CodeManifest,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """增量上传第三步：按清单用对象库中的文件组装新版本，并切换到该版本"""
+    server = get_code_editable_server(db, server_id)
+    data = parse_code_manifest(manifest)
+    missing = code_store.missing(data)
+    if missing:
+        raise HTTPException(status_code=409, detail={"message": "Missing blobs", "missing": missing})
+    release_id, release_path = releases.create(server.source_code_path)
+    try:
+        result = await run_in_threadpool(code_store.checkout, release_path, data)
+        await run_in_threadpool(releases.activate, server.source_code_path, release_id)
+    except FileNotFoundError:
+        # 提交期间对象被回收
+        releases.discard(server.source_code_path, release_id)
+        raise HTTPException(status_code=409, detail={"message": "Missing blobs", "missing": code_store.missing(data)})
+    except Exception:
+        releases.discard(server.source_code_path, release_id)
+        raise
+    bytecode_compiler.submit(release_path, server.image or BASE_IMAGE)
+    wheelhouse.schedule()
+    return {
+        "message": "代码更新成功，请重启服务器",
+        "release_id": release_id,
+        "digest": result["digest"],
+        "files": len(result["files"]),
+    }
+
+@app.get("/api/servers/{server_id}/releases", response_model=List[schemas.CodeRelease])
+def list_code_releases(
+    server_id: str,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """列出服务器保留的代码版本（从新到旧）"""
+    server = db.query(models.MCPServer).filter(models.MCPServer.id == server_id).first()
+    if not server:
+        raise HTTPException(status_code=404, detail="Server not found")
+    return releases.list(server.source_code_path)
+
+@app.post("/api/servers/{server_id}/releases/rollback")
+def rollback_code_release(
+    server_id: str,
+    request: schemas.ReleaseRollback = Body(default=schemas.ReleaseRollback()),
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    切换到指定的代码版本（未指定时回滚到上一个版本）
+    只切换 app 链接，运行中的容器不受影响，重启后生效
+    """
+    server = db.query(models.MCPServer).filter(models.MCPServer.id == server_id).first()
+    if not server:
+        raise HTTPException(status_code=404, detail="Server not found")
+    try:
+        release_id = releases.rollback(server.source_code_path, request.release_id)
+    except ReleaseError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    message = "已切换代码版本，重启服务器后生效" if server.status == models.ServerStatus.RUNNING else "已切换代码版本"
+    return {"message": message, "release_id": release_id}
 
 @app.post("/api/servers/{server_id}/upload-config")
 async def upload_config_files(
@@ -354,6 +735,8 @@ def update_server(
         
     if server.status == models.ServerStatus.RUNNING:
         raise HTTPException(status_code=400, detail="Cannot update a running server. Stop it first.")
+    if server.status == models.ServerStatus.BUILDING:
+        raise HTTPException(status_code=409, detail="Server is busy with a lifecycle job. Try again later.")
 
     if server_update.description is not None:
         server.description = server_update.description
@@ -362,49 +745,79 @@ def update_server(
     
     # 处理端口更新（支持 port 和 ports 两种字段）
     new_ports = server_update.ports or server_update.port
+    requested_ports = None
+    auto_port = None
+    reserved_ports = []
     if new_ports is not None:
         # 检查端口冲突
         if new_ports:  # 如果不是空字符串
             try:
                 requested_ports = [int(p.strip()) for p in str(new_ports).split(',') if p.strip()]
-                # 检查端口是否被其他服务器占用
-                for port in requested_ports:
-                    # 查找是否有其他服务器使用了这个端口
-                    other_server = db.query(models.MCPServer).filter(
-                        models.MCPServer.id != server_id,
-                        models.MCPServer.ports.like(f'%{port}%')
-                    ).first()
-                    if other_server:
-                        raise HTTPException(
-                            status_code=409,
-                            detail=f"端口 {port} 已被服务器 '{other_server.name}' 占用"
-                        )
-                    # 检查端口是否被系统占用
-                    if not docker_manager._is_port_free(port):
-                        raise HTTPException(
-                            status_code=409,
-                            detail=f"端口 {port} 已被系统占用"
-                        )
-                server.ports = str(new_ports)
             except ValueError:
                 raise HTTPException(status_code=400, detail="端口格式错误，请使用逗号分隔的数字")
+            # 检查端口是否被其他服务器占用（按端口索引查询）
+            for port, owner in port_reservations.owners(db, requested_ports).items():
+                if owner != server_id:
+                    raise HTTPException(
+                        status_code=409,
+                        detail=f"端口 {port} 已被{describe_port_owner(db, owner)}占用"
+                    )
+            current_ports = {r.port for r in server.port_reservations}
+            for port in requested_ports:
+                # 预热容器等非服务器占用只记录在分配表中
+                owner = port_allocator.owner_of(port)
+                if owner is not None and owner != server_id:
+                    raise HTTPException(
+                        status_code=409,
+                        detail=f"端口 {port} 已被{describe_port_owner(db, owner)}占用"
+                    )
+                # 检查端口是否被系统占用（只探测新增的端口）
+                if port not in current_ports and not docker_manager._is_port_free(port):
+                    raise HTTPException(
+                        status_code=409,
+                        detail=f"端口 {port} 已被系统占用"
+                    )
+        elif CONTAINER_NETWORK:
+            # 如果传入空字符串，容器网络模式下清空端口，不再发布
+            requested_ports = []
         else:
             # 如果传入空字符串，自动分配一个端口
-            auto_port = docker_manager._find_free_port()
-            if auto_port:
-                server.ports = str(auto_port)
+            auto_port = port_allocator.allocate(server_id)
+            requested_ports = [auto_port] if auto_port else []
+        # 提交前先在内存分配表中预留新端口，检查与预留之间被并发请求抢占时返回 409
+        reserved_ports = [p for p in requested_ports if port_allocator.owner_of(p) != server_id]
+        for index, port in enumerate(reserved_ports):
+            if not port_allocator.reserve(port, server_id):
+                db.rollback()
+                for reserved in reserved_ports[:index]:
+                    port_allocator.release(reserved, server_id)
+                raise HTTPException(status_code=409, detail=f"端口 {port} 已被占用，请选择其他端口")
+        port_reservations.set_configured(db, server, requested_ports, auto_assigned=auto_port is not None)
     
     if server_update.command is not None:
         server.command = server_update.command
     if server_update.args is not None:
         server.args = server_update.args
     
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        for port in reserved_ports + ([auto_port] if auto_port else []):
+            port_allocator.release(port, server_id)
+        if not port_reservations.is_conflict(e):
+            raise
+        raise HTTPException(status_code=409, detail="端口已被其他服务器占用")
+    if requested_ports is not None:
+        # 提交成功后释放不再使用的旧端口
+        for port in port_allocator.ports_of(server_id):
+            if port not in requested_ports:
+                port_allocator.release(port, server_id)
     db.refresh(server)
     return server
 
 @app.delete("/api/servers/{server_id}")
-def delete_server(
+async def delete_server(
     server_id: str,
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
@@ -413,23 +826,19 @@ def delete_server(
     if not server:
         raise HTTPException(status_code=404, detail="Server not found")
 
-    # 1. 停止容器
-    if server.container_id:
-        try:
-            docker_manager.stop_container(server.container_id)
-        except Exception as e:
-            logger.warning(f"Failed to stop container during delete: {e}")
+    # 与启动/停止等操作一样经任务队列执行：持有服务器锁和租约，不与进行中的操作并发
+    job, _ = job_manager.submit(server_id, "delete")
+    await job_manager.wait(job)
+    if job.state == JobState.FAILED:
+        raise HTTPException(status_code=job.status_code or 500, detail=job.error)
+    return job.result
 
-    # 2. 删除文件 (可选: 如果需要保留数据则注释掉)
-    # shutil.rmtree(server.source_code_path, ignore_errors=True)
-
-    # 3. 删除数据库记录
-    db.delete(server)
-    db.commit()
-    return {"message": "Server deleted"}
+def start_options(request) -> dict:
+    """启动类操作的就绪等待选项"""
+    return {"wait_ready": request.wait_ready, "ready_timeout": request.ready_timeout, "ready_probe": request.ready_probe}
 
 @app.post("/api/servers/{server_id}/action")
-def server_action(
+async def server_action(
     server_id: str, 
     action: schemas.ServerAction, 
     db: Session = Depends(get_db),
@@ -438,246 +847,254 @@ def server_action(
     server = db.query(models.MCPServer).filter(models.MCPServer.id == server_id).first()
     if not server:
         raise HTTPException(status_code=404, detail="Server not found")
+    if action.action not in lifecycle.ACTIONS:
+        return {"message": "Action not supported"}
 
-    if action.action == "start":
-        if server.status == models.ServerStatus.RUNNING:
-            return {"message": "Already running"}
-        
-        env_map = {env.key: env.value for env in server.env_vars}
-        
-        # 解析 args
-        cmd_list = None
-        if server.command:
-            cmd_list = [server.command]
-            if server.args:
-                # 简单的空格分割，更复杂的需要 json 解析
-                try:
-                    args = json.loads(server.args)
-                    if isinstance(args, list):
-                        cmd_list.extend(args)
-                    else:
-                        cmd_list.extend(server.args.split())
-                except:
-                    cmd_list.extend(server.args.split())
-
-        # 解析端口列表
-        requested_ports = None
-        if server.ports:
-            try:
-                # 支持逗号分隔的端口列表
-                requested_ports = [int(p.strip()) for p in server.ports.split(',') if p.strip()]
-            except ValueError:
-                logger.warning(f"Failed to parse ports: {server.ports}")
+    # 同步接口：提交任务并等待完成（重复请求会合并到同一个任务）
+    job, _ = job_manager.submit(server_id, action.action, start_options(action))
+    await job_manager.wait(job)
+    if job.state == JobState.FAILED:
+        raise HTTPException(status_code=job.status_code or 500, detail=job.error)
+    return job.result
 
-        try:
-            # 传递 source_code_path 和 requested_ports 给 run_container
-            result = docker_manager.run_container(
-                server.id, 
-                server.name, 
-                server.source_code_path, 
-                env_map,
-                requested_ports=requested_ports,
-                command=cmd_list,
-                image=server.image or "corp/mcp-base:latest"
-            )
-            
-            server.container_id = result["container_id"]
-            server.host_port = result["port"]
-            # 保存端口映射信息
-            if "ports" in result:
-                server.host_ports = json.dumps(result["ports"])
-            server.status = models.ServerStatus.RUNNING
-            db.commit()
-            return {"message": "Server started", "details": result}
-        except RuntimeError as e:
-            # Docker 相关的运行时错误（如 Docker 未启动、端口占用等）
-            server.status = models.ServerStatus.ERROR
-            db.commit()
-            error_msg = str(e)
-            if "Docker client not initialized" in error_msg or "Docker not running" in error_msg:
-                raise HTTPException(
-                    status_code=503, 
-                    detail="Docker service is not running. Please start Docker and try again."
-                )
-            elif "port" in error_msg.lower() and "not available" in error_msg.lower():
-                raise HTTPException(
-                    status_code=409, 
-                    detail=f"Port conflict: {error_msg}"
-                )
+@app.post("/api/servers/{server_id}/jobs", status_code=202)
+async def submit_server_job(
+    server_id: str,
+    action: schemas.ServerAction,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """异步提交生命周期操作，立即返回任务 ID"""
+    server = db.query(models.MCPServer).filter(models.MCPServer.id == server_id).first()
+    if not server:
+        raise HTTPException(status_code=404, detail="Server not found")
+    if action.action not in lifecycle.ACTIONS:
+        raise HTTPException(status_code=400, detail=f"Unsupported action: {action.action}")
+
+    job, coalesced = job_manager.submit(server_id, action.action, start_options(action))
+    return {**job.to_dict(), "coalesced": coalesced}
+
+@app.get("/api/servers/{server_id}/jobs")
+def list_server_jobs(server_id: str, current_user = Depends(get_current_user)):
+    """获取服务器最近的生命周期任务"""
+    return [job.to_dict() for job in job_manager.list_for_server(server_id)]
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str, current_user = Depends(get_current_user)):
+    """获取任务状态和进度"""
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.post("/api/servers/bulk-action")
+async def bulk_server_action(
+    request: schemas.BulkServerAction,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    批量执行生命周期操作
+    按 ids / image / name_pattern 选择服务器，以有限并发执行，
+    以 NDJSON 流的形式逐条返回每个服务器的进度
+    """
+    if request.action not in lifecycle.ACTIONS:
+        raise HTTPException(status_code=400, detail=f"Unsupported action: {request.action}")
+    if not (request.ids or request.image or request.name_pattern):
+        raise HTTPException(status_code=400, detail="请至少指定 ids、image 或 name_pattern 之一")
+
+    query = db.query(models.MCPServer.id, models.MCPServer.name)
+    if request.ids:
+        query = query.filter(models.MCPServer.id.in_(request.ids))
+    if request.image:
+        query = query.filter(models.MCPServer.image == request.image)
+    targets = [
+        (server_id, name) for server_id, name in query.order_by(models.MCPServer.name).all()
+        if not request.name_pattern or fnmatch.fnmatchcase(name, request.name_pattern)
+    ]
+    parallelism = max(1, min(request.parallelism, BULK_MAX_PARALLELISM))
+
+    async def run_one(server_id: str, name: str, semaphore: asyncio.Semaphore, events: asyncio.Queue):
+        async with semaphore:
+            # 通过任务队列执行，请求断开后任务仍会继续执行完毕
+            job, _ = job_manager.submit(server_id, request.action, start_options(request))
+            await events.put({"event": "started", "server_id": server_id, "name": name, "job_id": job.id})
+            await job_manager.wait(job)
+            if job.state == JobState.FAILED:
+                await events.put({
+                    "event": "failed", "server_id": server_id, "name": name, "job_id": job.id,
+                    "status_code": job.status_code, "message": job.error
+                })
             else:
-                raise HTTPException(status_code=500, detail=f"Failed to start server: {error_msg}")
-        except Exception as e:
-            # 其他未预期的错误
-            server.status = models.ServerStatus.ERROR
-            db.commit()
-            logger.error(f"Unexpected error starting server {server_id}: {e}", exc_info=True)
-            raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+                await events.put({
+                    "event": "succeeded", "server_id": server_id, "name": name, "job_id": job.id,
+                    "message": (job.result or {}).get("message"),
+                    "details": (job.result or {}).get("details")
+                })
 
-    elif action.action == "stop":
-        if server.container_id:
-            try:
-                docker_manager.stop_container(server.container_id)
-            except Exception:
-                pass
-        
-        server.status = models.ServerStatus.STOPPED
-        server.container_id = None
-        server.host_port = None
-        db.commit()
-        return {"message": "Server stopped"}
-        
-    elif action.action == "remove_container":
-        # 只删除容器，保留数据
-        if server.container_id:
-            try:
-                docker_manager.stop_container(server.container_id)
-                logger.info(f"Container {server.container_id} removed for server {server_id}")
-            except Exception as e:
-                logger.warning(f"Failed to remove container: {e}")
-        
-        server.status = models.ServerStatus.STOPPED
-        server.container_id = None
-        server.host_port = None
-        db.commit()
-        return {"message": "Container removed, data preserved"}
-    
-    elif action.action == "rebuild":
-        # 强制重建：删除容器 + 重新启动
-        if server.container_id:
-            try:
-                docker_manager.stop_container(server.container_id)
-            except Exception as e:
-                logger.warning(f"Failed to stop container during rebuild: {e}")
-        
-        server.status = models.ServerStatus.STOPPED
-        server.container_id = None
-        server.host_port = None
-        db.commit()
-        
-        # 重新启动（复用启动逻辑）
-        env_map = {env.key: env.value for env in server.env_vars}
-        
-        cmd_list = None
-        if server.command:
-            cmd_list = [server.command]
-            if server.args:
-                try:
-                    args = json.loads(server.args)
-                    if isinstance(args, list):
-                        cmd_list.extend(args)
-                    else:
-                        cmd_list.extend(server.args.split())
-                except:
-                    cmd_list.extend(server.args.split())
-        
-        requested_ports = None
-        if server.ports:
-            try:
-                requested_ports = [int(p.strip()) for p in server.ports.split(',') if p.strip()]
-            except ValueError:
-                logger.warning(f"Failed to parse ports: {server.ports}")
-        
+    async def stream():
+        events: asyncio.Queue = asyncio.Queue()
+        semaphore = asyncio.Semaphore(parallelism)
+        yield json.dumps({
+            "event": "accepted", "action": request.action, "total": len(targets),
+            "parallelism": parallelism, "servers": [{"server_id": i, "name": n} for i, n in targets]
+        }, ensure_ascii=False) + "\n"
+        tasks = [asyncio.create_task(run_one(i, n, semaphore, events)) for i, n in targets]
+        succeeded = failed = 0
+        while succeeded + failed < len(tasks):
+            event = await events.get()
+            if event["event"] == "succeeded":
+                succeeded += 1
+            elif event["event"] == "failed":
+                failed += 1
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+        yield json.dumps({"event": "finished", "succeeded": succeeded, "failed": failed}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+# SSE 空闲时发送心跳的间隔（秒），避免被代理断开
+LOG_SSE_HEARTBEAT = 15.0
+
+def get_log_container_id(server_id: str) -> str:
+    """查询服务器当前的容器 ID（不在整个日志流期间占用数据库会话）"""
+    db = SessionLocal()
+    try:
+        server = db.query(models.MCPServer).filter(models.MCPServer.id == server_id).first()
+        if not server:
+            raise HTTPException(status_code=404, detail="Server not found")
+        if not server.container_id:
+            raise HTTPException(status_code=409, detail="Server has no container")
+        return server.container_id
+    finally:
+        db.close()
+
+def format_log_line(entry, timestamps: bool) -> str:
+    ts, time_text, line = entry
+    return f"{time_text} {line}" if timestamps and time_text else line
+
+@app.get("/api/servers/{server_id}/logs")
+async def stream_server_logs(
+    server_id: str,
+    request: Request,
+    tail: Optional[int] = 100,
+    since: Optional[float] = None,
+    timestamps: bool = False,
+    current_user = Depends(get_stream_user)
+):
+    """
+    以 SSE 推送容器日志
+    事件 id 为日志时间，断线重连时通过 Last-Event-ID 从断点继续
+    """
+    container_id = get_log_container_id(server_id)
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id:
+        since = parse_log_time(last_event_id) or since
+        tail = None
+
+    subscription = await log_hub.subscribe(container_id, tail=tail, since=since)
+
+    async def stream():
         try:
-            result = docker_manager.run_container(
-                server_id=server.id,
-                server_name=server.name,
-                host_base_path=server.source_code_path,
-                env_vars=env_map,
-                requested_ports=requested_ports,
-                command=cmd_list,
-                image=server.image or "corp/mcp-base:latest"
-            )
-            
-            server.container_id = result['container_id']
-            server.host_port = result['port']
-            server.host_ports = json.dumps(result.get('ports', {}))
-            server.status = models.ServerStatus.RUNNING
-            db.commit()
-            
-            return {"message": "Server rebuilt successfully", "port": result['port']}
-        except Exception as e:
-            server.status = models.ServerStatus.ERROR
-            db.commit()
-            raise HTTPException(status_code=500, detail=f"Failed to rebuild: {str(e)}")
-        
-    elif action.action == "restart":
-        # 简化版重启：先停后起
-        # 1. Stop
-        if server.container_id:
-            try:
-                docker_manager.stop_container(server.container_id)
-            except Exception:
-                pass
-        server.status = models.ServerStatus.STOPPED
-        server.container_id = None
-        server.host_port = None
-        db.commit()
-        
-        # 2. Start
-        env_map = {env.key: env.value for env in server.env_vars}
-        
-        # 解析 args (同上)
-        cmd_list = None
-        if server.command:
-            cmd_list = [server.command]
-            if server.args:
+            while True:
                 try:
-                    args = json.loads(server.args)
-                    if isinstance(args, list):
-                        cmd_list.extend(args)
-                    else:
-                        cmd_list.extend(server.args.split())
-                except:
-                    cmd_list.extend(server.args.split())
-
-        # 解析端口列表
-        requested_ports = None
-        if server.ports:
-            try:
-                requested_ports = [int(p.strip()) for p in server.ports.split(',') if p.strip()]
-            except ValueError:
-                logger.warning(f"Failed to parse ports: {server.ports}")
+                    entry = await asyncio.wait_for(subscription.get(), LOG_SSE_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if entry is None:
+                    if subscription.stream.error:
+                        yield f"event: error\ndata: {subscription.stream.error}\n\n"
+                    yield "event: end\ndata: \n\n"
+                    return
+                event_id = f"id: {entry[1]}\n" if entry[1] else ""
+                yield f"{event_id}data: {format_log_line(entry, timestamps)}\n\n"
+        finally:
+            log_hub.unsubscribe(subscription)
 
-        try:
-            result = docker_manager.run_container(
-                server.id, 
-                server.name, 
-                server.source_code_path, 
-                env_map,
-                requested_ports=requested_ports,
-                command=cmd_list,
-                image=server.image or "corp/mcp-base:latest"
-            )
-            server.container_id = result["container_id"]
-            server.host_port = result["port"]
-            if "ports" in result:
-                server.host_ports = json.dumps(result["ports"])
-            server.status = models.ServerStatus.RUNNING
-            db.commit()
-            return {"message": "Server restarted", "details": result}
-        except RuntimeError as e:
-            server.status = models.ServerStatus.ERROR
-            db.commit()
-            error_msg = str(e)
-            if "Docker client not initialized" in error_msg or "Docker not running" in error_msg:
-                raise HTTPException(
-                    status_code=503, 
-                    detail="Docker service is not running. Please start Docker and try again."
-                )
-            elif "port" in error_msg.lower() and "not available" in error_msg.lower():
-                raise HTTPException(
-                    status_code=409, 
-                    detail=f"Port conflict: {error_msg}"
-                )
-            else:
-                raise HTTPException(status_code=500, detail=f"Failed to restart server: {error_msg}")
-        except Exception as e:
-            server.status = models.ServerStatus.ERROR
-            db.commit()
-            logger.error(f"Unexpected error restarting server {server_id}: {e}", exc_info=True)
-            raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/servers/{server_id}/logs/search")
+def search_server_logs(
+    server_id: str,
+    q: Optional[str] = None,
+    regex: bool = False,
+    ignore_case: bool = False,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    limit: int = 200,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    检索已持久化的日志（包括已删除容器的日志）
+    since/until 为 Unix 时间，只解压时间范围内的分段
+    """
+    server = db.query(models.MCPServer).filter(models.MCPServer.id == server_id).first()
+    if not server:
+        raise HTTPException(status_code=404, detail="Server not found")
+    store = log_capture.store(server_id)
+    try:
+        result = store.search(
+            pattern=q, regex=regex, ignore_case=ignore_case,
+            since=since, until=until, limit=max(1, min(limit, 5000))
+        )
+    except re.error as e:
+        raise HTTPException(status_code=400, detail=f"Invalid regex: {e}")
+    result["storage"] = store.stats()
+    return result
+
+@app.websocket("/api/servers/{server_id}/logs")
+async def websocket_server_logs(
+    websocket: WebSocket,
+    server_id: str,
+    token: Optional[str] = None,
+    tail: Optional[int] = 100,
+    since: Optional[float] = None,
+    timestamps: bool = False
+):
+    """以 WebSocket 推送容器日志，每条消息为一行日志（token 通过查询参数传递）"""
+    if authenticate_token(token) is None:
+        await websocket.close(code=4401)
+        return
+    try:
+        container_id = get_log_container_id(server_id)
+    except HTTPException as e:
+        await websocket.close(code=4000 + e.status_code, reason=e.detail)
+        return
+    await websocket.accept()
+    subscription = await log_hub.subscribe(container_id, tail=tail, since=since)
+
+    async def pump():
+        while True:
+            entry = await subscription.get()
+            if entry is None:
+                if subscription.stream.error:
+                    await websocket.send_text(f"Error reading logs: {subscription.stream.error}")
+                return
+            await websocket.send_text(format_log_line(entry, timestamps))
 
-    return {"message": "Action not supported"}
+    async def watch_disconnect():
+        # 客户端不发送数据，只需感知断开
+        while True:
+            await websocket.receive_text()
+
+    tasks = [asyncio.create_task(pump()), asyncio.create_task(watch_disconnect())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        log_hub.unsubscribe(subscription)
+    try:
+        await websocket.close()
+    except Exception:
+        pass
 
 @app.get("/api/system/version")
 def get_version():
@@ -692,107 +1109,105 @@ def get_version():
 def get_port_pool_status(db: Session = Depends(get_db), current_user = Depends(get_current_user)):
     """获取端口池状态：可用端口范围、已分配端口等信息"""
     try:
-        # 端口池配置
-        PORT_POOL_START = 30000
-        PORT_POOL_END = 40000
-        
-        # 获取所有服务器（包括未启动的）及其分配的端口
-        servers = db.query(models.MCPServer).all()
-        
-        allocated_ports = []  # 已分配的端口
+        # 端口预留按端口索引顺序读取，每个端口只属于一个服务器
+        rows = db.query(
+            models.PortReservation.port,
+            models.PortReservation.container_port,
+            models.PortReservation.server_id,
+            models.MCPServer.name,
+            models.MCPServer.status,
+        ).join(models.MCPServer).order_by(models.PortReservation.port).all()
+
         port_assignments = []
+        for port, container_port, server_id, server_name, server_status in rows:
+            port_assignments.append({
+                "server_id": server_id,
+                "server_name": server_name,
+                "port": port,
+                "container_port": container_port,
+                "status": server_status.value,
+                "is_allocated": True,
+                "is_running": server_status == models.ServerStatus.RUNNING
+            })
+
+        # 数量和碎片统计由分配器随占用/释放增量维护（包含预热容器和系统占用的端口）
+        pool_stats = port_allocator.stats()
         
-        for server in servers:
-            # 收集分配的端口（ports 字段）
-            if server.ports:
-                try:
-                    ports_list = [int(p.strip()) for p in server.ports.split(',') if p.strip()]
-                    for port in ports_list:
-                        if port not in allocated_ports:
-                            allocated_ports.append(port)
-                        port_assignments.append({
-                            "server_id": server.id,
-                            "server_name": server.name,
-                            "port": port,
-                            "status": server.status.value,
-                            "is_allocated": True
-                        })
-                except (ValueError, AttributeError):
-                    pass
-            
-            # 收集运行时端口（host_port 和 host_ports）
-            if server.host_port and server.host_port not in allocated_ports:
-                allocated_ports.append(server.host_port)
-                # 如果已经在 port_assignments 中，更新状态
-                found = False
-                for assignment in port_assignments:
-                    if assignment["port"] == server.host_port and assignment["server_id"] == server.id:
-                        assignment["is_running"] = True
-                        found = True
-                        break
-                if not found:
-                    port_assignments.append({
-                        "server_id": server.id,
-                        "server_name": server.name,
-                        "port": server.host_port,
-                        "status": server.status.value,
-                        "is_allocated": True,
-                        "is_running": True
-                    })
-            
-            # 收集额外的运行时端口
-            if server.host_ports:
-                try:
-                    ports_map = json.loads(server.host_ports)
-                    for container_port, host_port in ports_map.items():
-                        if host_port not in allocated_ports:
-                            allocated_ports.append(host_port)
-                        port_assignments.append({
-                            "server_id": server.id,
-                            "server_name": server.name,
-                            "port": host_port,
-                            "container_port": int(container_port),
-                            "status": server.status.value,
-                            "is_allocated": True,
-                            "is_running": True
-                        })
-                except json.JSONDecodeError:
-                    pass
-        
-        # 计算可用端口数
-        # 实际可用端口 = 总端口数 - 已分配端口数
-        total_ports = PORT_POOL_END - PORT_POOL_START
-        available_ports_count = total_ports - len(allocated_ports)
-        
-        # 只检查前20个未分配的端口作为示例
-        sample_available_ports = []
-        checked_count = 0
-        for port in range(PORT_POOL_START, PORT_POOL_END):
-            if port not in allocated_ports:
-                if docker_manager._is_port_free(port):
-                    sample_available_ports.append(port)
-                    if len(sample_available_ports) >= 20:
-                        break
-                checked_count += 1
-                if checked_count >= 100:  # 最多检查100个端口
-                    break
+        # 可用端口示例直接取自分配器的空闲区间树，不做探测
+        sample_available_ports = port_allocator.sample_free(20)
         
         return {
             "port_pool_start": PORT_POOL_START,
             "port_pool_end": PORT_POOL_END,
-            "total_ports": total_ports,
-            "allocated_ports_count": len(allocated_ports),  # 改为 allocated
-            "available_ports_count": available_ports_count,
-            "allocated_ports": sorted(allocated_ports),  # 改为 allocated
-            "port_assignments": sorted(port_assignments, key=lambda x: x["port"]),
+            **pool_stats,
+            "allocated_ports": [row["port"] for row in port_assignments],
+            "port_assignments": port_assignments,
             "sample_available_ports": sample_available_ports
         }
     except Exception as e:
         logger.error(f"Error getting port pool status: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to get port pool status: {str(e)}")
 
+@app.get("/api/system/code-store")
+def get_code_store_stats(current_user = Depends(get_current_user)):
+    """代码对象库统计：stored_bytes 为实际占用，logical_bytes 为去重前的总大小"""
+    return code_store.stats()
+
+@app.post("/api/system/code-store/gc")
+def gc_code_store(current_user = Depends(get_current_user)):
+    """回收没有被任何服务器引用的代码对象"""
+    return code_store.gc()
+
+@app.get("/api/system/wheelhouse")
+def get_wheelhouse_stats(current_user = Depends(get_current_user)):
+    """共享 wheelhouse 统计：wheel 数量、占用大小和最近一次预取结果"""
+    return wheelhouse.stats()
+
+@app.post("/api/system/wheelhouse/prefetch", status_code=202)
+def prefetch_wheelhouse(current_user = Depends(get_current_user)):
+    """立即在后台执行一次依赖预取"""
+    if not wheelhouse.enabled:
+        raise HTTPException(status_code=409, detail="Wheelhouse prefetch is disabled (WHEELHOUSE_PREFETCH_ENABLED)")
+    wheelhouse.schedule()
+    return {"message": "Prefetch scheduled"}
+
+@app.get("/api/system/start-latency")
+def get_start_latency(
+    limit: int = 20,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """按最近一次启动总耗时从高到低列出服务器，用于定位启动慢的服务器"""
+    rows = []
+    for server_id, name, image, timings in db.query(
+        models.MCPServer.id, models.MCPServer.name, models.MCPServer.image, models.MCPServer.start_timings
+    ).filter(models.MCPServer.start_timings.isnot(None)).all():
+        try:
+            data = json.loads(timings)
+        except ValueError:
+            continue
+        rows.append({"server_id": server_id, "name": name, "image": image, **data})
+    rows.sort(key=lambda row: row.get("phases", {}).get("total", 0), reverse=True)
+    return rows[:max(1, limit)]
+
+@app.get("/api/system/fleet-version")
+def get_fleet_version(request: Request, response: Response, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
+    """全局版本号：任何服务器、环境变量、配置文件或端口修改后递增，轮询时用于判断是否需要刷新"""
+    version = versioning.fleet_version(db)
+    etag = versioning.make_etag("fleet", version)
+    cached = versioning.not_modified(request, etag)
+    if cached:
+        return cached
+    response.headers["ETag"] = etag
+    return {"version": version}
+
+@app.get("/api/system/docker-executor")
+def get_docker_executor_stats(current_user = Depends(get_current_user)):
+    """获取 Docker 执行线程池的队列深度和调用统计"""
+    return docker_executor.stats()
+
 @app.get("/api/system/status")
-def get_system_status(current_user = Depends(get_current_user)):
+async def get_system_status(current_user = Depends(get_current_user)):
     """获取系统状态：Docker 服务状态、容器、镜像等信息"""
     try:
         if not docker_manager.client:
@@ -804,51 +1219,45 @@ def get_system_status(current_user = Depends(get_current_user)):
                 "platform_version": VERSION
             }
         
-        # 获取所有容器
-        containers = []
-        try:
-            all_containers = docker_manager.client.containers.list(all=True)
-            for container in all_containers:
-                containers.append({
-                    "id": container.id[:12],
-                    "name": container.name,
-                    "image": container.image.tags[0] if container.image.tags else container.image.id[:12],
-                    "status": container.status,
-                    "created": container.attrs.get("Created", ""),
-                    "ports": container.ports
-                })
-        except Exception as e:
-            logger.error(f"Failed to list containers: {e}")
-        
-        # 获取所有镜像
-        images = []
-        try:
-            all_images = docker_manager.client.images.list()
-            for image in all_images:
-                images.append({
-                    "id": image.id.split(':')[1][:12] if ':' in image.id else image.id[:12],
-                    "tags": image.tags,
-                    "size": image.attrs.get("Size", 0),
-                    "created": image.attrs.get("Created", "")
-                })
-        except Exception as e:
-            logger.error(f"Failed to list images: {e}")
-        
-        # 获取 Docker 版本信息
-        docker_version = {}
-        try:
-            docker_version = docker_manager.client.version()
-        except Exception as e:
-            logger.error(f"Failed to get Docker version: {e}")
+        # 直接读取由 Docker events 维护的内存快照；首次同步完成前才查询一次 daemon
+        if not docker_state.ready:
+            await docker_executor.run(docker_state.resync)
+        snapshot = docker_state.snapshot()
+        docker_version = snapshot["version"]
         
         return {
             "docker_available": True,
             "docker_version": docker_version.get("Version", "Unknown"),
             "api_version": docker_version.get("ApiVersion", "Unknown"),
-            "containers": containers,
-            "images": images,
+            "containers": snapshot["containers"],
+            "images": snapshot["images"],
+            "synced_at": snapshot["synced_at"],
+            "docker_executor": docker_executor.stats(),
+            "lifecycle_jobs": job_manager.stats(),
+            "warm_pool": warm_pool.stats(),
+            "log_streams": log_hub.stats(),
+            "log_capture": log_capture.stats(),
+            "dep_layers": dep_layers.stats(),
+            "wheelhouse": wheelhouse.stats(),
+            "bytecode": bytecode_compiler.stats(),
+            "gateway": gateway.stats(),
             "platform_version": VERSION
         }
+    except (DockerBusyError, DockerTimeoutError):
+        raise
     except Exception as e:
         logger.error(f"Error getting system status: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to get system status: {str(e)}")
+
+@app.on_event("shutdown")
+async def close_gateway():
+    await gateway.close()
+
+# 网关路由必须最后注册，避免覆盖平台自身的 /api/* 接口
+@app.api_route("/api/{server_name}/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "HEAD", "OPTIONS"])
+async def gateway_proxy(server_name: str, path: str, request: Request):
+    """
+    MCP 网关：将 /api/{server_name}/sse 等请求转发到对应容器
+    客户端无需直接访问容器的宿主机端口
+    """
+    return await gateway.proxy(request, server_name, path)
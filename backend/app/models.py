@@ -30,8 +30,12 @@ class MCPServer(Base):
     status = Column(Enum(ServerStatus), default=ServerStatus.STOPPED)
     container_id = Column(String, nullable=True) # Docker Container ID
     host_port = Column(Integer, nullable=True) # 分配的宿主机端口（主端口）
-    ports = Column(String, nullable=True) # 用户配置的端口列表（逗号分隔，如 "8000,8001"）
     host_ports = Column(String, nullable=True) # 实际分配的宿主机端口列表（JSON 格式）
+    container_ip = Column(String, nullable=True) # 容器网络模式下容器在 MCP_NETWORK 中的 IP
+    exit_code = Column(Integer, nullable=True) # 容器最近一次退出码（OOM 为 137）
+    exited_at = Column(DateTime, nullable=True) # 容器最近一次退出时间
+    start_timings = Column(String, nullable=True) # 最近一次启动的各阶段耗时（JSON 格式）
+    version = Column(Integer, default=1, nullable=False) # 每次修改（含环境变量、配置文件、端口）递增，用作 ETag
     
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -42,6 +46,18 @@ class MCPServer(Base):
     # 关联配置文件
     config_files = relationship("ConfigFile", back_populates="server", cascade="all, delete-orphan")
 
+    # 关联端口预留（按映射的容器端口排序）
+    port_reservations = relationship(
+        "PortReservation", back_populates="server", cascade="all, delete-orphan",
+        order_by="PortReservation.container_port"
+    )
+
+    @property
+    def ports(self):
+        """用户配置的端口列表（逗号分隔，如 "30001,30002"），由端口预留生成"""
+        configured = [str(r.port) for r in self.port_reservations if r.kind == PortReservation.CONFIGURED]
+        return ",".join(configured) or None
+
 class EnvironmentVariable(Base):
     __tablename__ = "env_vars"
 
@@ -65,4 +81,44 @@ class ConfigFile(Base):
     
     server = relationship("MCPServer", back_populates="config_files")
 
+class PortReservation(Base):
+    """
+    宿主机端口预留，port 唯一索引保证一个端口只属于一个服务器
+    configured：用户配置或自动分配的端口，container_port 按配置顺序从 8000 递增
+    runtime：容器运行时绑定的其他端口（如接管的预热容器端口），容器停止后释放
+    auto_assigned：configured 端口是否由平台自动分配；用户指定的端口固定不变，
+    自动分配的端口在认领预热容器时改为该容器的端口
+    """
+    __tablename__ = "port_reservations"
+
+    CONFIGURED = "configured"
+    RUNTIME = "runtime"
+
+    id = Column(Integer, primary_key=True, index=True)
+    port = Column(Integer, unique=True, index=True, nullable=False)
+    server_id = Column(String, ForeignKey("mcp_servers.id"), index=True, nullable=False)
+    kind = Column(String, default=CONFIGURED)
+    container_port = Column(Integer, nullable=True)
+    auto_assigned = Column(Boolean, default=False, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    server = relationship("MCPServer", back_populates="port_reservations")
+
+
+class FleetState(Base):
+    """全局状态（单行）：version 在任何服务器相关数据修改时递增"""
+    __tablename__ = "fleet_state"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, default=0, nullable=False)
+
+class ServerLease(Base):
+    """服务器生命周期操作租约（跨 uvicorn worker 的互斥锁）"""
+    __tablename__ = "server_leases"
 
+    server_id = Column(String, primary_key=True)
+    owner = Column(String)     # 持有者标识：hostname:pid:随机串
+    action = Column(String)    # 正在执行的操作
+    job_id = Column(String, nullable=True)
+    acquired_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, index=True)
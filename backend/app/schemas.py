@@ -1,8 +1,12 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, computed_field
+from typing import Dict, List, Literal, Optional
+import os
 from datetime import datetime
 from .models import ServerStatus
 
+# 对外暴露的网关地址，用于生成 SSE 连接地址
+GATEWAY_BASE_URL = os.getenv("GATEWAY_BASE_URL", "http://localhost:8000").rstrip("/")
+
 class EnvVarBase(BaseModel):
     key: str
     value: str
@@ -34,6 +38,15 @@ class ConfigFile(ConfigFileBase):
     class Config:
         from_attributes = True
 
+class ConfigFileSummary(BaseModel):
+    """列表中的配置文件只返回文件名，不含内容"""
+    id: int
+    filename: str
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
 class MCPServerBase(BaseModel):
     name: str
     description: Optional[str] = None
@@ -54,31 +67,74 @@ class MCPServerUpdate(BaseModel):
     command: Optional[str] = None
     args: Optional[str] = None
 
-class MCPServer(MCPServerBase):
+class MCPServerSummary(MCPServerBase):
+    """服务器列表的精简结构：不含环境变量和配置文件内容"""
     id: str
     status: ServerStatus
     host_port: Optional[int] = None
     ports: Optional[str] = None
     host_ports: Optional[str] = None
+    container_ip: Optional[str] = None
+    exit_code: Optional[int] = None
+    start_timings: Optional[str] = None  # 最近一次启动的各阶段耗时（JSON 格式）
+    exited_at: Optional[datetime] = None
     command: Optional[str] = None
     args: Optional[str] = None
     created_at: datetime
     updated_at: datetime
-    env_vars: List[EnvVar] = []
-    config_files: List[ConfigFile] = []
-    
-    # 计算属性：SSE 连接地址
+    config_files: List[ConfigFileSummary] = []
+
+    # 计算属性：SSE 连接地址（经平台网关转发，客户端无需访问容器端口）
+    @computed_field
     @property
     def sse_url(self) -> str:
-        # MVP: 假设直接通过 IP:Port 访问，或者通过网关
-        # 这里先返回一个占位符，实际应从配置读取 Gateway Host
-        if self.host_port:
-            return f"http://localhost:{self.host_port}/sse"
+        if self.status == ServerStatus.RUNNING:
+            return f"{GATEWAY_BASE_URL}/api/{self.name}/sse"
         return ""
 
     class Config:
         from_attributes = True
 
+class MCPServer(MCPServerSummary):
+    env_vars: List[EnvVar] = []
+    config_files: List[ConfigFile] = []
+
+class CodeFileEntry(BaseModel):
+    sha256: str
+    size: int = 0
+    exec: bool = False  # 是否可执行
+
+class CodeManifest(BaseModel):
+    """增量上传使用的代码清单：相对路径 -> 文件内容哈希"""
+    files: Dict[str, CodeFileEntry]
+    symlinks: Dict[str, str] = {}
+
+class CodeRelease(BaseModel):
+    id: str
+    created_at: datetime
+    digest: Optional[str] = None  # 清单哈希
+    files: int = 0
+    size: int = 0
+    current: bool = False
+
+class ReleaseRollback(BaseModel):
+    release_id: Optional[str] = None  # 为空时回滚到上一个版本
+
 class ServerAction(BaseModel):
-    action: str  # start, stop, restart
+    action: str  # start, stop, restart, rebuild, remove_container
+    # 启动类操作是否等待服务器就绪（为空时使用 SERVER_WAIT_READY），以及等待的最长秒数
+    wait_ready: Optional[bool] = None
+    ready_timeout: Optional[float] = None
+    ready_probe: Optional[Literal["http", "tcp"]] = None  # 就绪探测方式，tcp 用于不提供 HTTP 的自定义命令
+
+class BulkServerAction(BaseModel):
+    action: str
+    # 服务器选择条件（多个条件同时生效）
+    ids: Optional[List[str]] = None
+    image: Optional[str] = None
+    name_pattern: Optional[str] = None  # 通配符，如 "mysql-*"
+    parallelism: int = 4
+    wait_ready: Optional[bool] = None
+    ready_timeout: Optional[float] = None
+    ready_probe: Optional[Literal["http", "tcp"]] = None
 
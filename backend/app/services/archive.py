@@ -0,0 +1,151 @@
+"""
+上传代码包的解压
+
+- 只有 tar / tar.gz 是流式解压：以流模式（r|*）直接读取上传文件对象，不再先复制一份压缩包
+- zip 需要随机访问，不能流式解压，读取的是上传时的临时文件（SpooledTemporaryFile，
+  超过内存阈值时已落盘），压缩包在磁盘上仍有一份
+- 解压过程中限制总大小、文件数和压缩比，超限立即中止，防止压缩炸弹占满磁盘
+"""
+import os
+import stat
+import tarfile
+import zipfile
+import logging
+from typing import BinaryIO, Dict
+
+logger = logging.getLogger(__name__)
+
+# 解压后的总大小上限（字节）、文件数上限、压缩比上限
+MAX_EXTRACTED_BYTES = int(os.getenv("UPLOAD_MAX_EXTRACTED_BYTES", str(500 * 1024 * 1024)))
+MAX_FILES = int(os.getenv("UPLOAD_MAX_FILES", "20000"))
+MAX_COMPRESSION_RATIO = float(os.getenv("UPLOAD_MAX_COMPRESSION_RATIO", "100"))
+
+# 解压量低于该值时不检查压缩比（小文件的压缩比可能很高）
+RATIO_CHECK_THRESHOLD = 1024 * 1024
+
+CHUNK_SIZE = 1024 * 1024
+
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz")
+
+
+class ArchiveError(ValueError):
+    """压缩包无效或超出限制"""
+
+
+class _CountingReader:
+    """记录已从上传文件中读取的字节数，用于计算压缩比"""
+
+    def __init__(self, fileobj: BinaryIO):
+        self.fileobj = fileobj
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+class _Limits:
+    def __init__(self, compressed_size=None):
+        self.files = 0
+        self.bytes = 0
+        self.compressed_size = compressed_size
+
+    def add_file(self):
+        self.files += 1
+        if self.files > MAX_FILES:
+            raise ArchiveError(f"压缩包文件数超过上限 {MAX_FILES}")
+
+    def add_bytes(self, count: int):
+        self.bytes += count
+        if self.bytes > MAX_EXTRACTED_BYTES:
+            raise ArchiveError(f"解压后大小超过上限 {MAX_EXTRACTED_BYTES // (1024 * 1024)}MB")
+        compressed = self.compressed_size() if callable(self.compressed_size) else self.compressed_size
+        if compressed and self.bytes > RATIO_CHECK_THRESHOLD and self.bytes / compressed > MAX_COMPRESSION_RATIO:
+            raise ArchiveError(f"压缩比超过上限 {MAX_COMPRESSION_RATIO:g}")
+
+
+def _safe_target(dest: str, name: str) -> str:
+    """拒绝绝对路径和 .. 等逃逸出目标目录的路径"""
+    target = os.path.realpath(os.path.join(dest, name))
+    root = os.path.realpath(dest)
+    if os.path.isabs(name) or (target != root and not target.startswith(root + os.sep)):
+        raise ArchiveError(f"压缩包包含非法路径: {name}")
+    return target
+
+
+def _copy_limited(src: BinaryIO, target: str, limits: _Limits, mode: int = 0o644):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, "wb") as out:
+        while True:
+            chunk = src.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            limits.add_bytes(len(chunk))
+            out.write(chunk)
+    os.chmod(target, (mode & 0o777) | stat.S_IRUSR | stat.S_IWUSR)
+
+
+def extract_tar_stream(fileobj: BinaryIO, dest: str) -> Dict:
+    reader = _CountingReader(fileobj)
+    limits = _Limits(compressed_size=lambda: reader.bytes_read)
+    try:
+        with tarfile.open(fileobj=reader, mode="r|*") as tar:
+            for member in tar:
+                target = _safe_target(dest, member.name)
+                if member.isdir():
+                    os.makedirs(target, exist_ok=True)
+                elif member.isfile():
+                    limits.add_file()
+                    _copy_limited(tar.extractfile(member), target, limits, member.mode)
+                elif member.issym():
+                    limits.add_file()
+                    # 链接目标也必须位于目录内
+                    _safe_target(dest, os.path.join(os.path.dirname(member.name), member.linkname))
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    os.symlink(member.linkname, target)
+                # 硬链接和设备文件等直接忽略
+    except tarfile.TarError as e:
+        raise ArchiveError(f"Invalid tar file: {e}")
+    return {"files": limits.files, "bytes": limits.bytes}
+
+
+def extract_zip(fileobj: BinaryIO, dest: str) -> Dict:
+    try:
+        with zipfile.ZipFile(fileobj) as zf:
+            infos = zf.infolist()
+            compressed = sum(info.compress_size for info in infos) or 1
+            limits = _Limits(compressed_size=compressed)
+            # 先按目录中声明的大小做一次快速检查，再在解压时按实际字节数检查
+            declared = sum(info.file_size for info in infos)
+            if declared > MAX_EXTRACTED_BYTES:
+                raise ArchiveError(f"解压后大小超过上限 {MAX_EXTRACTED_BYTES // (1024 * 1024)}MB")
+            for info in infos:
+                target = _safe_target(dest, info.filename)
+                if info.is_dir():
+                    os.makedirs(target, exist_ok=True)
+                    continue
+                limits.add_file()
+                mode = (info.external_attr >> 16) or 0o644
+                with zf.open(info) as src:
+                    _copy_limited(src, target, limits, mode)
+    except zipfile.BadZipFile:
+        raise ArchiveError("Invalid zip file")
+    return {"files": limits.files, "bytes": limits.bytes}
+
+
+def extract_upload(fileobj: BinaryIO, filename: str, dest: str) -> Dict:
+    """
+    将上传的代码文件解压（或保存）到 dest
+    非压缩包按原文件名保存；超出限制或格式错误时抛出 ArchiveError，已写入的内容由调用方清理
+    """
+    os.makedirs(dest, exist_ok=True)
+    name = filename.lower()
+    if name.endswith(".zip"):
+        return extract_zip(fileobj, dest)
+    if name.endswith(TAR_SUFFIXES):
+        return extract_tar_stream(fileobj, dest)
+    limits = _Limits()
+    limits.add_file()
+    _copy_limited(fileobj, _safe_target(dest, os.path.basename(filename)), limits)
+    return {"files": 1, "bytes": limits.bytes}
@@ -0,0 +1,113 @@
+"""
+用户代码的字节码预编译
+
+基础镜像设置了 PYTHONDONTWRITEBYTECODE=1，且代码以只读方式挂载，容器每次启动都要重新编译导入的模块。
+代码版本（release）激活后，平台在后台用该服务器的镜像启动一次性容器，把版本目录挂载到与运行时相同的
+/app/user_code 路径执行 compileall，.pyc 写入版本目录的 __pycache__ 中，之后每次启动直接加载。
+
+- 使用 checked-hash 模式：按源文件内容校验，不依赖修改时间，跨文件系统复制后仍然有效
+- 版本目录激活后不再修改，.pyc 与源码始终一致；compileall 以临时文件 + 重命名方式写入，
+  编译过程中启动的容器不会读到写了一半的文件
+- 编译在镜像中的解释器执行，.pyc 的版本标签（cpython-3xx）与运行时一致
+
+未使用 PYTHONPYCACHEPREFIX：设置后解释器只在前缀目录中查找 .pyc，基础镜像和依赖层中已编译好的
+__pycache__ 会全部失效，反而增加启动时间。
+"""
+import os
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from .docker_manager import docker_manager
+
+logger = logging.getLogger(__name__)
+
+LABEL_BYTECODE_COMPILE = "mcp-fleet.bytecode_compile"
+
+COMPILE_COMMAND = [
+    "python", "-m", "compileall", "-q", "-j", "0",
+    "--invalidation-mode", "checked-hash", "/app/user_code",
+]
+
+
+class BytecodeCompiler:
+    def __init__(self, enabled: bool = True, timeout: float = 300, max_workers: int = 2):
+        self.enabled = enabled
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bytecode")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._compiled = 0
+        self._failed = 0
+        self._total_seconds = 0.0
+
+    def submit(self, code_path: str, image: str):
+        """在后台编译代码版本目录"""
+        if not self.enabled or not docker_manager.client:
+            return
+        with self._lock:
+            self._pending += 1
+        self._pool.submit(self._run, os.path.realpath(code_path), image)
+
+    def _run(self, code_path: str, image: str):
+        try:
+            self.compile(code_path, image)
+        except Exception as e:
+            with self._lock:
+                self._failed += 1
+            logger.warning(f"Bytecode compilation of {code_path} failed: {e}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def compile(self, code_path: str, image: str):
+        started_at = time.monotonic()
+        container = docker_manager.client.containers.run(
+            image,
+            command=COMPILE_COMMAND,
+            volumes={code_path: {"bind": "/app/user_code", "mode": "rw"}},
+            # 以平台用户身份运行，.pyc 与版本目录的属主一致
+            user=f"{os.getuid()}:{os.getgid()}",
+            environment={"PYTHONDONTWRITEBYTECODE": ""},
+            labels={LABEL_BYTECODE_COMPILE: os.path.basename(code_path)},
+            network_disabled=True,
+            detach=True,
+        )
+        try:
+            try:
+                result = container.wait(timeout=self.timeout)
+            except Exception:
+                raise RuntimeError(f"timed out after {self.timeout:g}s")
+            # 语法错误的文件会被跳过，其余文件照常编译，不影响代码上传
+            if result.get("StatusCode") != 0:
+                output = container.logs(tail=10).decode("utf-8", errors="replace").strip()
+                logger.info(f"Some files in {code_path} could not be compiled:\n{output}")
+        finally:
+            try:
+                container.remove(force=True)
+            except Exception:
+                pass
+        elapsed = time.monotonic() - started_at
+        with self._lock:
+            self._compiled += 1
+            self._total_seconds += elapsed
+        logger.info(f"Precompiled bytecode for {code_path} in {elapsed:.1f}s")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "pending": self._pending,
+                "compiled": self._compiled,
+                "failed": self._failed,
+                "avg_seconds": round(self._total_seconds / self._compiled, 2) if self._compiled else 0,
+            }
+
+
+# 单例模式
+bytecode_compiler = BytecodeCompiler(
+    enabled=os.getenv("PRECOMPILE_BYTECODE", "true").lower() in ("1", "true", "yes"),
+    timeout=float(os.getenv("PRECOMPILE_TIMEOUT", "300")),
+)
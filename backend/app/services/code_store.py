@@ -0,0 +1,326 @@
+"""
+内容寻址的代码存储
+
+上传的代码按文件计算 sha256，存入 <DATA_ROOT>/.cas/objects/<前两位>/<sha256>，
+各服务器的 app 目录中的文件替换为指向对象的硬链接（跨文件系统时尝试 reflink，最后才复制）。
+内容相同的文件在整个平台只存一份，服务器目录的物化几乎没有开销。
+
+- 对象文件只读（0444 / 可执行文件 0555），可执行位不同的相同内容分别存储，避免共享 inode 时权限冲突
+- 每次入库生成清单（manifest），记录相对路径到对象的映射，保存在服务器目录和 .cas/manifests 中
+- 链接数为 1 的对象没有任何服务器引用，由 gc() 回收（依赖硬链接，.cas 与服务器目录需在同一文件系统）
+- 增量上传的对象在 commit 之前同样没有引用，修改时间在 CODE_STORE_GC_GRACE 秒内的对象不回收
+"""
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import stat
+import re
+import threading
+import time
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 清单保存在代码目录旁边：<目录>.manifest.json
+MANIFEST_SUFFIX = ".manifest.json"
+
+# Linux FICLONE ioctl，用于在支持的文件系统（btrfs/xfs）上创建 reflink
+FICLONE = 0x40049409
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# 超过该时长未完成的上传临时文件在 gc 时删除
+STALE_UPLOAD_SECONDS = 3600
+
+# 无引用对象的保留时间：已上传、尚未 commit 的对象在此期间不被 gc 回收
+UNREFERENCED_GRACE_SECONDS = float(os.getenv("CODE_STORE_GC_GRACE", "3600"))
+
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class ManifestError(ValueError):
+    """清单格式错误或包含非法路径"""
+
+
+def validate_manifest(manifest: Dict):
+    """校验客户端提交的清单：路径必须是目录内的相对路径，哈希必须是 sha256"""
+    paths = list(manifest.get("files", {})) + list(manifest.get("symlinks", {}))
+    for path in paths:
+        normalized = os.path.normpath(path)
+        if not path or os.path.isabs(path) or normalized.startswith("..") or normalized != path.rstrip("/"):
+            raise ManifestError(f"Invalid path in manifest: {path}")
+    for path, entry in manifest.get("files", {}).items():
+        if not SHA256_RE.match(entry.get("sha256", "")):
+            raise ManifestError(f"Invalid sha256 for {path}")
+    for path, target in manifest.get("symlinks", {}).items():
+        resolved = os.path.normpath(os.path.join(os.path.dirname(path), target))
+        if os.path.isabs(target) or resolved.startswith(".."):
+            raise ManifestError(f"Symlink escapes code directory: {path} -> {target}")
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                return digest.hexdigest()
+            digest.update(chunk)
+
+
+def clone_file(src: str, dst: str):
+    """依次尝试硬链接、reflink、复制"""
+    try:
+        os.link(src, dst)
+        return
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+    try:
+        with open(src, "rb") as s, open(dst, "wb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        shutil.copystat(src, dst)
+        return
+    except OSError:
+        pass
+    shutil.copy2(src, dst)
+
+
+class CodeStore:
+    def __init__(self):
+        self.root: Optional[str] = None
+        # 入库与回收互斥，避免回收刚写入、尚未链接的对象
+        self._lock = threading.Lock()
+
+    @property
+    def objects_dir(self) -> str:
+        return os.path.join(self.root, "objects")
+
+    @property
+    def manifests_dir(self) -> str:
+        return os.path.join(self.root, "manifests")
+
+    def start(self, data_root: str, app_paths: Iterable[str] = ()):
+        """设置存储目录；后台将尚未入库的旧服务器目录入库，并回收无引用的对象"""
+        self.root = os.path.join(data_root, ".cas")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.manifests_dir, exist_ok=True)
+        pending = [p for p in app_paths if os.path.isdir(p) and not os.path.exists(self.manifest_path(p))]
+
+        def migrate():
+            for app_path in pending:
+                try:
+                    self.ingest(app_path)
+                except Exception as e:
+                    logger.error(f"Failed to ingest {app_path} into code store: {e}")
+            try:
+                self.gc()
+            except Exception as e:
+                logger.error(f"Code store gc failed: {e}")
+
+        threading.Thread(target=migrate, name="code-store-migrate", daemon=True).start()
+
+    def object_path(self, digest: str, executable: bool = False) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest + (".x" if executable else ""))
+
+    def has(self, digest: str, executable: bool = False) -> bool:
+        return os.path.exists(self.object_path(digest, executable))
+
+    def has_content(self, digest: str) -> bool:
+        return self.has(digest, False) or self.has(digest, True)
+
+    def touch_content(self, digest: str) -> bool:
+        """刷新对象的修改时间（重新开始 gc 保留期），对象不存在时返回 False"""
+        with self._lock:
+            touched = False
+            for executable in (False, True):
+                try:
+                    os.utime(self.object_path(digest, executable))
+                    touched = True
+                except FileNotFoundError:
+                    pass
+            return touched
+
+    def missing(self, manifest: Dict) -> List[str]:
+        """返回对象库中缺少的内容哈希（去重，保持清单顺序）"""
+        seen = set()
+        result = []
+        for entry in manifest["files"].values():
+            digest = entry["sha256"]
+            if digest not in seen:
+                seen.add(digest)
+                if not self.has_content(digest):
+                    result.append(digest)
+        return result
+
+    def ensure_object(self, digest: str, executable: bool):
+        """只有另一种可执行位的对象时，复制出所需权限的对象"""
+        obj = self.object_path(digest, executable)
+        if os.path.exists(obj):
+            return
+        other = self.object_path(digest, not executable)
+        if not os.path.exists(other):
+            raise FileNotFoundError(digest)
+        with self._lock:
+            if not os.path.exists(obj):
+                tmp = f"{obj}.tmp-{threading.get_ident()}"
+                shutil.copyfile(other, tmp)
+                os.chmod(tmp, 0o555 if executable else 0o444)
+                os.replace(tmp, obj)
+
+    def new_blob_path(self) -> str:
+        """上传中的对象先写入临时文件，校验哈希后再通过 put_blob 放入对象库"""
+        os.makedirs(os.path.join(self.objects_dir, "tmp"), exist_ok=True)
+        return os.path.join(self.objects_dir, "tmp", f"upload.tmp-{os.urandom(8).hex()}")
+
+    def put_blob(self, tmp_path: str, digest: str):
+        obj = self.object_path(digest, False)
+        with self._lock:
+            if self.has(digest, False):
+                os.remove(tmp_path)
+                os.utime(obj)
+                return
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            os.chmod(tmp_path, 0o444)
+            os.replace(tmp_path, obj)
+
+    @staticmethod
+    def manifest_path(app_path: str) -> str:
+        """清单保存在代码目录旁边，不会被挂载进容器；app 为版本链接时对应当前版本的清单"""
+        return os.path.realpath(app_path) + MANIFEST_SUFFIX
+
+    # ------------------------------------------------------------------
+    # 入库与物化
+    # ------------------------------------------------------------------
+    def add_file(self, path: str) -> Tuple[str, bool]:
+        """将文件存入对象库，并把原文件替换为指向对象的链接；返回 (sha256, 是否可执行)"""
+        digest = _hash_file(path)
+        executable = bool(os.stat(path).st_mode & stat.S_IXUSR)
+        obj = self.object_path(digest, executable)
+        with self._lock:
+            if not os.path.exists(obj):
+                os.makedirs(os.path.dirname(obj), exist_ok=True)
+                tmp = f"{obj}.tmp-{threading.get_ident()}"
+                clone_file(path, tmp)
+                os.chmod(tmp, 0o555 if executable else 0o444)
+                os.replace(tmp, obj)
+            if not os.path.samefile(path, obj):
+                tmp = f"{path}.cas-tmp"
+                clone_file(obj, tmp)
+                os.replace(tmp, path)
+        return digest, executable
+
+    def ingest(self, app_path: str) -> Dict:
+        """将目录中的所有文件入库，生成并保存清单"""
+        files: Dict[str, Dict] = {}
+        symlinks: Dict[str, str] = {}
+        for dirpath, dirnames, filenames in os.walk(app_path):
+            for name in filenames + [d for d in dirnames if os.path.islink(os.path.join(dirpath, d))]:
+                full = os.path.join(dirpath, name)
+                rel = os.path.relpath(full, app_path)
+                if os.path.islink(full):
+                    symlinks[rel] = os.readlink(full)
+                elif os.path.isfile(full):
+                    digest, executable = self.add_file(full)
+                    files[rel] = {"sha256": digest, "size": os.path.getsize(full), "exec": executable}
+        manifest = {"version": 1, "files": files, "symlinks": symlinks}
+        manifest["digest"] = self.save_manifest(manifest)
+        with open(self.manifest_path(app_path), "w") as f:
+            json.dump(manifest, f)
+        return manifest
+
+    def save_manifest(self, manifest: Dict) -> str:
+        """保存清单到 .cas/manifests，返回清单自身的 sha256"""
+        body = json.dumps(
+            {"version": manifest.get("version", 1), "files": manifest["files"], "symlinks": manifest.get("symlinks", {})},
+            sort_keys=True, separators=(",", ":")
+        ).encode()
+        digest = hashlib.sha256(body).hexdigest()
+        path = os.path.join(self.manifests_dir, f"{digest}.json")
+        if not os.path.exists(path):
+            with open(path + ".tmp", "wb") as f:
+                f.write(body)
+            os.replace(path + ".tmp", path)
+        return digest
+
+    def load_manifest(self, app_path: str) -> Optional[Dict]:
+        try:
+            with open(self.manifest_path(app_path)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def materialize(self, manifest: Dict, dest: str):
+        """按清单用链接构建目录（对象缺失时抛出 FileNotFoundError）"""
+        os.makedirs(dest, exist_ok=True)
+        for rel, entry in manifest["files"].items():
+            target = os.path.join(dest, rel)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            self.ensure_object(entry["sha256"], entry.get("exec", False))
+            clone_file(self.object_path(entry["sha256"], entry.get("exec", False)), target)
+        for rel, link in manifest.get("symlinks", {}).items():
+            target = os.path.join(dest, rel)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.symlink(link, target)
+
+    def checkout(self, dest: str, manifest: Dict) -> Dict:
+        """按清单在 dest 组装代码目录并保存清单；只做链接，不复制文件内容"""
+        self.materialize(manifest, dest)
+        manifest = {"version": 1, "files": manifest["files"], "symlinks": manifest.get("symlinks", {})}
+        manifest["digest"] = self.save_manifest(manifest)
+        with open(self.manifest_path(dest), "w") as f:
+            json.dump(manifest, f)
+        return manifest
+
+    # ------------------------------------------------------------------
+    # 回收与统计
+    # ------------------------------------------------------------------
+    def _iter_objects(self):
+        for prefix in os.listdir(self.objects_dir):
+            prefix_dir = os.path.join(self.objects_dir, prefix)
+            for name in os.listdir(prefix_dir):
+                if ".tmp-" not in name:
+                    yield os.path.join(prefix_dir, name)
+
+    def gc(self) -> Dict:
+        """
+        删除没有被任何服务器目录链接的对象（链接数为 1）和中断的上传临时文件
+        最近 UNREFERENCED_GRACE_SECONDS 秒内写入或上传确认过的对象保留，等待 commit 链接
+        """
+        removed = freed = 0
+        grace_cutoff = time.time() - UNREFERENCED_GRACE_SECONDS
+        tmp_dir = os.path.join(self.objects_dir, "tmp")
+        if os.path.isdir(tmp_dir):
+            expired = time.time() - STALE_UPLOAD_SECONDS
+            for name in os.listdir(tmp_dir):
+                path = os.path.join(tmp_dir, name)
+                if os.stat(path).st_mtime < expired:
+                    os.remove(path)
+        with self._lock:
+            for path in self._iter_objects():
+                st = os.stat(path)
+                if st.st_nlink <= 1 and st.st_mtime < grace_cutoff:
+                    os.remove(path)
+                    removed += 1
+                    freed += st.st_size
+        if removed:
+            logger.info(f"Code store gc removed {removed} objects ({freed} bytes)")
+        return {"removed": removed, "freed_bytes": freed}
+
+    def stats(self) -> Dict:
+        objects = stored = logical = 0
+        for path in self._iter_objects():
+            st = os.stat(path)
+            objects += 1
+            stored += st.st_size
+            # 链接数减去对象自身即为引用次数
+            logical += st.st_size * max(st.st_nlink - 1, 0)
+        return {"objects": objects, "stored_bytes": stored, "logical_bytes": logical}
+
+
+# 单例模式
+code_store = CodeStore()
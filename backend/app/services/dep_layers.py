@@ -0,0 +1,300 @@
+"""
+用户代码的依赖层
+
+用户代码中带有 uv.lock / requirements.txt / pyproject.toml 时，平台在一次性容器中把依赖安装到
+<DATA_ROOT>/.deps/<key>/，启动服务器时以只读方式挂载到 /app/deps 并加入 PYTHONPATH。
+
+- key = sha256(基础镜像 ID + 依赖文件内容)，依赖相同的服务器在整个平台共享同一个依赖层
+- 所有构建共用 <DATA_ROOT>/.deps/.uv-cache 下载缓存，同一个包只下载、构建一次
+- 依赖层先构建到临时目录，成功后重命名为正式目录；同一 key 的并发构建只执行一次
+- 超过 DEPS_LAYER_MAX_AGE_DAYS 天未被使用且没有容器挂载的依赖层在启动时回收
+
+依赖层需通过 DEPS_LAYERS_ENABLED 开启。启动服务器时构建在独立的有界线程池中执行，不占用处理请求的线程池；
+构建失败或超过 DEPS_START_TIMEOUT 秒时按原方式（不挂载依赖层）启动，超时的构建在后台继续，下次启动时使用。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+import docker
+
+from .docker_manager import docker_manager, LABEL_SERVER_ID
+
+logger = logging.getLogger(__name__)
+
+LABEL_DEPS_BUILD = "mcp-fleet.deps_build"
+
+# 容器内的挂载点
+CONTAINER_DEPS_PATH = "/app/deps"
+
+# 依赖文件按优先级检测：有锁文件时按锁文件安装，否则按 requirements.txt，最后按 pyproject.toml 中声明的依赖
+INSTALL_SCRIPTS = {
+    "uv.lock": (
+        "uv export --frozen --no-hashes --no-emit-project --project /src -o /tmp/requirements.txt"
+        " && uv pip install --python python --target /deps -r /tmp/requirements.txt"
+    ),
+    "requirements.txt": "uv pip install --python python --target /deps -r /src/requirements.txt",
+    "pyproject.toml": "uv pip install --python python --target /deps -r /src/pyproject.toml",
+}
+
+# 参与 key 计算的文件（uv.lock 需要同时包含 pyproject.toml）
+KEY_FILES = {
+    "uv.lock": ("pyproject.toml", "uv.lock"),
+    "requirements.txt": ("requirements.txt",),
+    "pyproject.toml": ("pyproject.toml",),
+}
+
+
+def detect_dependencies(code_path: str) -> Optional[str]:
+    """返回用于安装依赖的文件名，没有依赖文件时返回 None"""
+    for name in INSTALL_SCRIPTS:
+        if os.path.isfile(os.path.join(code_path, name)):
+            if name == "uv.lock" and not os.path.isfile(os.path.join(code_path, "pyproject.toml")):
+                continue
+            return name
+    return None
+
+
+class DependencyLayers:
+    def __init__(
+        self,
+        enabled: bool = False,
+        build_timeout: float = 900,
+        start_timeout: float = 300,
+        max_builds: int = 2,
+        max_age_days: float = 30,
+        index_url: str = "",
+    ):
+        self.enabled = enabled
+        self.build_timeout = build_timeout
+        self.start_timeout = start_timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_builds, thread_name_prefix="deps-build")
+        self.max_age_days = max_age_days
+        self.index_url = index_url
+        self.root: Optional[str] = None
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._hits = 0
+        self._builds = 0
+        self._failures = 0
+
+    @property
+    def cache_dir(self) -> str:
+        return os.path.join(self.root, ".uv-cache")
+
+    def start(self, data_root: str):
+        """设置存储目录，并在后台回收长期未使用的依赖层"""
+        self.root = os.path.join(data_root, ".deps")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # 构建容器以镜像中的非 root 用户运行，需要能写入缓存目录
+        os.chmod(self.cache_dir, 0o777)
+
+        def cleanup():
+            try:
+                self.gc()
+            except Exception as e:
+                logger.error(f"Dependency layer gc failed: {e}")
+
+        threading.Thread(target=cleanup, name="deps-gc", daemon=True).start()
+
+    async def prepare(self, code_path: str, image: str) -> Optional[str]:
+        """
+        启动服务器时获取依赖层目录；未启用、没有依赖文件、构建失败或等待超时时返回 None，按原方式启动
+        """
+        if not self.enabled or self.root is None:
+            return None
+        future = asyncio.get_running_loop().run_in_executor(self._pool, self.ensure, code_path, image)
+        # 超时后构建仍在后台执行，结果留给下次启动；这里只取走异常避免未处理的警告
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=self.start_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Dependency layer for {code_path} not ready after {self.start_timeout:g}s, starting without it"
+            )
+        except Exception as e:
+            logger.warning(f"Dependency layer for {code_path} failed, starting without it: {e}")
+        return None
+
+    def layer_key(self, code_path: str, source: str, image_id: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(f"v1\0{image_id}\0{source}\0".encode())
+        for name in KEY_FILES[source]:
+            with open(os.path.join(code_path, name), "rb") as f:
+                digest.update(name.encode() + b"\0" + f.read() + b"\0")
+        return digest.hexdigest()
+
+    def layer_path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def ensure(self, code_path: str, image: str) -> Optional[str]:
+        """
+        返回代码对应的依赖层目录（不存在时构建），代码没有依赖文件时返回 None
+        构建在调用线程中同步执行，失败时抛出 RuntimeError
+        """
+        if self.root is None:
+            return None
+        code_path = os.path.realpath(code_path)
+        source = detect_dependencies(code_path)
+        if source is None:
+            return None
+        if not docker_manager.client:
+            raise RuntimeError("Docker client not initialized")
+
+        try:
+            image_id = docker_manager.client.images.get(image).id
+        except docker.errors.ImageNotFound:
+            image_id = docker_manager.client.images.pull(image).id
+        key = self.layer_key(code_path, source, image_id)
+        path = self.layer_path(key)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if os.path.isdir(path):
+                self._hits += 1
+            else:
+                self._build(key, code_path, source, image)
+            # 元数据的修改时间即最后使用时间，用于回收
+            if os.path.exists(path + ".json"):
+                os.utime(path + ".json")
+            else:
+                with open(path + ".json", "w") as f:
+                    json.dump({"source": source, "image": image}, f)
+        return path
+
+    def _build(self, key: str, code_path: str, source: str, image: str):
+        build_dir = os.path.join(self.root, f".build-{key[:12]}-{uuid.uuid4().hex[:8]}")
+        os.makedirs(build_dir)
+        os.chmod(build_dir, 0o777)
+        environment = {**docker_manager.shared_env, "UV_CACHE_DIR": "/cache", "HOME": "/tmp", "UV_LINK_MODE": "copy"}
+        if self.index_url:
+            environment["UV_INDEX_URL"] = self.index_url
+        logger.info(f"Building dependency layer {key[:12]} from {source} on {image}")
+        started_at = time.monotonic()
+        container = None
+        try:
+            container = docker_manager.client.containers.run(
+                image,
+                command=["sh", "-c", INSTALL_SCRIPTS[source]],
+                volumes={
+                    **docker_manager.shared_volumes,
+                    code_path: {"bind": "/src", "mode": "ro"},
+                    build_dir: {"bind": "/deps", "mode": "rw"},
+                    self.cache_dir: {"bind": "/cache", "mode": "rw"},
+                },
+                environment=environment,
+                labels={LABEL_DEPS_BUILD: key},
+                detach=True,
+            )
+            try:
+                result = container.wait(timeout=self.build_timeout)
+            except Exception:
+                raise RuntimeError(f"Dependency install timed out after {self.build_timeout:g}s")
+            if result.get("StatusCode") != 0:
+                output = container.logs(tail=20).decode("utf-8", errors="replace").strip()
+                raise RuntimeError(f"Dependency install failed ({source}): {output}")
+
+            size = sum(
+                os.path.getsize(os.path.join(dirpath, name))
+                for dirpath, _, filenames in os.walk(build_dir) for name in filenames
+            )
+            os.rename(build_dir, self.layer_path(key))
+            with open(os.path.join(self.root, f"{key}.json"), "w") as f:
+                json.dump({
+                    "image": image,
+                    "source": source,
+                    "created_at": time.time(),
+                    "build_seconds": round(time.monotonic() - started_at, 1),
+                    "size": size,
+                }, f)
+            self._builds += 1
+            logger.info(f"Dependency layer {key[:12]} built in {time.monotonic() - started_at:.1f}s")
+        except Exception:
+            self._failures += 1
+            shutil.rmtree(build_dir, ignore_errors=True)
+            raise
+        finally:
+            if container is not None:
+                try:
+                    container.remove(force=True)
+                except Exception:
+                    pass
+
+    def _layers(self):
+        for name in os.listdir(self.root):
+            if name.endswith(".json"):
+                yield name[:-len(".json")], os.path.join(self.root, name)
+
+    def _mounted_layers(self) -> set:
+        """平台容器当前挂载的依赖层目录"""
+        mounted = set()
+        if not docker_manager.client:
+            return mounted
+        for container in docker_manager.client.containers.list(all=True, filters={"label": LABEL_SERVER_ID}):
+            for mount in container.attrs.get("Mounts") or []:
+                if mount.get("Destination") == CONTAINER_DEPS_PATH:
+                    mounted.add(os.path.realpath(mount.get("Source", "")))
+        return mounted
+
+    def gc(self) -> Dict:
+        """删除超过保留期未使用、且没有容器挂载的依赖层，以及中断的构建目录"""
+        removed = freed = 0
+        cutoff = time.time() - self.max_age_days * 86400
+        mounted = self._mounted_layers()
+        for key, meta_path in list(self._layers()):
+            path = self.layer_path(key)
+            if os.path.getmtime(meta_path) >= cutoff or os.path.realpath(path) in mounted:
+                continue
+            try:
+                with open(meta_path) as f:
+                    freed += json.load(f).get("size", 0)
+            except (OSError, ValueError):
+                pass
+            shutil.rmtree(path, ignore_errors=True)
+            os.remove(meta_path)
+            removed += 1
+        for name in os.listdir(self.root):
+            build_dir = os.path.join(self.root, name)
+            if name.startswith(".build-") and os.path.getmtime(build_dir) < time.time() - self.build_timeout * 2:
+                shutil.rmtree(build_dir, ignore_errors=True)
+        if removed:
+            logger.info(f"Dependency layer gc removed {removed} layers ({freed} bytes)")
+        return {"removed": removed, "freed_bytes": freed}
+
+    def stats(self) -> Dict:
+        layers = size = 0
+        if self.root is not None:
+            for _, meta_path in self._layers():
+                layers += 1
+                try:
+                    with open(meta_path) as f:
+                        size += json.load(f).get("size", 0)
+                except (OSError, ValueError):
+                    pass
+        return {
+            "enabled": self.enabled,
+            "layers": layers,
+            "bytes": size,
+            "hits": self._hits,
+            "builds": self._builds,
+            "failures": self._failures,
+        }
+
+
+# 单例模式
+dep_layers = DependencyLayers(
+    enabled=os.getenv("DEPS_LAYERS_ENABLED", "false").lower() in ("1", "true", "yes"),
+    build_timeout=float(os.getenv("DEPS_BUILD_TIMEOUT", "900")),
+    start_timeout=float(os.getenv("DEPS_START_TIMEOUT", "300")),
+    max_builds=int(os.getenv("DEPS_BUILD_CONCURRENCY", "2")),
+    max_age_days=float(os.getenv("DEPS_LAYER_MAX_AGE_DAYS", "30")),
+    index_url=os.getenv("DEPS_INDEX_URL", ""),
+)
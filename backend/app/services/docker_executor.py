@@ -0,0 +1,124 @@
+import asyncio
+import os
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class DockerBusyError(RuntimeError):
+    """Docker 执行队列已满"""
+
+
+class DockerTimeoutError(RuntimeError):
+    """Docker 调用超时"""
+
+
+class DockerExecutor:
+    """
+    Docker 调用专用的有界线程池
+
+    - 所有 DockerManager 调用都在这里执行，不占用 FastAPI 的默认线程池
+    - 排队任务数超过 max_queue 时直接拒绝（DockerBusyError），避免请求无限堆积
+    - 每次调用都有超时（DockerTimeoutError）；超时后请求立即返回，
+      后台线程里的 Docker 调用会继续执行完毕，但不再有人等待结果
+    """
+
+    def __init__(self, max_workers: int = 8, max_queue: int = 64, default_timeout: float = 30.0):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.default_timeout = default_timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="docker")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._timeouts = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._total_run = 0.0
+
+    def _wrap(self, fn: Callable, args, kwargs, submitted_at: float):
+        started_at = time.monotonic()
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._total_wait += started_at - submitted_at
+        ok = False
+        try:
+            result = fn(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._total_run += time.monotonic() - started_at
+                if ok:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+
+    def submit(self, fn: Callable, *args, **kwargs):
+        """提交到线程池，返回 concurrent.futures.Future"""
+        with self._lock:
+            if self._queued >= self.max_queue:
+                self._rejected += 1
+                raise DockerBusyError("Docker executor queue is full, please retry later")
+            self._queued += 1
+        future = self._pool.submit(self._wrap, fn, args, kwargs, time.monotonic())
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future):
+        # 排队中被取消的任务不会进入 _wrap，需要在这里修正排队计数
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+
+    async def run(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """在线程池中执行 fn，并在 timeout 秒后放弃等待"""
+        future = asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+        try:
+            return await asyncio.wait_for(future, timeout or self.default_timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._timeouts += 1
+            name = getattr(fn, "__name__", repr(fn))
+            logger.warning(f"Docker call {name} timed out after {timeout or self.default_timeout}s")
+            raise DockerTimeoutError(f"Docker call {name} timed out")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            finished = self._completed + self._failed
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "queue_depth": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+                "failed": self._failed,
+                "timeouts": self._timeouts,
+                "rejected": self._rejected,
+                "avg_wait_ms": round(self._total_wait / finished * 1000, 1) if finished else 0.0,
+                "avg_run_ms": round(self._total_run / finished * 1000, 1) if finished else 0.0,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+# 常用调用的超时时间（秒）
+# 启动可能需要拉取镜像，停止本身带有 10 秒的优雅退出等待
+START_TIMEOUT = float(os.getenv("DOCKER_START_TIMEOUT", "120"))
+STOP_TIMEOUT = float(os.getenv("DOCKER_STOP_TIMEOUT", "30"))
+
+# 单例模式（可通过环境变量调整大小）
+docker_executor = DockerExecutor(
+    max_workers=int(os.getenv("DOCKER_EXECUTOR_WORKERS", "8")),
+    max_queue=int(os.getenv("DOCKER_EXECUTOR_QUEUE", "64")),
+    default_timeout=float(os.getenv("DOCKER_CALL_TIMEOUT", "30")),
+)
@@ -1,9 +1,11 @@
 import docker
-import socket
 import os
-from typing import Optional, Dict, List
+import time
+from typing import Optional, Dict, List, Tuple
 import logging
 
+from .port_allocator import port_allocator, PortAllocator
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -11,6 +13,19 @@ logger = logging.getLogger(__name__)
 # 基础镜像名称
 BASE_IMAGE = "corp/mcp-base:latest"
 
+# 平台容器的命名前缀和标签
+CONTAINER_NAME_PREFIX = "mcp-"
+LABEL_SERVER_ID = "mcp-fleet.server_id"
+LABEL_SERVER_NAME = "mcp-fleet.server_name"
+
+# 容器网络模式：设置后容器加入该 bridge 网络，网关直接访问 容器IP:8000，
+# 不再发布宿主机端口（用户指定的固定端口仍会发布）
+CONTAINER_NETWORK = os.getenv("MCP_NETWORK", "")
+CONTAINER_PORT = 8000
+
+def _elapsed_ms(started_at: float) -> int:
+    return round((time.monotonic() - started_at) * 1000)
+
 class DockerManager:
     def __init__(self):
         try:
@@ -18,17 +33,53 @@ class DockerManager:
         except Exception as e:
             logger.warning(f"Failed to connect to Docker daemon: {e}. Docker features will not work.")
             self.client = None
+        # 所有平台容器共享的只读挂载和环境变量（如 wheelhouse）
+        self.shared_volumes: Dict[str, Dict] = {}
+        self.shared_env: Dict[str, str] = {}
+
+    def add_shared_mount(self, host_path: str, container_path: str, env: Optional[Dict[str, str]] = None):
+        """注册一个挂载到所有平台容器的只读目录，之后创建的容器生效"""
+        self.shared_volumes[host_path] = {'bind': container_path, 'mode': 'ro'}
+        self.shared_env.update(env or {})
 
     def _is_port_free(self, port: int) -> bool:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            return s.connect_ex(('localhost', port)) != 0
+        return PortAllocator.probe(port)
+
+    def ensure_network(self) -> str:
+        """确保容器网络存在，返回网络名"""
+        try:
+            self.client.networks.get(CONTAINER_NETWORK)
+        except docker.errors.NotFound:
+            logger.info(f"Creating container network: {CONTAINER_NETWORK}")
+            self.client.networks.create(CONTAINER_NETWORK, driver="bridge")
+        return CONTAINER_NETWORK
 
-    def _find_free_port(self, start_port: int = 30000, end_port: int = 40000) -> Optional[int]:
-        """寻找宿主机可用端口"""
-        for port in range(start_port, end_port):
-            if self._is_port_free(port):
-                return port
-        return None
+    @staticmethod
+    def container_ip(attrs: Dict) -> Optional[str]:
+        """从容器详情或列表摘要中取出在 CONTAINER_NETWORK 中的 IP"""
+        networks = (attrs.get("NetworkSettings") or {}).get("Networks") or {}
+        return (networks.get(CONTAINER_NETWORK) or {}).get("IPAddress") or None
+
+    def list_bound_host_ports(self) -> List[Tuple[int, str]]:
+        """
+        获取宿主机上所有容器实际绑定的端口
+        返回: [(host_port, container_name)]
+        """
+        if not self.client:
+            return []
+        result = []
+        try:
+            # 使用底层 API，一次调用拿到全部容器的端口信息
+            for summary in self.client.api.containers(all=True):
+                names = summary.get("Names") or [""]
+                name = names[0].lstrip("/")
+                for binding in summary.get("Ports") or []:
+                    public_port = binding.get("PublicPort")
+                    if public_port:
+                        result.append((int(public_port), name))
+        except Exception as e:
+            logger.error(f"Failed to list container port bindings: {e}")
+        return result
 
     def run_container(self, 
                       server_id: str, 
@@ -37,38 +88,52 @@ class DockerManager:
                       env_vars: Dict[str, str], 
                       requested_ports: Optional[List[int]] = None,
                       command: Optional[List[str]] = None,
-                      image: str = BASE_IMAGE) -> Dict:
+                      image: str = BASE_IMAGE,
+                      deps_path: Optional[str] = None) -> Dict:
         """
         启动容器
-        返回: {"container_id": str, "port": int, "ports": Dict[int, int]}
+        返回: {"container_id": str, "port": int, "ports": Dict[int, int], "ip": str, "timings": Dict[str, int]}
+        容器网络模式下未指定端口时不发布宿主机端口，port 为 None，ip 为容器 IP
+        timings 为各阶段耗时（毫秒）：port_allocation、container_create、container_start
         
         :param host_base_path: 宿主机上该 Server 的基础数据目录 (包含 app/ 和 data/)
         :param requested_ports: 用户请求的固定端口列表，如果提供则尝试绑定
         :param command: 可选的自定义启动命令 (override CMD)
+        :param deps_path: 可选的依赖层目录，挂载到 /app/deps 并加入 PYTHONPATH
         """
         if not self.client:
             raise RuntimeError("Docker client not initialized (Docker not running?)")
 
+        timings = {}
+        phase_started = time.monotonic()
+
         # 1. 端口分配逻辑
         port_mappings = {}  # {container_port: host_port}
+        # 调用前已持有的端口（配置端口）不在失败时释放，只释放本次新占用的端口
+        held_ports = set(port_allocator.ports_of(server_id))
         
         if requested_ports and len(requested_ports) > 0:
             # 用户指定了端口列表
             for idx, req_port in enumerate(requested_ports):
                 container_port = 8000 + idx  # 容器内端口从 8000 开始递增
-                if self._is_port_free(req_port):
-                    port_mappings[container_port] = req_port
-                else:
+                if not port_allocator.reserve(req_port, server_id):
+                    self._release_new_ports(server_id, port_mappings.values(), held_ports)
                     raise RuntimeError(f"Requested port {req_port} is not available")
-        else:
-            # 自动分配一个端口
-            port = self._find_free_port()
+                port_mappings[container_port] = req_port
+                if not self._is_port_free(req_port):
+                    self._release_new_ports(server_id, port_mappings.values(), held_ports)
+                    raise RuntimeError(f"Requested port {req_port} is not available")
+        elif not CONTAINER_NETWORK:
+            # 自动分配一个端口（优先复用该服务器已持有的端口，避免重复占用）
+            owned = [p for p in sorted(held_ports) if self._is_port_free(p)]
+            port = owned[0] if owned else port_allocator.allocate(server_id)
             if not port:
                 raise RuntimeError("No free ports available")
             port_mappings[8000] = port
         
         # 主端口（第一个端口）
-        main_port = list(port_mappings.values())[0]
+        main_port = list(port_mappings.values())[0] if port_mappings else None
+        timings["port_allocation"] = _elapsed_ms(phase_started)
 
         # 2. 准备挂载目录路径
         host_app_path = os.path.join(host_base_path, "app")
@@ -79,23 +144,30 @@ class DockerManager:
         os.makedirs(host_data_path, exist_ok=True)
 
         # 3. 准备 Docker 参数
+        # app 是指向当前代码版本的链接，挂载解析后的版本目录，之后切换版本不影响该容器
         volumes = {
-            host_app_path: {'bind': '/app/user_code', 'mode': 'ro'}, # 代码只读
+            **self.shared_volumes,
+            os.path.realpath(host_app_path): {'bind': '/app/user_code', 'mode': 'ro'}, # 代码只读
             host_data_path: {'bind': '/app/data', 'mode': 'rw'}      # 数据持久化
         }
 
-        # 环境变量注入（安全地传递给容器）
-        environment = env_vars.copy()
+        # 环境变量注入（安全地传递给容器），用户配置的变量优先于平台共享变量
+        environment = {**self.shared_env, **env_vars}
         environment["MCP_SERVER_ID"] = server_id
 
+        # 依赖层只读挂载，优先于镜像中已安装的包
+        if deps_path:
+            volumes[deps_path] = {'bind': '/app/deps', 'mode': 'ro'}
+            environment["PYTHONPATH"] = ":".join(p for p in ("/app/deps", environment.get("PYTHONPATH")) if p)
+
         # 构建端口映射字典
         ports_dict = {f"{container_port}/tcp": host_port 
                      for container_port, host_port in port_mappings.items()}
 
         run_kwargs = {
             "image": image,  # 使用传入的镜像参数
-            "name": f"mcp-{server_name}",
-            "detach": True,
+            "name": f"{CONTAINER_NAME_PREFIX}{server_name}",
+            "labels": {LABEL_SERVER_ID: server_id, LABEL_SERVER_NAME: server_name},
             "ports": ports_dict,
             "volumes": volumes,
             "environment": environment,
@@ -107,21 +179,53 @@ class DockerManager:
         if command:
             run_kwargs["command"] = command
 
+        if CONTAINER_NETWORK:
+            run_kwargs["network"] = self.ensure_network()
+
         try:
-            # 4. 启动容器
-            container = self.client.containers.run(**run_kwargs)
-            
-            logger.info(f"Container started: {container.id} with ports {port_mappings}")
+            # 4. 创建并启动容器（分开执行以便分别计时）
+            phase_started = time.monotonic()
+            try:
+                container = self.client.containers.create(**run_kwargs)
+            except docker.errors.ImageNotFound:
+                self.client.images.pull(image)
+                container = self.client.containers.create(**run_kwargs)
+            timings["container_create"] = _elapsed_ms(phase_started)
+
+            phase_started = time.monotonic()
+            try:
+                container.start()
+            except Exception:
+                # 启动失败的容器不保留，避免下次启动时容器名冲突
+                container.remove(force=True)
+                raise
+            timings["container_start"] = _elapsed_ms(phase_started)
+
+            ip = None
+            if CONTAINER_NETWORK:
+                container.reload()
+                ip = self.container_ip(container.attrs)
+            logger.info(f"Container started: {container.id} with ports {port_mappings} ip {ip}")
             return {
                 "container_id": container.id, 
                 "port": main_port,
-                "ports": port_mappings  # {container_port: host_port}
+                "ports": port_mappings,  # {container_port: host_port}
+                "ip": ip,
+                "timings": timings
             }
 
         except Exception as e:
             logger.error(f"Failed to start container: {e}")
+            self._release_new_ports(server_id, port_mappings.values(), held_ports)
             raise e
 
+    @staticmethod
+    def _release_new_ports(server_id: str, ports, held_ports: set):
+        """容器启动失败时释放本次 run_container 新占用的端口"""
+        for port in ports:
+            if port not in held_ports:
+                port_allocator.release(port, server_id)
+
     def stop_container(self, container_id: str):
         if not self.client:
             return
@@ -136,6 +240,18 @@ class DockerManager:
             logger.error(f"Error stopping container: {e}")
             raise e
 
+    def open_log_stream(self, container_id: str, tail="all", since: Optional[float] = None, follow: bool = True):
+        """
+        打开容器日志流（每行带 RFC3339 时间戳前缀）
+        返回的流对象可调用 close() 中断阻塞中的读取
+        """
+        if not self.client:
+            raise RuntimeError("Docker client not initialized")
+        kwargs = {"stream": True, "follow": follow, "timestamps": True, "tail": tail}
+        if since is not None:
+            kwargs["since"] = since
+        return self.client.api.logs(container_id, **kwargs)
+
     def get_logs(self, container_id: str, tail: int = 100):
         if not self.client:
             yield "Docker client not connected"
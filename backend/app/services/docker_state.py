@@ -0,0 +1,244 @@
+import os
+import threading
+import time
+import logging
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from .docker_manager import docker_manager
+
+logger = logging.getLogger(__name__)
+
+# 会触发镜像列表刷新的镜像事件
+IMAGE_REFRESH_ACTIONS = {"pull", "tag", "untag", "delete", "import", "load", "build"}
+
+
+def _short_id(value: str) -> str:
+    if not value:
+        return ""
+    return value.split(':', 1)[1][:12] if ':' in value else value[:12]
+
+
+def _format_ports(port_list: List[Dict]) -> Dict[str, Optional[List[Dict[str, str]]]]:
+    """将容器列表接口的 Ports 转换为与 container.ports 一致的格式"""
+    ports: Dict[str, Optional[List[Dict[str, str]]]] = {}
+    for binding in port_list or []:
+        key = f"{binding.get('PrivatePort')}/{binding.get('Type', 'tcp')}"
+        if binding.get("PublicPort"):
+            ports[key] = (ports.get(key) or []) + [{
+                "HostIp": binding.get("IP", ""),
+                "HostPort": str(binding["PublicPort"]),
+            }]
+        elif key not in ports:
+            ports[key] = None
+    return ports
+
+
+def _format_created(created) -> str:
+    if isinstance(created, (int, float)):
+        return datetime.fromtimestamp(created, tz=timezone.utc).isoformat().replace("+00:00", "Z")
+    return created or ""
+
+
+class DockerStateCache:
+    """
+    容器与镜像状态的内存快照
+
+    - 启动时做一次全量同步，之后由 Docker events 流增量更新
+    - 每个事件只重新查询发生变化的那一个容器，不再逐个容器查询镜像标签
+    - 定期全量同步，兜底事件流断开期间丢失的变化
+    - 对外提供的列表在写入时预先生成，读取为常数时间
+    """
+
+    def __init__(self, manager, resync_interval: float = 60.0):
+        self.manager = manager
+        self.resync_interval = resync_interval
+        self._lock = threading.Lock()
+        self._containers: Dict[str, Dict] = {}   # container id -> 列表接口返回的原始数据
+        self._images: Dict[str, Dict] = {}       # image id -> 列表接口返回的原始数据
+        self._version: Dict = {}
+        self._view: Dict = {"containers": [], "images": []}
+        self._ready = False
+        self._synced_at: Optional[float] = None
+        self._listeners: List[Callable[[Dict], None]] = []
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._events_stream = None
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    def subscribe(self, callback: Callable[[Dict], None]):
+        """订阅容器事件，回调在事件线程中执行"""
+        self._listeners.append(callback)
+
+    def start(self):
+        if not self.manager.client or self._threads:
+            return
+        self._stop.clear()
+        for target, name in ((self._events_loop, "docker-events"), (self._resync_loop, "docker-resync")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        stream = self._events_stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+        self._threads = []
+
+    # ------------------------------------------------------------------
+    # 同步
+    # ------------------------------------------------------------------
+    def resync(self):
+        """全量同步容器、镜像和 Docker 版本"""
+        api = self.manager.client.api
+        containers = {c["Id"]: c for c in api.containers(all=True)}
+        images = {img["Id"]: img for img in api.images()}
+        try:
+            version = self.manager.client.version()
+        except Exception as e:
+            logger.error(f"Failed to get Docker version: {e}")
+            version = self._version
+        with self._lock:
+            self._containers = containers
+            self._images = images
+            self._version = version
+            self._rebuild_view()
+            self._ready = True
+            self._synced_at = time.time()
+
+    def _refresh_container(self, container_id: str):
+        found = self.manager.client.api.containers(all=True, filters={"id": container_id})
+        with self._lock:
+            if found:
+                self._containers[container_id] = found[0]
+            else:
+                self._containers.pop(container_id, None)
+            self._rebuild_view()
+
+    def _refresh_images(self):
+        images = {img["Id"]: img for img in self.manager.client.api.images()}
+        with self._lock:
+            self._images = images
+            self._rebuild_view()
+
+    def _rebuild_view(self):
+        """根据原始数据生成接口返回的列表（调用方持有锁）"""
+        image_tags = {image_id: (img.get("RepoTags") or []) for image_id, img in self._images.items()}
+        containers = []
+        for c in self._containers.values():
+            tags = [t for t in image_tags.get(c.get("ImageID"), []) if t != "<none>:<none>"]
+            image = tags[0] if tags else c.get("Image", "")
+            if image.startswith("sha256:"):
+                image = _short_id(image)
+            names = c.get("Names") or [""]
+            containers.append({
+                "id": c["Id"][:12],
+                "name": names[0].lstrip("/"),
+                "image": image,
+                "status": c.get("State", ""),
+                "created": _format_created(c.get("Created")),
+                "ports": _format_ports(c.get("Ports")),
+            })
+        images = []
+        for img in self._images.values():
+            images.append({
+                "id": _short_id(img["Id"]),
+                "tags": [t for t in (img.get("RepoTags") or []) if t != "<none>:<none>"],
+                "size": img.get("Size", 0),
+                "created": _format_created(img.get("Created")),
+            })
+        self._view = {"containers": containers, "images": images}
+
+    # ------------------------------------------------------------------
+    # 后台线程
+    # ------------------------------------------------------------------
+    def _events_loop(self):
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                stream = self.manager.client.events(
+                    decode=True, filters={"type": ["container", "image"]}
+                )
+                self._events_stream = stream
+                # 重新连上事件流后做一次全量同步，补齐断开期间的变化
+                self.resync()
+                backoff = 1.0
+                for event in stream:
+                    if self._stop.is_set():
+                        break
+                    self._handle_event(event)
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                logger.warning(f"Docker events stream interrupted: {e}, reconnecting in {backoff:.0f}s")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                self._events_stream = None
+
+    def _resync_loop(self):
+        while not self._stop.wait(self.resync_interval):
+            try:
+                self.resync()
+            except Exception as e:
+                logger.error(f"Docker state resync failed: {e}")
+
+    def _handle_event(self, event: Dict):
+        event_type = event.get("Type")
+        action = event.get("Action") or event.get("status") or ""
+        if event_type == "container":
+            if action.startswith("exec_"):
+                return
+            container_id = event.get("Actor", {}).get("ID") or event.get("id")
+            if not container_id:
+                return
+            try:
+                if action == "destroy":
+                    with self._lock:
+                        self._containers.pop(container_id, None)
+                        self._rebuild_view()
+                else:
+                    self._refresh_container(container_id)
+            except Exception as e:
+                logger.error(f"Failed to refresh container {container_id[:12]}: {e}")
+            for listener in list(self._listeners):
+                try:
+                    listener(event)
+                except Exception as e:
+                    logger.error(f"Docker event listener failed: {e}")
+        elif event_type == "image" and action in IMAGE_REFRESH_ACTIONS:
+            try:
+                self._refresh_images()
+            except Exception as e:
+                logger.error(f"Failed to refresh images: {e}")
+
+    # ------------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------------
+    def get_container(self, container_id: str) -> Optional[Dict]:
+        """返回缓存中容器列表接口的原始数据"""
+        with self._lock:
+            return self._containers.get(container_id)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "containers": self._view["containers"],
+                "images": self._view["images"],
+                "version": self._version,
+                "synced_at": self._synced_at,
+            }
+
+
+# 单例模式
+docker_state = DockerStateCache(
+    docker_manager,
+    resync_interval=float(os.getenv("DOCKER_STATE_RESYNC_INTERVAL", "60")),
+)
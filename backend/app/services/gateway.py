@@ -0,0 +1,217 @@
+"""
+SSE 网关
+
+按路径 /api/{server_name}/{path} 将请求反向代理到对应容器：
+- 路由表在内存中维护，由生命周期操作和容器对账同步更新，未命中时回查数据库
+- 上游使用共享的 httpx.AsyncClient 连接池（keep-alive），全部为异步 IO，长连接不占用线程
+- SSE 响应中的 endpoint 事件是容器内的相对路径，转发时补上 /api/{server_name} 前缀，
+  使客户端后续的 POST 消息也经过网关
+"""
+import os
+import threading
+import logging
+from typing import Dict, Optional, Tuple
+
+import httpx
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from .. import models
+from ..database import SessionLocal
+from .docker_manager import CONTAINER_PORT
+
+logger = logging.getLogger(__name__)
+
+# 平台访问容器发布端口时使用的地址（平台本身运行在容器中时可设为 host.docker.internal）
+# 容器网络模式下直接访问容器 IP，平台需能访问 MCP_NETWORK（运行在容器中时需加入该网络）
+UPSTREAM_HOST = os.getenv("GATEWAY_UPSTREAM_HOST", "127.0.0.1")
+
+# 与网关路径冲突的服务器名称（平台自身的 /api/* 接口）
+RESERVED_NAMES = {"auth", "servers", "system", "images", "jobs"}
+
+# 不转发的逐跳头
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "transfer-encoding", "upgrade", "host",
+}
+
+# 不转发给容器的凭据：平台的登录 token（Authorization）和平台域名下的 cookie
+CREDENTIAL_HEADERS = {"authorization", "cookie"}
+
+
+class RouteTable:
+    """server_name -> (host, port)"""
+
+    def __init__(self):
+        self._routes: Dict[str, Tuple[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def set(self, name: str, port: Optional[int], host: Optional[str] = None):
+        if not port:
+            self.remove(name)
+            return
+        with self._lock:
+            self._routes[name] = (host or UPSTREAM_HOST, int(port))
+
+    @staticmethod
+    def upstream_of(server: models.MCPServer) -> Optional[Tuple[str, int]]:
+        """服务器的上游地址：容器网络模式直连 容器IP:8000，否则走宿主机端口"""
+        if server.container_ip:
+            return server.container_ip, CONTAINER_PORT
+        if server.host_port:
+            return UPSTREAM_HOST, int(server.host_port)
+        return None
+
+    def set_server(self, server: models.MCPServer):
+        upstream = self.upstream_of(server)
+        if upstream:
+            self.set(server.name, upstream[1], upstream[0])
+        else:
+            self.remove(server.name)
+
+    def remove(self, name: str):
+        with self._lock:
+            self._routes.pop(name, None)
+
+    def get(self, name: str) -> Optional[Tuple[str, int]]:
+        with self._lock:
+            return self._routes.get(name)
+
+    def load(self, name: str) -> Optional[Tuple[str, int]]:
+        """从数据库加载单个服务器的路由（同步，调用方负责放到线程池执行）"""
+        db = SessionLocal()
+        try:
+            server = db.query(models.MCPServer).filter(models.MCPServer.name == name).first()
+            if server and server.status == models.ServerStatus.RUNNING:
+                self.set_server(server)
+            else:
+                self.remove(name)
+            return self.get(name)
+        finally:
+            db.close()
+
+    def __len__(self):
+        return len(self._routes)
+
+
+class Gateway:
+    def __init__(self, max_connections: int, max_keepalive: int, connect_timeout: float):
+        self.routes = RouteTable()
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.connect_timeout = connect_timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._active_streams = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                ),
+                # SSE 为长连接，不设置读取超时
+                timeout=httpx.Timeout(connect=self.connect_timeout, read=None, write=30.0, pool=self.connect_timeout),
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> Dict:
+        return {"routes": len(self.routes), "active_streams": self._active_streams}
+
+    async def proxy(self, request: Request, server_name: str, path: str) -> StreamingResponse:
+        upstream = self.routes.get(server_name) or await run_in_threadpool(self.routes.load, server_name)
+        if upstream is None:
+            raise HTTPException(status_code=404, detail=f"Server '{server_name}' is not running")
+
+        host, port = upstream
+        url = f"http://{host}:{port}/{path}"
+        headers = [
+            (k, v) for k, v in request.headers.items()
+            if k.lower() not in HOP_BY_HOP_HEADERS and k.lower() not in CREDENTIAL_HEADERS
+        ]
+        client_host = request.client.host if request.client else ""
+        forwarded_for = request.headers.get("x-forwarded-for")
+        headers += [
+            ("x-forwarded-for", f"{forwarded_for}, {client_host}" if forwarded_for else client_host),
+            ("x-forwarded-proto", request.url.scheme),
+            ("x-forwarded-prefix", f"/api/{server_name}"),
+        ]
+        upstream_request = self.client.build_request(
+            request.method, url,
+            params=request.query_params.multi_items(),
+            headers=headers,
+            content=request.stream() if request.method not in ("GET", "HEAD") else None,
+        )
+        try:
+            response = await self.client.send(upstream_request, stream=True)
+        except httpx.TransportError as e:
+            # 连接失败说明路由已失效（容器已停止或端口变化），下次请求重新加载
+            self.routes.remove(server_name)
+            logger.warning(f"Gateway upstream {server_name} ({host}:{port}) unavailable: {e}")
+            raise HTTPException(status_code=502, detail=f"Server '{server_name}' is unreachable")
+
+        response_headers = {
+            k: v for k, v in response.headers.items()
+            if k.lower() not in HOP_BY_HOP_HEADERS and k.lower() not in ("content-length", "content-encoding")
+        }
+        is_sse = response.headers.get("content-type", "").startswith("text/event-stream")
+        if is_sse:
+            response_headers["x-accel-buffering"] = "no"
+        body = self._rewrite_sse(response, server_name) if is_sse else self._passthrough(response)
+        return StreamingResponse(body, status_code=response.status_code, headers=response_headers)
+
+    async def _passthrough(self, response: httpx.Response):
+        try:
+            async for chunk in response.aiter_bytes():
+                yield chunk
+        finally:
+            await response.aclose()
+
+    async def _rewrite_sse(self, response: httpx.Response, server_name: str):
+        """转发 SSE 流；只解析到第一个 endpoint 事件为止，之后原样转发"""
+        prefix = f"/api/{server_name}".encode()
+        pending = b""
+        rewriting = True
+        self._active_streams += 1
+        try:
+            async for chunk in response.aiter_bytes():
+                if not rewriting:
+                    yield chunk
+                    continue
+                pending += chunk
+                while rewriting and b"\n\n" in pending.replace(b"\r\n", b"\n"):
+                    normalized = pending.replace(b"\r\n", b"\n")
+                    event, _, pending = normalized.partition(b"\n\n")
+                    lines = event.split(b"\n")
+                    if b"event: endpoint" in lines or b"event:endpoint" in lines:
+                        lines = [
+                            b"data: " + prefix + line[len(b"data:"):].lstrip()
+                            if line.startswith(b"data:") and line[len(b"data:"):].lstrip().startswith(b"/")
+                            else line
+                            for line in lines
+                        ]
+                        rewriting = False
+                    yield b"\n".join(lines) + b"\n\n"
+                if not rewriting and pending:
+                    yield pending
+                    pending = b""
+            if pending:
+                yield pending
+        finally:
+            self._active_streams -= 1
+            await response.aclose()
+
+
+# 单例模式
+gateway = Gateway(
+    max_connections=int(os.getenv("GATEWAY_MAX_CONNECTIONS", "10000")),
+    max_keepalive=int(os.getenv("GATEWAY_MAX_KEEPALIVE", "200")),
+    connect_timeout=float(os.getenv("GATEWAY_CONNECT_TIMEOUT", "5")),
+)
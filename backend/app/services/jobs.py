@@ -0,0 +1,317 @@
+"""生命周期任务队列：操作以任务形式提交，由有限数量的 worker 在后台执行"""
+import asyncio
+import os
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from .. import models
+from ..database import SessionLocal
+from . import lifecycle, leases
+from .docker_executor import DockerBusyError, DockerTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# 等待其他 worker 释放租约的最长时间和轮询间隔（秒）
+LEASE_WAIT_TIMEOUT = float(os.getenv("SERVER_LEASE_WAIT_TIMEOUT", "300"))
+LEASE_POLL_INTERVAL = 0.5
+
+
+class JobState:
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class Job:
+    def __init__(self, server_id: str, action: str, options: Optional[Dict] = None):
+        self.id = str(uuid.uuid4())
+        self.server_id = server_id
+        self.action = action
+        self.options = options or {}
+        self.state = JobState.PENDING
+        self.phase = "queued"
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.status_code: Optional[int] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.done = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (JobState.SUCCEEDED, JobState.FAILED)
+
+    def to_dict(self) -> Dict:
+        duration_ms = None
+        if self.started_at is not None:
+            duration_ms = round(((self.finished_at or time.time()) - self.started_at) * 1000)
+        return {
+            "job_id": self.id,
+            "server_id": self.server_id,
+            "action": self.action,
+            "options": self.options,
+            "state": self.state,
+            "phase": self.phase,
+            "result": self.result,
+            "error": self.error,
+            "status_code": self.status_code,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "duration_ms": duration_ms,
+        }
+
+
+class JobManager:
+    """
+    生命周期任务管理
+
+    - 同一服务器上正在排队或执行的相同操作会被合并，返回同一个任务
+    - 同一服务器上的不同操作按提交顺序串行执行
+    - 跨 worker 通过数据库租约互斥；其他 worker 正在执行相同操作时直接等待其完成并复用结果
+    - 全局最多 workers 个任务同时执行，HTTP 请求不再等待 Docker
+    - 启动类操作执行期间服务器状态为 BUILDING
+    """
+
+    def __init__(self, workers: int = 4, history: int = 500):
+        self.workers = workers
+        self.history = history
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._active: Dict[str, List[Job]] = {}         # server_id -> 未完成的任务（按提交顺序）
+        self._server_locks: Dict[str, asyncio.Lock] = {}
+        # 持有未完成任务的引用，避免执行中被垃圾回收，关闭时统一取消
+        self._tasks: Set[asyncio.Task] = set()
+
+    def submit(self, server_id: str, action: str, options: Optional[Dict] = None) -> Tuple[Job, bool]:
+        """提交任务，返回 (任务, 是否与已有任务合并)；options 为启动选项，选项不同的任务不合并"""
+        options = {k: v for k, v in (options or {}).items() if v is not None}
+        for job in self._active.get(server_id, []):
+            if job.action == action and job.options == options and not job.finished:
+                return job, True
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+        job = Job(server_id, action, options)
+        self._jobs[job.id] = job
+        self._active.setdefault(server_id, []).append(job)
+        self._trim_history()
+        job.task = asyncio.create_task(self._run(job))
+        self._tasks.add(job.task)
+        job.task.add_done_callback(self._tasks.discard)
+        return job, False
+
+    async def shutdown(self):
+        """取消所有未完成的任务并等待其结束（释放租约、恢复 BUILDING 状态）"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def wait(self, job: Job) -> Job:
+        await job.done.wait()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def list_for_server(self, server_id: str, limit: int = 20) -> List[Job]:
+        jobs = [job for job in reversed(self._jobs.values()) if job.server_id == server_id]
+        return jobs[:limit]
+
+    def stats(self) -> Dict:
+        states: Dict[str, int] = {}
+        for job in self._jobs.values():
+            states[job.state] = states.get(job.state, 0) + 1
+        return {"workers": self.workers, "jobs": states}
+
+    def _trim_history(self):
+        while len(self._jobs) > self.history:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if not oldest.finished:
+                break
+            del self._jobs[oldest_id]
+
+    async def _run(self, job: Job):
+        lock = self._server_locks.setdefault(job.server_id, asyncio.Lock())
+        try:
+            async with lock:
+                try:
+                    joined_result = await self._acquire_lease(job)
+                except HTTPException as e:
+                    self._fail(job, e.status_code, e.detail)
+                    return
+                except Exception as e:
+                    logger.error(f"Failed to acquire lease for server {job.server_id}: {e}", exc_info=True)
+                    self._fail(job, 500, str(e))
+                    return
+                if joined_result is not None:
+                    job.result = joined_result
+                    job.state = JobState.SUCCEEDED
+                    job.status_code = 200
+                    job.phase = "done"
+                    job.finished_at = time.time()
+                    return
+
+                heartbeat = asyncio.create_task(self._heartbeat(job.server_id))
+                try:
+                    async with self._semaphore:
+                        await self._execute(job)
+                finally:
+                    heartbeat.cancel()
+                    try:
+                        await run_in_threadpool(leases.release, job.server_id)
+                    except Exception as e:
+                        logger.error(f"Failed to release lease for server {job.server_id}: {e}")
+        finally:
+            active = self._active.get(job.server_id, [])
+            if job in active:
+                active.remove(job)
+            if not active:
+                self._active.pop(job.server_id, None)
+                self._server_locks.pop(job.server_id, None)
+            job.done.set()
+
+    def _set_phase(self, job: Job, phase: str):
+        job.phase = phase
+
+    def _fail(self, job: Job, status_code: int, error: str):
+        job.state = JobState.FAILED
+        job.status_code = status_code
+        job.error = error
+        job.phase = "done"
+        job.finished_at = time.time()
+
+    async def _acquire_lease(self, job: Job) -> Optional[Dict]:
+        """
+        获取服务器租约
+        返回 None 表示已获得租约；若其他 worker 正在执行相同操作，
+        等待其完成后返回合并后的结果（不再重复调用 Docker）
+        租约的读写是阻塞的数据库操作（SQLite 写锁最多等待 busy_timeout），在线程池中执行，不阻塞事件循环
+        """
+        deadline = time.monotonic() + LEASE_WAIT_TIMEOUT
+        joined = False
+        while True:
+            holder = await run_in_threadpool(leases.current, job.server_id)
+            if holder is None or holder.owner == leases.WORKER_ID:
+                if joined:
+                    return await run_in_threadpool(self._joined_result, job)
+                if await run_in_threadpool(leases.try_acquire, job.server_id, job.action, job.id):
+                    return None
+            else:
+                if holder.action == job.action:
+                    joined = True
+                job.phase = f"waiting: {holder.action} in progress on {holder.owner}"
+            if time.monotonic() > deadline:
+                raise HTTPException(status_code=409, detail="Server is busy with another lifecycle operation")
+            await asyncio.sleep(LEASE_POLL_INTERVAL)
+
+    def _joined_result(self, job: Job) -> Dict:
+        db = SessionLocal()
+        try:
+            server = db.query(models.MCPServer).filter(models.MCPServer.id == job.server_id).first()
+            if not server:
+                if job.action == "delete":
+                    return {"message": "Server deleted", "joined": True}
+                raise HTTPException(status_code=404, detail="Server not found")
+            if job.action in lifecycle.BUILDING_ACTIONS and server.status != models.ServerStatus.RUNNING:
+                raise HTTPException(status_code=500, detail=f"Concurrent {job.action} failed on another worker")
+            return {
+                "message": f"Joined in-flight {job.action}",
+                "status": server.status.value,
+                "host_port": server.host_port,
+                "joined": True
+            }
+        finally:
+            db.close()
+
+    async def _heartbeat(self, server_id: str):
+        while True:
+            await asyncio.sleep(leases.LEASE_TTL / 3)
+            try:
+                if not await run_in_threadpool(leases.renew, server_id):
+                    logger.warning(f"Lost lifecycle lease for server {server_id}")
+            except Exception as e:
+                logger.error(f"Failed to renew lease for server {server_id}: {e}")
+
+    async def _execute(self, job: Job):
+        job.state = JobState.RUNNING
+        job.started_at = time.time()
+        db = SessionLocal()
+        previous_status = None
+        try:
+            server, previous_status = await run_in_threadpool(self._begin, db, job)
+            job.result = await lifecycle.perform_action(
+                db, server, job.action, progress=lambda phase: self._set_phase(job, phase), options=job.options
+            )
+            job.state = JobState.SUCCEEDED
+            job.status_code = 200
+        except HTTPException as e:
+            job.state = JobState.FAILED
+            job.status_code = e.status_code
+            job.error = e.detail
+        except (DockerBusyError, DockerTimeoutError) as e:
+            job.state = JobState.FAILED
+            job.status_code = 503 if isinstance(e, DockerBusyError) else 504
+            job.error = str(e)
+        except asyncio.CancelledError:
+            # 平台关闭：记为失败以便下面恢复 BUILDING 状态
+            job.state = JobState.FAILED
+            job.status_code = 503
+            job.error = "Job cancelled"
+            raise
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.action}) failed for server {job.server_id}: {e}", exc_info=True)
+            job.state = JobState.FAILED
+            job.status_code = 500
+            job.error = str(e)
+        finally:
+            # 若操作中途失败而状态仍停留在 BUILDING，恢复为原状态（容器已被删除则为 STOPPED）
+            if previous_status is not None and job.state == JobState.FAILED:
+                try:
+                    await run_in_threadpool(self._restore_status, db, job.server_id, previous_status)
+                except Exception as e:
+                    logger.error(f"Failed to restore status of server {job.server_id}: {e}")
+            db.close()
+            job.phase = "done"
+            job.finished_at = time.time()
+
+    @staticmethod
+    def _begin(db, job: Job):
+        """加载服务器，启动类操作将状态置为 BUILDING；返回 (服务器, 原状态)"""
+        server = db.query(models.MCPServer).filter(models.MCPServer.id == job.server_id).first()
+        if not server:
+            raise HTTPException(status_code=404, detail="Server not found")
+        previous_status = None
+        if job.action in lifecycle.BUILDING_ACTIONS and not (
+            job.action == "start" and server.status == models.ServerStatus.RUNNING
+        ):
+            previous_status = server.status
+            server.status = models.ServerStatus.BUILDING
+            db.commit()
+            # 提交后属性失效，在这里重新加载，避免之后在事件循环中触发查询
+            db.refresh(server)
+        return server, previous_status
+
+    @staticmethod
+    def _restore_status(db, server_id: str, previous_status: models.ServerStatus):
+        db.rollback()
+        server = db.query(models.MCPServer).filter(models.MCPServer.id == server_id).first()
+        if server and server.status == models.ServerStatus.BUILDING:
+            server.status = previous_status if server.container_id else models.ServerStatus.STOPPED
+            db.commit()
+
+
+# 单例模式
+job_manager = JobManager(
+    workers=int(os.getenv("LIFECYCLE_WORKERS", "4")),
+    history=int(os.getenv("LIFECYCLE_JOB_HISTORY", "500")),
+)
@@ -0,0 +1,92 @@
+"""基于数据库的服务器操作租约，保证同一服务器同一时间只有一个 worker 在执行生命周期操作"""
+import os
+import socket
+import uuid
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from .. import models
+from ..database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# 当前进程的唯一标识
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# 租约有效期（秒），持有期间每 1/3 有效期续约一次
+LEASE_TTL = float(os.getenv("SERVER_LEASE_TTL", "30"))
+
+
+def try_acquire(server_id: str, action: str, job_id: Optional[str] = None) -> bool:
+    """尝试获取租约：不存在则插入，已过期则接管"""
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=LEASE_TTL)
+    db = SessionLocal()
+    try:
+        taken_over = db.query(models.ServerLease).filter(
+            models.ServerLease.server_id == server_id,
+            (models.ServerLease.expires_at < now) | (models.ServerLease.owner == WORKER_ID)
+        ).update({
+            "owner": WORKER_ID, "action": action, "job_id": job_id,
+            "acquired_at": now, "expires_at": expires_at
+        }, synchronize_session=False)
+        if taken_over:
+            db.commit()
+            return True
+        db.add(models.ServerLease(
+            server_id=server_id, owner=WORKER_ID, action=action, job_id=job_id,
+            acquired_at=now, expires_at=expires_at
+        ))
+        db.commit()
+        return True
+    except IntegrityError:
+        db.rollback()
+        return False
+    finally:
+        db.close()
+
+
+def renew(server_id: str) -> bool:
+    """续约，返回 False 表示租约已丢失"""
+    db = SessionLocal()
+    try:
+        renewed = db.query(models.ServerLease).filter(
+            models.ServerLease.server_id == server_id,
+            models.ServerLease.owner == WORKER_ID
+        ).update({
+            "expires_at": datetime.utcnow() + timedelta(seconds=LEASE_TTL)
+        }, synchronize_session=False)
+        db.commit()
+        return bool(renewed)
+    finally:
+        db.close()
+
+
+def release(server_id: str):
+    db = SessionLocal()
+    try:
+        db.query(models.ServerLease).filter(
+            models.ServerLease.server_id == server_id,
+            models.ServerLease.owner == WORKER_ID
+        ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def current(server_id: str) -> Optional[models.ServerLease]:
+    """返回当前有效的租约（已过期的视为不存在）"""
+    db = SessionLocal()
+    try:
+        lease = db.query(models.ServerLease).filter(
+            models.ServerLease.server_id == server_id,
+            models.ServerLease.expires_at >= datetime.utcnow()
+        ).first()
+        if lease:
+            db.expunge(lease)
+        return lease
+    finally:
+        db.close()
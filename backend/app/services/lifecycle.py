@@ -0,0 +1,339 @@
+"""
+服务器生命周期操作（启动、停止、重启、重建），供单个操作和批量操作共用
+
+这些函数在任务队列的事件循环中执行：Docker 调用经 docker_executor，数据库读写（含关系的延迟加载）
+按阶段合并为一次 run_in_threadpool 调用，不阻塞事件循环
+"""
+import json
+import os
+import time
+import logging
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .. import models
+from .docker_manager import docker_manager, BASE_IMAGE
+from .docker_executor import docker_executor, DockerBusyError, DockerTimeoutError, START_TIMEOUT, STOP_TIMEOUT
+from .warm_pool import warm_pool
+from .log_store import log_capture
+from .gateway import gateway
+from .reconciler import reconciler
+from . import port_reservations
+from .port_allocator import port_allocator
+from .dep_layers import dep_layers
+from .readiness import wait_until_ready, ReadinessError, WAIT_READY_DEFAULT, READY_TIMEOUT, READY_PROBE_DEFAULT
+
+logger = logging.getLogger(__name__)
+
+# 支持的生命周期操作
+ACTIONS = ("start", "stop", "restart", "rebuild", "remove_container")
+
+# 执行期间服务器处于 BUILDING 状态的操作
+BUILDING_ACTIONS = ("start", "restart", "rebuild")
+
+
+def _stop_and_release(container_id: str):
+    docker_manager.stop_container(container_id)
+    # 预热容器删除后归还数据目录
+    warm_pool.release(container_id)
+
+
+def build_command(server: models.MCPServer) -> Optional[List[str]]:
+    """根据 command 和 args 生成容器启动命令"""
+    if not server.command:
+        return None
+    cmd_list = [server.command]
+    if server.args:
+        # 优先按 JSON 列表解析，否则按空格分割
+        try:
+            args = json.loads(server.args)
+            if isinstance(args, list):
+                cmd_list.extend(args)
+            else:
+                cmd_list.extend(server.args.split())
+        except ValueError:
+            cmd_list.extend(server.args.split())
+    return cmd_list
+
+
+def parse_requested_ports(server: models.MCPServer) -> Optional[List[int]]:
+    """解析逗号分隔的端口列表"""
+    if not server.ports:
+        return None
+    try:
+        return [int(p.strip()) for p in server.ports.split(',') if p.strip()]
+    except ValueError:
+        logger.warning(f"Failed to parse ports: {server.ports}")
+        return None
+
+
+async def remove_container(server: models.MCPServer, reason: str = "stop"):
+    """停止并删除服务器容器（容器不存在或删除失败时只记录日志）"""
+    if not server.container_id:
+        return
+    # 主动停止导致的退出（143/137）不应被对账记为崩溃
+    reconciler.expect_stop(server.container_id)
+    try:
+        await docker_executor.run(_stop_and_release, server.container_id, timeout=STOP_TIMEOUT)
+    except DockerBusyError:
+        raise
+    except Exception as e:
+        logger.warning(f"Failed to remove container during {reason}: {e}")
+
+
+def _commit(db: Session, server: models.MCPServer):
+    """提交并重新加载服务器（提交后属性失效，避免之后在事件循环中触发查询）；在线程池中调用"""
+    db.commit()
+    db.refresh(server)
+
+
+def _record_stopped(db: Session, server: models.MCPServer, keep_status: bool):
+    if not (keep_status and server.status == models.ServerStatus.BUILDING):
+        server.status = models.ServerStatus.STOPPED
+    server.container_id = None
+    server.host_port = None
+    server.container_ip = None
+    port_reservations.release_runtime(server)
+    _commit(db, server)
+
+
+async def stop_server(db: Session, server: models.MCPServer, reason: str = "stop", keep_status: bool = False):
+    """停止服务器并清理运行时信息；keep_status 用于重启/重建，保持 BUILDING 状态不变"""
+    await remove_container(server, reason)
+    await run_in_threadpool(_record_stopped, db, server, keep_status)
+    gateway.routes.remove(server.name)
+
+
+def _delete_record(db: Session, server: models.MCPServer):
+    db.delete(server)
+    db.commit()
+
+
+async def delete_server(db: Session, server: models.MCPServer):
+    """删除服务器：删除容器和数据库记录，归还端口（代码和数据目录保留）"""
+    await remove_container(server, "delete")
+    server_id, server_name = server.id, server.name
+    await run_in_threadpool(_delete_record, db, server)
+    port_allocator.release_owner(server_id)
+    log_capture.forget(server_id)
+    gateway.routes.remove(server_name)
+
+
+def _elapsed_ms(started_at: float) -> int:
+    return round((time.monotonic() - started_at) * 1000)
+
+
+async def start_server(
+    db: Session,
+    server: models.MCPServer,
+    verb: str = "start",
+    wait_ready: Optional[bool] = None,
+    ready_timeout: Optional[float] = None,
+    ready_probe: Optional[str] = None,
+    progress: Optional[Callable[[str], None]] = None
+) -> Dict:
+    """
+    启动服务器容器并记录运行时信息
+    wait_ready 为真时等待服务器就绪后才置为 RUNNING，未指定时使用 SERVER_WAIT_READY
+    ready_probe 为探测方式（http 探测 SSE 端点，tcp 用于非 HTTP 的自定义命令），未指定时使用 SERVER_READY_PROBE
+    各阶段耗时（毫秒）保存在 server.start_timings 中
+    失败时将状态置为 ERROR 并抛出对应的 HTTPException
+    """
+    report = progress or (lambda phase: None)
+    wait_ready = WAIT_READY_DEFAULT if wait_ready is None else wait_ready
+    started_at = time.monotonic()
+    timings: Dict[str, int] = {}
+
+    # 清理已退出（如崩溃、OOM）但未删除的旧容器，避免容器名冲突
+    if server.container_id:
+        await remove_container(server, f"{verb} cleanup")
+        server.container_id = None
+
+    env_map, requested_ports, pinned_ports = await run_in_threadpool(_load_start_config, server)
+    image = server.image or BASE_IMAGE
+    command = build_command(server)
+    try:
+        # 代码带有依赖文件时准备依赖层（命中缓存时只计算哈希；构建在独立线程池中执行，失败或超时时不挂载）
+        phase_started = time.monotonic()
+        deps_path = await dep_layers.prepare(os.path.join(server.source_code_path, "app"), image)
+        if deps_path:
+            timings["dependencies"] = _elapsed_ms(phase_started)
+        result = None
+        # 预热容器的挂载已固定，需要依赖层的服务器直接创建容器
+        if not deps_path and warm_pool.is_eligible(image, command, pinned_ports):
+            # 优先认领预热容器，没有空闲容器时退回到正常创建
+            phase_started = time.monotonic()
+            result = await docker_executor.run(
+                warm_pool.claim, image, server.id, server.name, server.source_code_path, env_map
+            )
+            if result is not None:
+                timings["warm_claim"] = _elapsed_ms(phase_started)
+        if result is None:
+            result = await docker_executor.run(
+                docker_manager.run_container,
+                server.id,
+                server.name,
+                server.source_code_path,
+                env_map,
+                requested_ports=requested_ports,
+                command=command,
+                image=image,
+                deps_path=deps_path,
+                timeout=START_TIMEOUT
+            )
+    except DockerBusyError:
+        raise
+    except RuntimeError as e:
+        # Docker 相关的运行时错误（如 Docker 未启动、端口占用等）
+        server.status = models.ServerStatus.ERROR
+        await run_in_threadpool(_commit, db, server)
+        error_msg = str(e)
+        if isinstance(e, DockerTimeoutError):
+            raise HTTPException(status_code=504, detail=f"Docker operation timed out: {error_msg}")
+        elif "Docker client not initialized" in error_msg or "Docker not running" in error_msg:
+            raise HTTPException(
+                status_code=503,
+                detail="Docker service is not running. Please start Docker and try again."
+            )
+        elif "port" in error_msg.lower() and "not available" in error_msg.lower():
+            raise HTTPException(status_code=409, detail=f"Port conflict: {error_msg}")
+        else:
+            raise HTTPException(status_code=500, detail=f"Failed to {verb} server: {error_msg}")
+    except Exception as e:
+        # 其他未预期的错误
+        server.status = models.ServerStatus.ERROR
+        await run_in_threadpool(_commit, db, server)
+        logger.error(f"Unexpected error during {verb} of server {server.id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+    timings.update(result.get("timings") or {})
+    await run_in_threadpool(_record_started, db, server, result, requested_ports)
+    # 持久化容器日志，删除容器后仍可检索
+    log_capture.capture(server.id, result["container_id"])
+
+    upstream = gateway.routes.upstream_of(server)
+    if wait_ready and upstream:
+        report("probing")
+        timeout = ready_timeout or READY_TIMEOUT
+        try:
+            waited = await wait_until_ready(
+                upstream[0], upstream[1], result["container_id"], timeout, ready_probe or READY_PROBE_DEFAULT
+            )
+            timings["ready"] = round(waited * 1000)
+        except ReadinessError as e:
+            # 保留容器以便查看日志
+            timings["total"] = _elapsed_ms(started_at)
+            server.start_timings = _timings_json(timings, ready=False)
+            server.status = models.ServerStatus.ERROR
+            await run_in_threadpool(_commit, db, server)
+            raise HTTPException(
+                status_code=500 if e.exited else 504,
+                detail=f"Server failed to become ready after {verb}: {e}"
+            )
+
+    timings["total"] = _elapsed_ms(started_at)
+    server.start_timings = _timings_json(timings, ready=True if wait_ready and upstream else None)
+    server.status = models.ServerStatus.RUNNING
+    await run_in_threadpool(_commit, db, server)
+    gateway.routes.set_server(server)
+    result["timings"] = timings
+    return result
+
+
+def _load_start_config(server: models.MCPServer):
+    """启动前读取环境变量和端口配置（关系延迟加载）；在线程池中调用"""
+    env_map = {env.key: env.value for env in server.env_vars}
+    return env_map, parse_requested_ports(server), port_reservations.pinned_ports(server)
+
+
+def _record_started(db: Session, server: models.MCPServer, result: Dict, requested_ports: Optional[List[int]]):
+    """记录新容器的运行时信息和端口；在线程池中调用"""
+    if result.get("warm") and result["port"] and requested_ports != [result["port"]]:
+        _adopt_warm_port(db, server, result["port"], requested_ports or [])
+    server.container_id = result["container_id"]
+    server.host_port = result["port"]
+    server.container_ip = result.get("ip")
+    # 保存端口映射信息
+    server.host_ports = json.dumps(result.get("ports", {}))
+    port_reservations.record_runtime(db, server, result.get("ports", {}))
+    server.exit_code = None
+    _commit(db, server)
+
+
+def _adopt_warm_port(db: Session, server: models.MCPServer, port: int, previous: List[int]):
+    """认领预热容器后，自动分配的端口改为预热容器的端口（已由 claim 转移给服务器），归还原端口"""
+    try:
+        port_reservations.set_configured(db, server, [port], auto_assigned=True)
+    except port_reservations.PortConflictError as e:
+        # 分配器保证不会发生；保留原配置，预热容器端口按运行时端口记录
+        logger.warning(f"Cannot adopt warm container port for server {server.id}: {e}")
+        return
+    for old_port in previous:
+        if old_port != port:
+            port_allocator.release(old_port, server.id)
+
+
+def _timings_json(timings: Dict[str, int], ready: Optional[bool]) -> str:
+    """ready：True/False 为就绪探测结果，None 表示未等待就绪"""
+    return json.dumps({"started_at": datetime.utcnow().isoformat(), "ready": ready, "phases": timings})
+
+
+async def perform_action(
+    db: Session,
+    server: models.MCPServer,
+    action: str,
+    progress: Optional[Callable[[str], None]] = None,
+    options: Optional[Dict] = None
+) -> Dict:
+    """
+    执行单个生命周期操作，返回给前端的结果；progress 用于报告当前阶段
+    options 为启动选项（wait_ready、ready_timeout、ready_probe），仅对启动类操作生效
+    """
+    report = progress or (lambda phase: None)
+    start_options = dict(options or {}, progress=report)
+
+    if action == "start":
+        if server.status == models.ServerStatus.RUNNING:
+            return {"message": "Already running"}
+        report("starting")
+        result = await start_server(db, server, **start_options)
+        return {"message": "Server started", "details": result}
+
+    elif action == "stop":
+        report("stopping")
+        await stop_server(db, server)
+        return {"message": "Server stopped"}
+
+    elif action == "remove_container":
+        # 只删除容器，保留数据
+        report("stopping")
+        await stop_server(db, server, reason="remove_container")
+        return {"message": "Container removed, data preserved"}
+
+    elif action == "rebuild":
+        # 强制重建：删除容器 + 重新启动
+        report("stopping")
+        await stop_server(db, server, reason="rebuild", keep_status=True)
+        report("starting")
+        result = await start_server(db, server, verb="rebuild", **start_options)
+        return {"message": "Server rebuilt successfully", "port": result["port"], "details": result}
+
+    elif action == "restart":
+        # 简化版重启：先停后起
+        report("stopping")
+        await stop_server(db, server, reason="restart", keep_status=True)
+        report("starting")
+        result = await start_server(db, server, verb="restart", **start_options)
+        return {"message": "Server restarted", "details": result}
+
+    elif action == "delete":
+        # 只由 DELETE 接口提交，不在 ACTIONS 中
+        report("stopping")
+        await delete_server(db, server)
+        return {"message": "Server deleted"}
+
+    return {"message": "Action not supported"}
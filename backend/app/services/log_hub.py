@@ -0,0 +1,318 @@
+"""
+容器日志分发
+
+每个容器只保持一条到 Docker 的日志流（后台线程读取），按行广播给所有查看者：
+- 最近的日志保存在环形缓冲区中，新查看者按 tail/since 直接从缓冲区取历史
+- 每个查看者有独立的有界队列，消费过慢时丢弃新日志并插入丢弃提示，不阻塞其他查看者
+- 最后一个查看者离开后，日志流在 LOG_IDLE_TIMEOUT 秒后关闭
+- 日志持久化（log_store.LogCapture）以 sink 的形式挂在同一条日志流上，在读取线程中写入；
+  挂有 sink 的日志流不会因空闲关闭，容器退出、日志流结束时通知 sink
+"""
+import asyncio
+import os
+import threading
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from .docker_manager import docker_manager
+
+logger = logging.getLogger(__name__)
+
+# (时间戳, 原始 RFC3339 时间, 日志内容)
+LogEntry = Tuple[float, str, str]
+
+# sink：(写入函数, 结束回调)；写入函数返回 False 时移除该 sink
+LogSink = Tuple[Callable[[List[LogEntry]], bool], Callable[[], None]]
+
+
+def parse_log_time(value: str) -> Optional[float]:
+    """解析 Docker 的 RFC3339Nano 时间戳，返回 Unix 时间"""
+    try:
+        value = value.rstrip("Z")
+        base, _, fraction = value.partition(".")
+        ts = datetime.strptime(base[:19], "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+        return ts + (float(f"0.{fraction[:6]}") if fraction else 0.0)
+    except ValueError:
+        return None
+
+
+def parse_log_line(raw: str) -> LogEntry:
+    time_text, _, line = raw.partition(" ")
+    ts = parse_log_time(time_text)
+    if ts is None:
+        return (0.0, "", raw)
+    return (ts, time_text, line)
+
+
+class LogSubscription:
+    """单个查看者的订阅"""
+
+    def __init__(self, stream: "LogStream", backlog: List[LogEntry], maxsize: int):
+        self.stream = stream
+        self.backlog: Deque[LogEntry] = deque(backlog)
+        self.queue: "asyncio.Queue[Optional[LogEntry]]" = asyncio.Queue(maxsize)
+        self.dropped = 0
+        self.ended = False
+
+    def offer(self, entry: LogEntry):
+        """在事件循环线程中调用；队列满时丢弃并计数"""
+        if self.dropped:
+            if self.queue.maxsize - self.queue.qsize() < 2:
+                self.dropped += 1
+                return
+            self.queue.put_nowait((0.0, "", f"[{self.dropped} log lines dropped: viewer too slow]"))
+            self.dropped = 0
+        if self.queue.full():
+            self.dropped += 1
+            return
+        self.queue.put_nowait(entry)
+
+    def end(self):
+        self.ended = True
+        try:
+            self.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+
+    async def get(self) -> Optional[LogEntry]:
+        """返回下一行日志，日志流结束时返回 None"""
+        if self.backlog:
+            return self.backlog.popleft()
+        if self.ended and self.queue.empty():
+            return None
+        return await self.queue.get()
+
+
+class LogStream:
+    """单个容器的上游日志流"""
+
+    def __init__(
+        self, hub: "LogHub", container_id: str, full_history: bool = False, since: Optional[float] = None,
+        sinks: Optional[Dict[str, LogSink]] = None,
+    ):
+        """
+        full_history 为真时历史日志从 since（为空时从头）开始读取，而不是只读缓冲区大小的尾部
+        sinks 在读取线程启动前挂上，历史日志一定会写入
+        """
+        self.hub = hub
+        self.container_id = container_id
+        self.buffer: Deque[LogEntry] = deque(maxlen=hub.buffer_lines)
+        self.subscribers: Set[LogSubscription] = set()
+        self.sinks: Dict[str, LogSink] = dict(sinks or {})
+        self._sink_lock = threading.Lock()
+        self._full_history = full_history
+        self._history_since = since
+        self.primed = asyncio.Event()
+        self.ended = False
+        self.error: Optional[str] = None
+        self._loop = asyncio.get_running_loop()
+        self._raw = None
+        self._closing = False
+        self._idle_handle: Optional[asyncio.TimerHandle] = None
+        self._thread = threading.Thread(
+            target=self._read_loop, name=f"logs-{container_id[:12]}", daemon=True
+        )
+        self._thread.start()
+
+    # ---------------- 读取线程 ----------------
+    def _read_loop(self):
+        error = None
+        try:
+            # 1. 历史日志（不跟随），填充缓冲区
+            if self._full_history:
+                history_stream = docker_manager.open_log_stream(
+                    self.container_id, tail="all", since=self._history_since, follow=False
+                )
+            else:
+                history_stream = docker_manager.open_log_stream(
+                    self.container_id, tail=self.hub.buffer_lines, follow=False
+                )
+            entries = [parse_log_line(raw) for batch in self._read_lines(history_stream) for raw in batch]
+            self._feed_sinks(entries)
+            self._loop.call_soon_threadsafe(self._prime, entries[-self.hub.buffer_lines:])
+            if self._closing:
+                return
+            # 2. 从最后一条历史日志的时间开始跟随，跳过重复的行
+            since = entries[-1][0] if entries else None
+            seen_at_since = {line for ts, _, line in entries if since is not None and ts == since}
+            self._raw = docker_manager.open_log_stream(self.container_id, tail="all" if since else 0, since=since)
+            for batch in self._read_lines(self._raw):
+                parsed = []
+                for raw in batch:
+                    entry = parse_log_line(raw)
+                    if since is not None and (entry[0] < since or (entry[0] == since and entry[2] in seen_at_since)):
+                        continue
+                    parsed.append(entry)
+                if parsed:
+                    self._feed_sinks(parsed)
+                    self._loop.call_soon_threadsafe(self._publish, parsed)
+        except Exception as e:
+            if not self._closing:
+                error = str(e)
+                logger.warning(f"Log stream for container {self.container_id[:12]} failed: {e}")
+        finally:
+            self._end_sinks()
+            try:
+                self._loop.call_soon_threadsafe(self._finish, error)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+
+    def _feed_sinks(self, entries: List[LogEntry]):
+        if not entries:
+            return
+        with self._sink_lock:
+            for name in list(self.sinks):
+                self._feed_sink(name, entries)
+
+    def _feed_sink(self, name: str, entries: List[LogEntry]):
+        """持有 _sink_lock 时调用"""
+        try:
+            keep = self.sinks[name][0](entries)
+        except Exception as e:
+            logger.warning(f"Log sink {name} for container {self.container_id[:12]} failed: {e}")
+            keep = False
+        if keep is False:
+            del self.sinks[name]
+
+    def _end_sinks(self):
+        with self._sink_lock:
+            sinks, self.sinks = self.sinks, {}
+        for name, (_, on_end) in sinks.items():
+            try:
+                on_end()
+            except Exception as e:
+                logger.warning(f"Log sink {name} for container {self.container_id[:12]} failed to close: {e}")
+
+    def add_sink(self, name: str, sink: LogSink, since: Optional[float]) -> bool:
+        """挂上 sink 并补写缓冲区中晚于 since 的日志；同名 sink 已存在时返回 False"""
+        with self._sink_lock:
+            if name in self.sinks or self.ended:
+                return False
+            self.sinks[name] = sink
+            backlog = [entry for entry in self.buffer if since is None or entry[0] > since]
+            if backlog:
+                self._feed_sink(name, backlog)
+        return True
+
+    def _read_lines(self, raw_stream):
+        """按块读取，拼接成完整的行，每块产出一批"""
+        pending = b""
+        for chunk in raw_stream:
+            pending += chunk
+            *lines, pending = pending.split(b"\n")
+            if lines:
+                yield [line.decode("utf-8", errors="replace") for line in lines]
+            if self._closing:
+                return
+        if pending:
+            yield [pending.decode("utf-8", errors="replace")]
+
+    # ---------------- 事件循环线程 ----------------
+    def _prime(self, entries: List[LogEntry]):
+        self.buffer.extend(entries)
+        self.primed.set()
+
+    def _publish(self, entries: List[LogEntry]):
+        self.buffer.extend(entries)
+        for subscription in self.subscribers:
+            for entry in entries:
+                subscription.offer(entry)
+
+    def _finish(self, error: Optional[str]):
+        self.ended = True
+        self.error = error
+        self.primed.set()
+        for subscription in self.subscribers:
+            subscription.end()
+        self.hub._forget(self)
+
+    def close(self):
+        self._closing = True
+        if self._raw is not None:
+            try:
+                self._raw.close()
+            except Exception:
+                pass
+
+
+class LogHub:
+    def __init__(self, buffer_lines: int = 1000, queue_size: int = 1000, idle_timeout: float = 30.0):
+        self.buffer_lines = buffer_lines
+        self.queue_size = queue_size
+        self.idle_timeout = idle_timeout
+        self._streams: Dict[str, LogStream] = {}
+
+    def attach(self, container_id: str, name: str, sink: LogSink, since: Optional[float] = None) -> bool:
+        """
+        在容器的日志流上挂 sink（在事件循环线程中调用），没有日志流时创建并从 since 开始读取历史
+        同名 sink 已挂上时返回 False
+        """
+        stream = self._streams.get(container_id)
+        if stream is None or stream.ended:
+            # 先挂上 sink 再启动读取线程，否则历史日志可能在挂上之前已被读走
+            self._streams[container_id] = LogStream(
+                self, container_id, full_history=True, since=since, sinks={name: sink}
+            )
+            return True
+        if stream._idle_handle is not None:
+            stream._idle_handle.cancel()
+            stream._idle_handle = None
+        return stream.add_sink(name, sink, since)
+
+    async def subscribe(self, container_id: str, tail: Optional[int] = 100, since: Optional[float] = None) -> LogSubscription:
+        """订阅容器日志；tail/since 只作用于缓冲区中的历史日志"""
+        stream = self._streams.get(container_id)
+        if stream is None or stream.ended:
+            stream = LogStream(self, container_id)
+            self._streams[container_id] = stream
+        if stream._idle_handle is not None:
+            stream._idle_handle.cancel()
+            stream._idle_handle = None
+        await stream.primed.wait()
+
+        backlog = [entry for entry in stream.buffer if since is None or entry[0] > since]
+        if tail is not None:
+            backlog = backlog[-tail:] if tail > 0 else []
+        subscription = LogSubscription(stream, backlog, self.queue_size)
+        if stream.ended:
+            subscription.end()
+        else:
+            stream.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: LogSubscription):
+        stream = subscription.stream
+        stream.subscribers.discard(subscription)
+        if not stream.subscribers and not stream.sinks and not stream.ended and stream._idle_handle is None:
+            stream._idle_handle = asyncio.get_running_loop().call_later(
+                self.idle_timeout, self._close_idle, stream
+            )
+
+    def _close_idle(self, stream: LogStream):
+        stream._idle_handle = None
+        if stream.subscribers or stream.sinks:
+            return
+        logger.info(f"Closing idle log stream for container {stream.container_id[:12]}")
+        self._forget(stream)
+        stream.close()
+
+    def _forget(self, stream: LogStream):
+        if self._streams.get(stream.container_id) is stream:
+            del self._streams[stream.container_id]
+
+    def stats(self) -> Dict:
+        return {
+            "streams": len(self._streams),
+            "subscribers": sum(len(stream.subscribers) for stream in self._streams.values()),
+            "sinks": sum(len(stream.sinks) for stream in self._streams.values()),
+        }
+
+
+# 单例模式
+log_hub = LogHub(
+    buffer_lines=int(os.getenv("LOG_BUFFER_LINES", "1000")),
+    queue_size=int(os.getenv("LOG_SUBSCRIBER_QUEUE", "1000")),
+    idle_timeout=float(os.getenv("LOG_IDLE_TIMEOUT", "30")),
+)
@@ -0,0 +1,360 @@
+"""
+容器日志持久化
+
+每个服务器的日志保存在 <DATA_ROOT>/<server_id>/logs/ 下，删除容器或重建后仍可查询：
+    current.log           正在写入的分段（明文，每行 "<RFC3339 时间> <内容>"）
+    seg-<毫秒时间>.log.gz  已封存的分段，由多个独立的 gzip 成员组成
+    index.json            分段索引：时间范围、行数、大小，以及每个 gzip 成员的起始时间和文件偏移
+
+检索时只解压与时间范围重叠的分段，并从最后一个起始时间不晚于 since 的成员处直接 seek。
+每个服务器的已封存分段总大小不超过 LOG_RETENTION_BYTES，超出时删除最旧的分段。
+
+索引在分段封存、容器切换、平台关闭时写入，其余情况最多每 LOG_INDEX_SAVE_INTERVAL 秒写入一次；
+平台异常退出时，最后保存的行时间由 current.log 恢复。
+"""
+import gzip
+import json
+import os
+import re
+import threading
+import time
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+from .docker_manager import docker_manager
+from .log_hub import log_hub, parse_log_line, LogEntry
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_FILE = "current.log"
+INDEX_FILE = "index.json"
+
+# 追加日志时写入索引的最小间隔（秒）
+INDEX_SAVE_INTERVAL = float(os.getenv("LOG_INDEX_SAVE_INTERVAL", "5"))
+
+
+class ServerLogStore:
+    """单个服务器的日志分段存储（线程安全）"""
+
+    def __init__(self, base_path: str, segment_bytes: int, block_bytes: int, retention_bytes: int):
+        self.base_path = base_path
+        self.dir = os.path.join(base_path, "logs")
+        self.segment_bytes = segment_bytes
+        self.block_bytes = block_bytes
+        self.retention_bytes = retention_bytes
+        self._lock = threading.Lock()
+        self._index: Optional[Dict] = None
+        self._active: Optional[Dict] = None   # 当前分段的元数据
+        self._dirty = False                   # 索引有未写入磁盘的变化
+        self._saved_at = 0.0
+
+    # ---------------- 索引 ----------------
+    def _load_index(self) -> Dict:
+        if self._index is None:
+            try:
+                with open(os.path.join(self.dir, INDEX_FILE)) as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {"segments": [], "last": {}}
+        return self._index
+
+    def _save_index(self):
+        tmp = os.path.join(self.dir, INDEX_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp, os.path.join(self.dir, INDEX_FILE))
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+    def flush(self):
+        """写入尚未保存的索引（平台关闭时调用）"""
+        with self._lock:
+            if self._dirty and os.path.isdir(self.dir):
+                self._save_index()
+
+    def last_captured(self, container_id: str) -> Optional[float]:
+        """该容器已保存的最后一行日志的时间，用于断点续传"""
+        with self._lock:
+            if self._active is None and os.path.isdir(self.dir):
+                self._recover_active()
+            last = self._load_index().get("last", {})
+            return last.get("ts") if last.get("container_id") == container_id else None
+
+    # ---------------- 写入 ----------------
+    def append(self, container_id: str, entries: List[LogEntry]) -> bool:
+        """追加日志；服务器目录已被删除时返回 False"""
+        if not entries:
+            return True
+        with self._lock:
+            if not os.path.isdir(self.base_path):
+                return False
+            os.makedirs(self.dir, exist_ok=True)
+            index = self._load_index()
+            if self._active is None:
+                self._recover_active()
+            if self._active is not None and self._active["container_id"] != container_id:
+                self._seal()
+            data = "".join(f"{time_text} {line}\n" for ts, time_text, line in entries if time_text)
+            with open(os.path.join(self.dir, ACTIVE_FILE), "a", encoding="utf-8") as f:
+                f.write(data)
+            stamped = [entry for entry in entries if entry[1]]
+            switched = False
+            if stamped:
+                if self._active is None:
+                    self._active = {"container_id": container_id, "start": stamped[0][0], "lines": 0, "bytes": 0}
+                self._active["end"] = stamped[-1][0]
+                self._active["lines"] += len(stamped)
+                self._active["bytes"] += len(data.encode("utf-8"))
+                switched = index["last"].get("container_id") != container_id
+                index["last"] = {"container_id": container_id, "ts": stamped[-1][0]}
+                self._dirty = True
+            if self._active is not None and self._active["bytes"] >= self.segment_bytes:
+                self._seal()
+            elif switched or (self._dirty and time.monotonic() - self._saved_at >= INDEX_SAVE_INTERVAL):
+                # 恢复 current.log 时依赖索引中的 container_id，切换容器时立即写入
+                self._save_index()
+            return True
+
+    def seal(self):
+        """封存当前分段（容器停止时调用）"""
+        with self._lock:
+            if not os.path.isdir(self.dir):
+                return
+            self._load_index()
+            if self._active is None:
+                self._recover_active()
+            if self._active is not None:
+                self._seal()
+
+    def _recover_active(self):
+        """从磁盘上残留的 current.log 恢复元数据（如平台重启）"""
+        path = os.path.join(self.dir, ACTIVE_FILE)
+        if not os.path.exists(path):
+            return
+        first = last = None
+        lines = 0
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for raw in f:
+                entry = parse_log_line(raw.rstrip("\n"))
+                if entry[1]:
+                    first = first if first is not None else entry[0]
+                    last = entry[0]
+                    lines += 1
+        if first is None:
+            os.remove(path)
+            return
+        index_last = self._load_index().setdefault("last", {})
+        self._active = {
+            "container_id": index_last.get("container_id"),
+            "start": first, "end": last, "lines": lines, "bytes": os.path.getsize(path)
+        }
+        # 索引按间隔写入，异常退出时可能落后于 current.log
+        if index_last.get("container_id") and last > (index_last.get("ts") or 0):
+            index_last["ts"] = last
+            self._dirty = True
+
+    def _seal(self):
+        """将 current.log 压缩为分段，每 block_bytes 明文开始一个新的 gzip 成员并记录偏移"""
+        active_path = os.path.join(self.dir, ACTIVE_FILE)
+        name = f"seg-{int(self._active['start'] * 1000)}.log.gz"
+        blocks: List[Tuple[float, int]] = []
+        with open(active_path, "rb") as src, open(os.path.join(self.dir, name), "wb") as dst:
+            member = None
+            member_bytes = 0
+            for raw in src:
+                if member is None or member_bytes >= self.block_bytes:
+                    if member is not None:
+                        member.close()
+                    entry = parse_log_line(raw.decode("utf-8", errors="replace").rstrip("\n"))
+                    blocks.append((entry[0], dst.tell()))
+                    member = gzip.GzipFile(fileobj=dst, mode="wb")
+                    member_bytes = 0
+                member.write(raw)
+                member_bytes += len(raw)
+            if member is not None:
+                member.close()
+        os.remove(active_path)
+        segment = dict(self._active, file=name, blocks=blocks, size=os.path.getsize(os.path.join(self.dir, name)))
+        self._index["segments"].append(segment)
+        self._active = None
+        self._enforce_retention()
+        self._save_index()
+
+    def _enforce_retention(self):
+        segments = self._index["segments"]
+        total = sum(segment["size"] for segment in segments)
+        while segments and total > self.retention_bytes:
+            oldest = segments.pop(0)
+            total -= oldest["size"]
+            try:
+                os.remove(os.path.join(self.dir, oldest["file"]))
+            except OSError:
+                pass
+
+    # ---------------- 检索 ----------------
+    def search(self,
+               pattern: Optional[str] = None,
+               regex: bool = False,
+               ignore_case: bool = False,
+               since: Optional[float] = None,
+               until: Optional[float] = None,
+               limit: int = 200) -> Dict:
+        """按时间范围和关键字（或正则）检索日志，按时间顺序返回最早的 limit 条"""
+        flags = re.IGNORECASE if ignore_case else 0
+        matcher = re.compile(pattern if regex else re.escape(pattern), flags) if pattern else None
+
+        with self._lock:
+            index = self._load_index()
+            segments = [dict(segment) for segment in index["segments"]]
+            if self._active is None and os.path.isdir(self.dir):
+                self._recover_active()
+            active = dict(self._active) if self._active else None
+
+        matches = []
+        scanned = 0
+        for segment in segments:
+            if (since is not None and segment["end"] < since) or (until is not None and segment["start"] > until):
+                continue
+            scanned += 1
+            if self._scan(self._read_segment(segment, since), matcher, since, until, limit, matches):
+                return {"matches": matches, "truncated": True, "scanned_segments": scanned}
+        if active and not ((since is not None and active["end"] < since) or (until is not None and active["start"] > until)):
+            scanned += 1
+            if self._scan(self._read_active(), matcher, since, until, limit, matches):
+                return {"matches": matches, "truncated": True, "scanned_segments": scanned}
+        return {"matches": matches, "truncated": False, "scanned_segments": scanned}
+
+    def _read_segment(self, segment: Dict, since: Optional[float]):
+        offset = 0
+        if since is not None:
+            for first_ts, block_offset in segment["blocks"]:
+                if first_ts > since:
+                    break
+                offset = block_offset
+        try:
+            with open(os.path.join(self.dir, segment["file"]), "rb") as f:
+                f.seek(offset)
+                with gzip.GzipFile(fileobj=f, mode="rb") as member:
+                    for raw in member:
+                        yield raw.decode("utf-8", errors="replace").rstrip("\n")
+        except FileNotFoundError:
+            return  # 已被保留策略删除
+
+    def _read_active(self):
+        try:
+            with open(os.path.join(self.dir, ACTIVE_FILE), encoding="utf-8", errors="replace") as f:
+                for raw in f:
+                    yield raw.rstrip("\n")
+        except FileNotFoundError:
+            return
+
+    @staticmethod
+    def _scan(lines, matcher, since, until, limit, matches) -> bool:
+        """扫描一个分段，返回 True 表示已达到 limit"""
+        for raw in lines:
+            ts, time_text, line = parse_log_line(raw)
+            if since is not None and ts < since:
+                continue
+            if until is not None and ts > until:
+                return False  # 分段内按时间有序
+            if matcher is None or matcher.search(line):
+                matches.append({"time": time_text, "line": line})
+                if len(matches) >= limit:
+                    return True
+        return False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            index = self._load_index()
+            return {
+                "segments": len(index["segments"]),
+                "bytes": sum(segment["size"] for segment in index["segments"]),
+                "active_bytes": self._active["bytes"] if self._active else 0,
+                "oldest": index["segments"][0]["start"] if index["segments"] else None,
+            }
+
+
+class LogCapture:
+    """
+    日志采集：以 sink 的形式挂在 log_hub 的容器日志流上写入 ServerLogStore，
+    每个容器只有一条 Docker 日志流和一个读取线程，查看实时日志不再另开日志流
+    容器退出后日志流结束，当前分段随即封存
+    """
+
+    SINK_NAME = "capture"
+
+    def __init__(self, segment_bytes: int, block_bytes: int, retention_bytes: int):
+        self.segment_bytes = segment_bytes
+        self.block_bytes = block_bytes
+        self.retention_bytes = retention_bytes
+        self.data_root: Optional[str] = None
+        self._lock = threading.Lock()
+        self._stores: Dict[str, ServerLogStore] = {}
+        self._captures: Set[str] = set()   # 正在采集的 container_id
+
+    def start(self, data_root: str, running: List[Tuple[str, str]]):
+        """平台启动时为运行中的服务器恢复采集；running 为 [(server_id, container_id)]"""
+        self.data_root = data_root
+        for server_id, container_id in running:
+            self.capture(server_id, container_id)
+
+    def store(self, server_id: str) -> ServerLogStore:
+        with self._lock:
+            store = self._stores.get(server_id)
+            if store is None:
+                store = ServerLogStore(
+                    os.path.join(self.data_root, server_id),
+                    self.segment_bytes, self.block_bytes, self.retention_bytes
+                )
+                self._stores[server_id] = store
+            return store
+
+    def stop(self):
+        """平台关闭时写入所有未保存的索引"""
+        with self._lock:
+            stores = list(self._stores.values())
+        for store in stores:
+            try:
+                store.flush()
+            except OSError as e:
+                logger.error(f"Failed to save log index for {store.base_path}: {e}")
+
+    def forget(self, server_id: str):
+        """服务器删除后丢弃缓存的存储对象"""
+        with self._lock:
+            self._stores.pop(server_id, None)
+
+    def capture(self, server_id: str, container_id: str):
+        """开始采集容器日志（在事件循环线程中调用；同一容器重复调用无副作用）"""
+        if self.data_root is None or not docker_manager.client:
+            return
+        store = self.store(server_id)
+        since = store.last_captured(container_id)
+
+        def write(entries: List[LogEntry]) -> bool:
+            if since is not None:
+                # since 精度为秒级，跳过已经保存过的行
+                entries = [entry for entry in entries if entry[0] > since]
+            return store.append(container_id, entries)
+
+        def end():
+            with self._lock:
+                self._captures.discard(container_id)
+            store.seal()
+
+        with self._lock:
+            self._captures.add(container_id)
+        if not log_hub.attach(container_id, self.SINK_NAME, (write, end), since=since):
+            logger.debug(f"Log capture for container {container_id[:12]} already attached")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"capturing": len(self._captures)}
+
+
+# 单例模式
+log_capture = LogCapture(
+    segment_bytes=int(os.getenv("LOG_SEGMENT_BYTES", str(4 * 1024 * 1024))),
+    block_bytes=int(os.getenv("LOG_INDEX_BLOCK_BYTES", str(64 * 1024))),
+    retention_bytes=int(os.getenv("LOG_RETENTION_BYTES", str(50 * 1024 * 1024))),
+)
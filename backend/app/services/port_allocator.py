@@ -0,0 +1,264 @@
+import socket
+import threading
+import logging
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 端口池范围（左闭右开）
+PORT_POOL_START = 30000
+PORT_POOL_END = 40000
+
+
+class FreeRunTree:
+    """
+    端口池空闲区间线段树
+
+    每个节点记录区间内前缀空闲长度、后缀空闲长度、最长连续空闲长度和空闲段数，
+    单个端口占用/释放时自底向上更新 O(log n)，根节点即为整个端口池的统计，查询 O(1)。
+    补齐到 2 的幂的多余叶子视为已占用。
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._leaves = 1
+        while self._leaves < max(size, 1):
+            self._leaves *= 2
+        self.build(bytearray(size))
+
+    def build(self, bitmap: bytearray):
+        """按位图（1 表示已占用）整体重建，O(n)"""
+        n = 2 * self._leaves
+        self._pre = [0] * n
+        self._suf = [0] * n
+        self._best = [0] * n
+        self._runs = [0] * n
+        for i in range(self.size):
+            if not bitmap[i]:
+                self._set_leaf(self._leaves + i, True)
+        length = 1
+        node_end = self._leaves
+        while node_end > 1:
+            length *= 2
+            for node in range(node_end // 2, node_end):
+                self._pull(node, length // 2)
+            node_end //= 2
+
+    def _set_leaf(self, node: int, free: bool):
+        value = 1 if free else 0
+        self._pre[node] = self._suf[node] = self._best[node] = self._runs[node] = value
+
+    def _pull(self, node: int, half: int):
+        left, right = 2 * node, 2 * node + 1
+        pre, suf = self._pre, self._suf
+        pre[node] = pre[left] if pre[left] < half else half + pre[right]
+        suf[node] = suf[right] if suf[right] < half else half + suf[left]
+        self._best[node] = max(self._best[left], self._best[right], suf[left] + pre[right])
+        self._runs[node] = self._runs[left] + self._runs[right] - (1 if suf[left] and pre[right] else 0)
+
+    def update(self, index: int, free: bool):
+        node = self._leaves + index
+        self._set_leaf(node, free)
+        half = 1
+        node //= 2
+        while node:
+            self._pull(node, half)
+            half *= 2
+            node //= 2
+
+    @property
+    def largest_free_run(self) -> int:
+        return self._best[1]
+
+    @property
+    def free_runs(self) -> int:
+        return self._runs[1]
+
+    def first_free(self, start: int = 0) -> Optional[int]:
+        """返回 >= start 的第一个空闲位置，没有时返回 None，O(log n)"""
+        return self._first_free(1, 0, self._leaves, start)
+
+    def _first_free(self, node: int, lo: int, hi: int, start: int) -> Optional[int]:
+        if hi <= start or not self._best[node]:
+            return None
+        if hi - lo == 1:
+            return lo
+        mid = (lo + hi) // 2
+        found = self._first_free(2 * node, lo, mid, start)
+        if found is None:
+            found = self._first_free(2 * node + 1, mid, hi, start)
+        return found
+
+
+class PortAllocator:
+    """
+    宿主机端口分配器
+
+    - 端口池内的占用状态保存在 bytearray 位图中（每个端口 1 字节，1 万个端口约 10KB）
+    - 空闲端口维护在一个 deque 空闲链表中，allocate/release 均为 O(1)（均摊）
+    - 空闲链表采用惰性删除：reserve 只改位图，allocate 弹出时再跳过已占用的端口
+    - 每个端口在空闲链表中最多出现一次（_queued 位图记录是否已在链表中），
+      反复 reserve/release 同一端口不会让链表无限增长，链表长度不超过端口池大小
+    - 只对最终选中的那一个端口做 socket 探测，探测失败的端口标记为系统占用
+    - 端口池之外的端口（用户手工指定，如 8080）只记录归属，不进入位图
+    - 已分配数量和空闲区间线段树随占用/释放增量维护，stats 为 O(1)
+    """
+
+    # 系统（非平台管理）占用端口的归属标识
+    SYSTEM_OWNER = "__system__"
+
+    def __init__(self, start_port: int = PORT_POOL_START, end_port: int = PORT_POOL_END):
+        self.start_port = start_port
+        self.end_port = end_port
+        self._lock = threading.Lock()
+        self._bitmap = bytearray(end_port - start_port)
+        self._free: deque = deque(range(start_port, end_port))
+        self._queued = bytearray(b"\x01") * (end_port - start_port)  # 端口是否已在 _free 中
+        self._owners: Dict[int, str] = {}          # port -> owner
+        self._by_owner: Dict[str, Set[int]] = {}   # owner -> {port}
+        self._allocated = 0                        # 端口池内已占用的端口数
+        self._tree = FreeRunTree(end_port - start_port)
+        self._loaded = False
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def _in_pool(self, port: int) -> bool:
+        return self.start_port <= port < self.end_port
+
+    @staticmethod
+    def probe(port: int) -> bool:
+        """socket 探测端口是否空闲（True 表示空闲）"""
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            return s.connect_ex(('localhost', port)) != 0
+
+    def _mark(self, port: int, owner: str):
+        self._owners[port] = owner
+        self._by_owner.setdefault(owner, set()).add(port)
+        if self._in_pool(port) and not self._bitmap[port - self.start_port]:
+            self._bitmap[port - self.start_port] = 1
+            self._allocated += 1
+            self._tree.update(port - self.start_port, False)
+
+    def _unmark(self, port: int):
+        owner = self._owners.pop(port, None)
+        if owner is not None:
+            ports = self._by_owner.get(owner)
+            if ports is not None:
+                ports.discard(port)
+                if not ports:
+                    del self._by_owner[owner]
+        if self._in_pool(port) and self._bitmap[port - self.start_port]:
+            self._bitmap[port - self.start_port] = 0
+            self._allocated -= 1
+            self._tree.update(port - self.start_port, True)
+            # 仍在链表中（reserve 后惰性删除未弹出）的端口不重复入队
+            if not self._queued[port - self.start_port]:
+                self._queued[port - self.start_port] = 1
+                self._free.append(port)
+
+    def rebuild(self, reservations: Iterable[Tuple[int, str]]):
+        """根据数据库记录和 Docker 实际绑定重建分配表"""
+        with self._lock:
+            self._bitmap = bytearray(self.end_port - self.start_port)
+            self._owners.clear()
+            self._by_owner.clear()
+            for port, owner in reservations:
+                # 同一端口出现多次时以首次出现的归属为准（数据库记录优先于 Docker 绑定）
+                if port not in self._owners:
+                    self._owners[port] = owner
+                    self._by_owner.setdefault(owner, set()).add(port)
+                    if self._in_pool(port):
+                        self._bitmap[port - self.start_port] = 1
+            self._allocated = sum(self._bitmap)
+            self._tree.build(self._bitmap)
+            self._free = deque(
+                p for p in range(self.start_port, self.end_port)
+                if not self._bitmap[p - self.start_port]
+            )
+            self._queued = bytearray(1 - used for used in self._bitmap)
+            self._loaded = True
+        logger.info(f"Port allocator loaded: {len(self._owners)} ports reserved")
+
+    def owner_of(self, port: int) -> Optional[str]:
+        with self._lock:
+            return self._owners.get(port)
+
+    def ports_of(self, owner: str) -> List[int]:
+        with self._lock:
+            return sorted(self._by_owner.get(owner, ()))
+
+    def reserve(self, port: int, owner: str) -> bool:
+        """为 owner 预留指定端口，若已被其他 owner 占用返回 False"""
+        with self._lock:
+            current = self._owners.get(port)
+            if current is not None and current != owner:
+                return False
+            self._mark(port, owner)
+            return True
+
+    def allocate(self, owner: str) -> Optional[int]:
+        """从端口池中分配一个空闲端口，只对选中的端口做 socket 探测"""
+        with self._lock:
+            while self._free:
+                port = self._free.popleft()
+                self._queued[port - self.start_port] = 0
+                if self._bitmap[port - self.start_port]:
+                    continue  # 惰性删除：已被 reserve 的端口
+                if not self.probe(port):
+                    # 被平台之外的进程占用，记为系统占用，避免下次再探测
+                    self._mark(port, self.SYSTEM_OWNER)
+                    continue
+                self._mark(port, owner)
+                return port
+            return None
+
+    def release(self, port: int, owner: Optional[str] = None):
+        """释放端口；指定 owner 时只释放属于该 owner 的端口"""
+        with self._lock:
+            if owner is not None and self._owners.get(port) != owner:
+                return
+            self._unmark(port)
+
+    def release_owner(self, owner: str):
+        """释放 owner 名下的全部端口"""
+        with self._lock:
+            for port in list(self._by_owner.get(owner, ())):
+                self._unmark(port)
+
+    def sample_free(self, limit: int = 20) -> List[int]:
+        """从空闲区间线段树中按端口顺序取出若干空闲端口示例（不做 socket 探测），O(limit·log n)"""
+        result = []
+        with self._lock:
+            index = self._tree.first_free(0)
+            while index is not None and len(result) < limit:
+                result.append(self.start_port + index)
+                index = self._tree.first_free(index + 1)
+        return result
+
+    def assignments(self) -> Dict[str, List[int]]:
+        """按归属列出已占用的端口：{owner: [port]}"""
+        with self._lock:
+            return {owner: sorted(ports) for owner, ports in self._by_owner.items()}
+
+    def stats(self) -> Dict[str, float]:
+        """端口池统计，均为增量维护的计数，O(1)"""
+        with self._lock:
+            total = self.end_port - self.start_port
+            free = total - self._allocated
+            largest = self._tree.largest_free_run
+            return {
+                "total_ports": total,
+                "allocated_ports_count": self._allocated,
+                "available_ports_count": free,
+                "largest_free_run": largest,
+                "free_runs": self._tree.free_runs,
+                # 碎片率：空闲端口中不在最长连续空闲区间内的比例
+                "fragmentation": round(1 - largest / free, 4) if free else 0.0,
+            }
+
+
+# 单例模式
+port_allocator = PortAllocator()
@@ -0,0 +1,143 @@
+"""
+服务器端口预留
+
+端口预留保存在 port_reservations 表中（port 唯一索引），取代原先 mcp_servers.ports 的逗号分隔字符串：
+- 冲突检测和端口池统计是按索引的查询，不再逐行解析字符串
+- 预留/释放与服务器的修改在同一事务中提交；并发请求争抢同一端口时由唯一索引保证只有一个成功
+- 这里的函数只修改会话，不提交；提交失败（IntegrityError）时用 is_conflict 判断是否为端口冲突
+
+内存中的 port_allocator 仍负责自动分配和预热容器等非服务器占用，启动时从本表重建。
+"""
+import logging
+from typing import Dict, Iterable, List
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+# 配置端口映射到的容器端口从 8000 起递增（与 docker_manager.run_container 一致）
+CONTAINER_PORT_BASE = 8000
+
+
+class PortConflictError(ValueError):
+    """端口已被其他服务器预留"""
+
+    def __init__(self, port: int, server_id: str):
+        super().__init__(f"Port {port} is reserved by server {server_id}")
+        self.port = port
+        self.server_id = server_id
+
+
+def owners(db: Session, ports: Iterable[int]) -> Dict[int, str]:
+    """查询端口的归属服务器：{port: server_id}，未预留的端口不在结果中"""
+    ports = list(ports)
+    if not ports:
+        return {}
+    return dict(
+        db.query(models.PortReservation.port, models.PortReservation.server_id)
+        .filter(models.PortReservation.port.in_(ports)).all()
+    )
+
+
+def set_configured(db: Session, server: models.MCPServer, ports: List[int], auto_assigned: bool = False):
+    """
+    将服务器配置的端口替换为 ports（保持顺序）；有端口属于其他服务器时抛出 PortConflictError
+    auto_assigned 表示端口由平台自动分配（而非用户指定）
+    """
+    for port, owner in owners(db, ports).items():
+        if owner != server.id:
+            raise PortConflictError(port, owner)
+    existing = {r.port: r for r in server.port_reservations}
+    for reservation in list(server.port_reservations):
+        if reservation.kind == models.PortReservation.CONFIGURED and reservation.port not in ports:
+            server.port_reservations.remove(reservation)
+    for index, port in enumerate(ports):
+        reservation = existing.get(port)
+        if reservation is None:
+            reservation = models.PortReservation(port=port)
+            server.port_reservations.append(reservation)
+        reservation.kind = models.PortReservation.CONFIGURED
+        reservation.container_port = CONTAINER_PORT_BASE + index
+        reservation.auto_assigned = auto_assigned
+
+
+def pinned_ports(server: models.MCPServer) -> List[int]:
+    """用户指定的固定端口（不含自动分配的端口）"""
+    return [
+        r.port for r in server.port_reservations
+        if r.kind == models.PortReservation.CONFIGURED and not r.auto_assigned
+    ]
+
+
+def record_runtime(db: Session, server: models.MCPServer, port_mappings: Dict[int, int]):
+    """记录容器实际绑定的端口（{container_port: host_port}）中不属于配置端口的部分"""
+    bound = {int(host): int(container) for container, host in port_mappings.items()}
+    # 仍在使用的行原样保留：同一端口先删后插会在 flush 时违反唯一索引
+    for reservation in list(server.port_reservations):
+        if reservation.kind == models.PortReservation.RUNTIME and reservation.port not in bound:
+            server.port_reservations.remove(reservation)
+    existing = {r.port for r in server.port_reservations}
+    extra = {port: container for port, container in bound.items() if port not in existing}
+    taken = owners(db, extra)
+    for host_port, container_port in extra.items():
+        if host_port in taken:
+            # 分配器保证不会发生，出现时说明数据不一致，不阻止容器启动
+            logger.warning(f"Runtime port {host_port} of server {server.id} is reserved by server {taken[host_port]}")
+            continue
+        server.port_reservations.append(models.PortReservation(
+            port=host_port, kind=models.PortReservation.RUNTIME, container_port=container_port
+        ))
+
+
+def release_runtime(server: models.MCPServer):
+    """释放容器运行时绑定的端口（容器停止或消失时调用）"""
+    for reservation in list(server.port_reservations):
+        if reservation.kind == models.PortReservation.RUNTIME:
+            server.port_reservations.remove(reservation)
+
+
+def is_conflict(error: IntegrityError) -> bool:
+    """提交失败是否由端口唯一索引冲突引起"""
+    return "port_reservations" in str(error.orig)
+
+
+def _parse_legacy_ports(value: str) -> List[int]:
+    try:
+        return [int(p.strip()) for p in value.split(",") if p.strip()]
+    except ValueError:
+        logger.warning(f"Failed to parse legacy ports: {value}")
+        return []
+
+
+def backfill_legacy(db: Session) -> int:
+    """
+    旧版本数据库的 mcp_servers.ports 字符串转换为端口预留，转换后清空该列（只执行一次）
+    返回转换的端口数
+    """
+    columns = {c["name"] for c in inspect(db.get_bind()).get_columns("mcp_servers")}
+    if "ports" not in columns:
+        return 0
+    rows = db.execute(text("SELECT id, ports FROM mcp_servers WHERE ports IS NOT NULL AND ports != ''")).fetchall()
+    if not rows:
+        return 0
+    taken = dict(db.query(models.PortReservation.port, models.PortReservation.server_id).all())
+    count = 0
+    for server_id, value in rows:
+        for index, port in enumerate(_parse_legacy_ports(value)):
+            if port in taken:
+                logger.warning(f"Port {port} of server {server_id} is already reserved by server {taken[port]}, skipped")
+                continue
+            taken[port] = server_id
+            db.add(models.PortReservation(
+                port=port, server_id=server_id,
+                kind=models.PortReservation.CONFIGURED, container_port=CONTAINER_PORT_BASE + index
+            ))
+            count += 1
+    db.execute(text("UPDATE mcp_servers SET ports = NULL"))
+    db.commit()
+    logger.info(f"Converted {count} legacy port reservations of {len(rows)} servers")
+    return count
@@ -0,0 +1,111 @@
+"""
+服务器就绪探测
+
+容器创建成功不代表用户代码已经加载：bootstrap 可能在导入时崩溃，或者加载大型依赖需要较长时间。
+启动时可选择等待就绪，探测方式：
+- http（默认）：反复请求 SSE 端点（GET /sse），只有收到 HTTP 响应状态才视为就绪
+- tcp：用于不提供 HTTP 的自定义启动命令，连接建立后短时间内未被对端关闭即视为就绪
+
+宿主机端口模式下 docker-proxy 总会先接受连接，后端无进程监听时再立即关闭，
+因此连接被关闭、协议错误等传输层错误一律视为尚未就绪。
+探测期间定期检查容器状态，容器已退出时立即失败，不必等到超时。
+"""
+import asyncio
+import os
+import time
+import logging
+from typing import Optional
+
+import httpx
+
+from .docker_manager import docker_manager
+from .docker_executor import docker_executor
+
+logger = logging.getLogger(__name__)
+
+# 默认是否等待就绪，以及等待的最长时间（秒）
+WAIT_READY_DEFAULT = os.getenv("SERVER_WAIT_READY", "false").lower() in ("1", "true", "yes")
+READY_TIMEOUT = float(os.getenv("SERVER_READY_TIMEOUT", "30"))
+READY_PROBE_DEFAULT = os.getenv("SERVER_READY_PROBE", "http")
+
+PROBE_MODES = ("http", "tcp")
+
+PROBE_PATH = "/sse"
+PROBE_INTERVAL = 0.1
+# tcp 模式下连接保持打开多久视为有进程在监听
+TCP_HOLD_SECONDS = 0.2
+# 每隔多少秒检查一次容器是否已退出
+CONTAINER_CHECK_INTERVAL = 1.0
+
+
+class ReadinessError(RuntimeError):
+    """服务器在期限内未就绪"""
+
+    def __init__(self, message: str, exited: bool = False):
+        super().__init__(message)
+        self.exited = exited
+
+
+def _container_exit(container_id: str) -> Optional[str]:
+    """容器已退出时返回退出码和最后几行日志，仍在运行时返回 None"""
+    container = docker_manager.client.containers.get(container_id)
+    if container.status in ("created", "running", "restarting"):
+        return None
+    exit_code = container.attrs.get("State", {}).get("ExitCode")
+    output = container.logs(tail=10).decode("utf-8", errors="replace").strip()
+    return f"Container exited with code {exit_code}: {output}"
+
+
+async def _probe_http(client: httpx.AsyncClient, host: str, port: int) -> bool:
+    try:
+        async with client.stream("GET", f"http://{host}:{port}{PROBE_PATH}") as response:
+            return response.status_code < 500
+    except httpx.TransportError:
+        # 包括连接被 docker-proxy 接受后立即关闭（RemoteProtocolError）和响应头超时
+        return False
+
+
+async def _probe_tcp(host: str, port: int) -> bool:
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout=2.0)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    try:
+        # 对端立即关闭（读到 EOF）说明后端没有进程监听
+        data = await asyncio.wait_for(reader.read(1), timeout=TCP_HOLD_SECONDS)
+        return data != b""
+    except asyncio.TimeoutError:
+        return True
+    except OSError:
+        return False
+    finally:
+        writer.close()
+
+
+async def wait_until_ready(
+    host: str, port: int, container_id: str, timeout: float = READY_TIMEOUT, mode: str = READY_PROBE_DEFAULT
+) -> float:
+    """等待服务器就绪，返回等待的秒数；超时或容器退出时抛出 ReadinessError"""
+    if mode not in PROBE_MODES:
+        raise ValueError(f"Unknown readiness probe mode: {mode}")
+    started_at = time.monotonic()
+    deadline = started_at + timeout
+    next_check = started_at + CONTAINER_CHECK_INTERVAL
+    async with httpx.AsyncClient(timeout=httpx.Timeout(2.0, read=2.0)) as client:
+        while True:
+            ready = await _probe_http(client, host, port) if mode == "http" else await _probe_tcp(host, port)
+            if ready:
+                return time.monotonic() - started_at
+            now = time.monotonic()
+            if now >= next_check:
+                next_check = now + CONTAINER_CHECK_INTERVAL
+                try:
+                    exited = await docker_executor.run(_container_exit, container_id)
+                except Exception as e:
+                    logger.warning(f"Failed to inspect container {container_id[:12]} during readiness probe: {e}")
+                    exited = None
+                if exited:
+                    raise ReadinessError(exited, exited=True)
+            if now >= deadline:
+                raise ReadinessError(f"Server did not become ready within {timeout:g}s")
+            await asyncio.sleep(PROBE_INTERVAL)
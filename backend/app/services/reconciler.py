@@ -0,0 +1,334 @@
+import os
+import re
+import queue
+import threading
+import time
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import case
+
+from .. import models
+from ..database import SessionLocal
+from .docker_manager import docker_manager, LABEL_SERVER_ID, CONTAINER_NAME_PREFIX
+from .docker_state import docker_state
+from .port_allocator import port_allocator
+from . import port_reservations
+from .gateway import gateway
+
+logger = logging.getLogger(__name__)
+
+# 需要同步到数据库的容器事件
+RECONCILE_ACTIONS = {"start", "die", "oom", "destroy"}
+
+# OOM 被杀时 Docker 报告的退出码
+OOM_EXIT_CODE = 137
+
+# BUILDING 状态超过该时长（秒）视为任务中断（如进程重启），交由对账修正
+BUILDING_STALE_SECONDS = float(os.getenv("BUILDING_STALE_SECONDS", "900"))
+
+# 主动停止的容器在该时长（秒）内退出不视为崩溃
+EXPECTED_STOP_SECONDS = 300
+
+_EXITED_RE = re.compile(r"Exited \((-?\d+)\)")
+
+_NOT_BUILDING = models.MCPServer.status != models.ServerStatus.BUILDING
+
+
+def _main_host_port(port_list: List[Dict]) -> Optional[int]:
+    """从容器列表接口的 Ports 中取出主端口（容器内 8000）对应的宿主机端口"""
+    for binding in port_list or []:
+        if binding.get("PrivatePort") == 8000 and binding.get("PublicPort"):
+            return int(binding["PublicPort"])
+    return None
+
+
+def _parse_exit_code(status_text: str) -> Optional[int]:
+    match = _EXITED_RE.search(status_text or "")
+    return int(match.group(1)) if match else None
+
+
+class Reconciler:
+    """
+    容器状态对账
+
+    - 订阅 Docker 的 start/die/oom/destroy 事件，放入队列后由后台线程批量写库
+    - 定期按服务器标签一次性列出所有平台容器，修正事件遗漏导致的状态偏差
+    - 只处理与数据库中 container_id 一致的容器，避免旧容器的事件覆盖新状态
+    - 处于 BUILDING 状态的服务器由生命周期任务负责，对账时跳过（超时未完成的除外），
+      start 事件也不会提前把状态改为 RUNNING（就绪探测可能尚未完成）；
+      该判断写在 UPDATE 语句的条件中，读取之后任务才写入的 BUILDING 也不会被覆盖
+    - 生命周期操作主动停止的容器（expect_stop）退出时记为 STOPPED，不记录 SIGTERM/SIGKILL 退出码
+    """
+
+    def __init__(self, interval: float = 30.0, flush_interval: float = 1.0):
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self._events: "queue.Queue[Dict]" = queue.Queue()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._expected_stops: Dict[str, float] = {}  # container_id -> 过期时间
+        self._expected_lock = threading.Lock()
+
+    def expect_stop(self, container_id: str):
+        """登记即将主动停止的容器"""
+        with self._expected_lock:
+            self._expected_stops[container_id] = time.monotonic() + EXPECTED_STOP_SECONDS
+
+    def _is_expected_stop(self, container_id: Optional[str], forget: bool = False) -> bool:
+        now = time.monotonic()
+        with self._expected_lock:
+            for expired in [cid for cid, deadline in self._expected_stops.items() if deadline < now]:
+                del self._expected_stops[expired]
+            if forget:
+                return self._expected_stops.pop(container_id, None) is not None
+            return container_id in self._expected_stops
+
+    def start(self):
+        if not docker_manager.client or self._thread:
+            return
+        docker_state.subscribe(self.on_event)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="reconciler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def on_event(self, event: Dict):
+        """Docker 事件回调（在事件线程中执行，只入队）"""
+        action = event.get("Action") or event.get("status") or ""
+        if action not in RECONCILE_ACTIONS:
+            return
+        attributes = event.get("Actor", {}).get("Attributes", {})
+        if not attributes.get(LABEL_SERVER_ID) and not attributes.get("name", "").startswith(CONTAINER_NAME_PREFIX):
+            return
+        self._events.put(event)
+
+    # ------------------------------------------------------------------
+    # 后台线程
+    # ------------------------------------------------------------------
+    def _loop(self):
+        elapsed = self.interval  # 启动后立即做一次全量对账
+        while not self._stop.is_set():
+            batch = self._drain()
+            if batch:
+                try:
+                    self.apply_events(batch)
+                except Exception as e:
+                    logger.error(f"Failed to apply {len(batch)} container events: {e}")
+            if elapsed >= self.interval:
+                elapsed = 0.0
+                try:
+                    self.reconcile_all()
+                except Exception as e:
+                    logger.error(f"Periodic reconcile failed: {e}")
+            self._stop.wait(self.flush_interval)
+            elapsed += self.flush_interval
+
+    def _drain(self) -> List[Dict]:
+        batch = []
+        while True:
+            try:
+                batch.append(self._events.get_nowait())
+            except queue.Empty:
+                return batch
+
+    # ------------------------------------------------------------------
+    # 事件批量写库
+    # ------------------------------------------------------------------
+    def apply_events(self, events: List[Dict]):
+        # 按服务器合并事件，同一个容器的 oom 标记在随后的 die 中生效
+        changes: Dict[str, Dict] = {}
+        names: Dict[str, str] = {}
+        for event in events:
+            action = event.get("Action") or event.get("status")
+            actor = event.get("Actor", {})
+            attributes = actor.get("Attributes", {})
+            container_id = actor.get("ID") or event.get("id")
+            server_id = attributes.get(LABEL_SERVER_ID)
+            key = server_id or f"name:{attributes.get('name', '')}"
+            if not server_id:
+                names[key] = attributes.get("name", "")[len(CONTAINER_NAME_PREFIX):]
+            change = changes.get(key)
+            if change is None or change["container_id"] != container_id:
+                change = {"container_id": container_id, "oom": False, "actions": []}
+                changes[key] = change
+            if action == "oom":
+                change["oom"] = True
+                continue
+            if action == "start":
+                summary = docker_state.get_container(container_id) or {}
+                change["host_port"] = _main_host_port(summary.get("Ports"))
+                change["ip"] = docker_manager.container_ip(summary)
+            elif action == "die":
+                exit_code = attributes.get("exitCode")
+                change["exit_code"] = int(exit_code) if exit_code is not None else None
+            change["actions"].append(action)
+
+        db = SessionLocal()
+        try:
+            ids = [k for k in changes if not k.startswith("name:")]
+            servers = {}
+            if ids:
+                for server in db.query(models.MCPServer).filter(models.MCPServer.id.in_(ids)):
+                    servers[server.id] = server
+            if names:
+                for server in db.query(models.MCPServer).filter(models.MCPServer.name.in_(list(names.values()))):
+                    servers[f"name:{CONTAINER_NAME_PREFIX}{server.name}"] = server
+                # 预热池容器没有服务器标签，按 container_id 匹配
+                unmatched = {changes[k]["container_id"]: k for k in names if k not in servers}
+                if unmatched:
+                    for server in db.query(models.MCPServer).filter(
+                        models.MCPServer.container_id.in_(list(unmatched))
+                    ):
+                        servers[unmatched[server.container_id]] = server
+            for key, change in changes.items():
+                server = servers.get(key)
+                if server is not None:
+                    for action in change["actions"]:
+                        self._apply_change(db, server, action, change)
+            db.commit()
+        finally:
+            db.close()
+
+    @staticmethod
+    def _update(db, server: models.MCPServer, values: Dict, *conditions) -> bool:
+        """
+        条件满足时写入服务器字段，返回是否写入
+
+        条件在 UPDATE 语句中判断，不依赖之前读取到的对象状态；写入后对象过期，下次访问重新读取
+        """
+        rows = db.query(models.MCPServer).filter(models.MCPServer.id == server.id, *conditions).update(
+            values, synchronize_session=False
+        )
+        db.expire(server)
+        return rows > 0
+
+    def _apply_change(self, db, server: models.MCPServer, action: str, change: Dict):
+        container_id = change["container_id"]
+        if action == "start":
+            values = {"container_id": container_id, "status": models.ServerStatus.RUNNING, "exit_code": None}
+            if change.get("host_port"):
+                values["host_port"] = change["host_port"]
+            if change.get("ip"):
+                values["container_ip"] = change["ip"]
+            if not self._update(db, server, values, _NOT_BUILDING):
+                return  # 由生命周期任务在就绪后置为 RUNNING 并注册路由
+            if change.get("host_port"):
+                port_allocator.reserve(change["host_port"], server.id)
+            gateway.routes.set_server(server)
+            return
+        if server.container_id != container_id:
+            return  # 旧容器的事件
+        same_container = models.MCPServer.container_id == container_id
+        if action == "die":
+            gateway.routes.remove(server.name)
+            if not change["oom"] and self._is_expected_stop(container_id):
+                self._update(db, server, {"status": models.ServerStatus.STOPPED}, same_container, _NOT_BUILDING)
+                return
+            exit_code = change.get("exit_code")
+            if change["oom"] and exit_code is None:
+                exit_code = OOM_EXIT_CODE
+            crashed = change["oom"] or (exit_code not in (None, 0))
+            status = models.ServerStatus.ERROR if crashed else models.ServerStatus.STOPPED
+            self._update(db, server, {
+                "exit_code": exit_code,
+                "exited_at": datetime.utcnow(),
+                "status": case((_NOT_BUILDING, status), else_=models.MCPServer.status),
+            }, same_container)
+            logger.info(f"Server {server.name} exited with code {exit_code}{' (OOM)' if change['oom'] else ''}")
+        elif action == "destroy":
+            self._is_expected_stop(container_id, forget=True)
+            gateway.routes.remove(server.name)
+            running = models.MCPServer.status == models.ServerStatus.RUNNING
+            if self._update(db, server, {
+                "container_id": None,
+                "host_port": None,
+                "container_ip": None,
+                "status": case((running, models.ServerStatus.STOPPED), else_=models.MCPServer.status),
+            }, same_container):
+                port_reservations.release_runtime(server)
+
+    # ------------------------------------------------------------------
+    # 定期全量对账
+    # ------------------------------------------------------------------
+    def reconcile_all(self):
+        """一次列出所有平台容器，与数据库批量比对"""
+        summaries = docker_manager.client.api.containers(all=True, filters={"label": LABEL_SERVER_ID})
+        by_server: Dict[str, Dict] = {summary["Labels"][LABEL_SERVER_ID]: summary for summary in summaries}
+
+        db = SessionLocal()
+        try:
+            changed = 0
+            stale_before = datetime.utcnow() - timedelta(seconds=BUILDING_STALE_SECONDS)
+            writable = _NOT_BUILDING | (models.MCPServer.updated_at < stale_before)
+            servers = db.query(models.MCPServer).filter(writable).all()
+            # 预热池容器和旧版本创建的容器没有服务器标签，按 container_id 补查
+            missing = [server.container_id for server in servers if server.id not in by_server and server.container_id]
+            by_id: Dict[str, Dict] = {}
+            if missing:
+                by_id = {
+                    summary["Id"]: summary
+                    for summary in docker_manager.client.api.containers(all=True, filters={"id": missing})
+                }
+            for server in servers:
+                summary = by_server.get(server.id) or by_id.get(server.container_id)
+                if self._reconcile_server(db, server, summary, writable):
+                    changed += 1
+                # 同步网关路由
+                if server.status == models.ServerStatus.RUNNING:
+                    gateway.routes.set_server(server)
+                elif server.status != models.ServerStatus.BUILDING:
+                    gateway.routes.remove(server.name)
+            if changed:
+                db.commit()
+                logger.info(f"Reconciled {changed} servers with container state")
+        finally:
+            db.close()
+
+    def _reconcile_server(self, db, server: models.MCPServer, summary: Optional[Dict], writable) -> bool:
+        active = server.status in (models.ServerStatus.RUNNING, models.ServerStatus.BUILDING)
+        if summary is None:
+            if not active and not server.container_id:
+                return False
+            values = {"container_id": None, "host_port": None, "container_ip": None}
+            if active:
+                values["status"] = models.ServerStatus.STOPPED
+            if not self._update(db, server, values, writable):
+                return False
+            port_reservations.release_runtime(server)
+            return True
+
+        values = {"container_id": summary["Id"]}
+        state = summary.get("State")
+        host_port = None
+        if state == "running":
+            values["status"] = models.ServerStatus.RUNNING
+            host_port = _main_host_port(summary.get("Ports"))
+            if host_port:
+                values["host_port"] = host_port
+            container_ip = docker_manager.container_ip(summary)
+            if container_ip:
+                values["container_ip"] = container_ip
+        elif state in ("exited", "dead"):
+            exit_code = _parse_exit_code(summary.get("Status"))
+            if self._is_expected_stop(summary["Id"]):
+                if active:
+                    values["status"] = models.ServerStatus.STOPPED
+            elif active:
+                values["status"] = models.ServerStatus.ERROR if exit_code not in (None, 0) else models.ServerStatus.STOPPED
+                values["exit_code"] = exit_code
+                values["exited_at"] = datetime.utcnow()
+        changed = any(getattr(server, key) != value for key, value in values.items())
+        if changed and not self._update(db, server, values, writable):
+            return False
+        if host_port:
+            port_allocator.reserve(host_port, server.id)
+        return changed
+
+
+# 单例模式
+reconciler = Reconciler(interval=float(os.getenv("RECONCILE_INTERVAL", "30")))
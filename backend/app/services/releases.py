@@ -0,0 +1,169 @@
+"""
+代码版本（release）
+
+每次上传或增量提交都生成一个新的不可变版本目录，服务器的 app 是指向当前版本的符号链接：
+
+    <server_dir>/releases/<release_id>/                 版本代码（文件为对象库的硬链接）
+    <server_dir>/releases/<release_id>.manifest.json    版本清单
+    <server_dir>/app -> releases/<release_id>
+
+- 切换版本只替换符号链接（先创建临时链接再 rename，原子操作），回滚无需重新上传
+- 容器挂载的是解析后的版本目录，切换不影响已运行的容器，重启后生效
+- 每个服务器保留最近 CODE_RELEASES_KEEP 个版本，当前版本始终保留
+"""
+import os
+import shutil
+import threading
+import time
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from .code_store import code_store, MANIFEST_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+RELEASES_DIR = "releases"
+CURRENT_LINK = "app"
+LEGACY_MANIFEST = "app.manifest.json"
+
+
+class ReleaseError(ValueError):
+    """版本不存在或无法切换"""
+
+
+class ReleaseManager:
+    def __init__(self, keep: int = 5):
+        self.keep = max(1, keep)
+        # 切换与清理互斥，避免清理掉正在切换到的版本
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def releases_dir(base_path: str) -> str:
+        return os.path.join(base_path, RELEASES_DIR)
+
+    def release_path(self, base_path: str, release_id: str) -> str:
+        if not release_id or os.sep in release_id or release_id.startswith(".") or release_id.endswith(MANIFEST_SUFFIX):
+            raise ReleaseError(f"Invalid release id: {release_id}")
+        return os.path.join(self.releases_dir(base_path), release_id)
+
+    def _next_id(self, base_path: str) -> str:
+        """版本 ID 以递增序号开头，按 ID 排序即为创建顺序"""
+        ids = self.ids(base_path)
+        seq = ids[0].split("-", 1)[0] if ids else ""
+        return f"{int(seq) + 1 if seq.isdigit() else 1:06d}-{time.strftime('%Y%m%d%H%M%S', time.gmtime())}"
+
+    def create(self, base_path: str) -> Tuple[str, str]:
+        """创建一个空的新版本目录，返回 (版本 ID, 目录)"""
+        with self._lock:
+            release_id = self._next_id(base_path)
+            path = self.release_path(base_path, release_id)
+            os.makedirs(path)
+        return release_id, path
+
+    def discard(self, base_path: str, release_id: str):
+        """删除未激活的版本（上传失败时调用）"""
+        if release_id == self.current(base_path):
+            return
+        path = self.release_path(base_path, release_id)
+        shutil.rmtree(path, ignore_errors=True)
+        if os.path.exists(path + MANIFEST_SUFFIX):
+            os.remove(path + MANIFEST_SUFFIX)
+
+    def current(self, base_path: str) -> Optional[str]:
+        link = os.path.join(base_path, CURRENT_LINK)
+        if not os.path.islink(link):
+            return None
+        return os.path.basename(os.readlink(link))
+
+    def ids(self, base_path: str) -> List[str]:
+        """所有版本 ID，按创建时间从新到旧"""
+        try:
+            names = os.listdir(self.releases_dir(base_path))
+        except FileNotFoundError:
+            return []
+        return sorted(
+            (name for name in names
+             if not name.endswith(MANIFEST_SUFFIX) and os.path.isdir(os.path.join(self.releases_dir(base_path), name))),
+            reverse=True,
+        )
+
+    def list(self, base_path: str) -> List[Dict]:
+        current = self.current(base_path)
+        result = []
+        for release_id in self.ids(base_path):
+            path = self.release_path(base_path, release_id)
+            manifest = code_store.load_manifest(path) or {}
+            files = manifest.get("files", {})
+            result.append({
+                "id": release_id,
+                "created_at": datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.utc),
+                "digest": manifest.get("digest"),
+                "files": len(files),
+                "size": sum(entry.get("size", 0) for entry in files.values()),
+                "current": release_id == current,
+            })
+        return result
+
+    def activate(self, base_path: str, release_id: str):
+        """将 app 原子地切换到指定版本，然后清理多余的旧版本"""
+        path = self.release_path(base_path, release_id)
+        if not os.path.isdir(path):
+            raise ReleaseError(f"Release {release_id} not found")
+        with self._lock:
+            self.migrate(base_path)
+            link = os.path.join(base_path, CURRENT_LINK)
+            tmp = f"{link}.tmp-{threading.get_ident()}"
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+            # 相对链接：平台运行在容器中、数据目录映射到宿主机其他路径时同样有效
+            os.symlink(os.path.join(RELEASES_DIR, release_id), tmp)
+            os.replace(tmp, link)
+            self._prune(base_path)
+
+    def rollback(self, base_path: str, release_id: Optional[str] = None) -> str:
+        """回滚到指定版本；未指定时回滚到当前版本之前的一个版本"""
+        if release_id is None:
+            ids = self.ids(base_path)
+            current = self.current(base_path)
+            older = ids[ids.index(current) + 1:] if current in ids else []
+            if not older:
+                raise ReleaseError("No previous release to roll back to")
+            release_id = older[0]
+        self.activate(base_path, release_id)
+        return release_id
+
+    def _prune(self, base_path: str) -> List[str]:
+        current = self.current(base_path)
+        removed = []
+        for release_id in self.ids(base_path)[self.keep:]:
+            if release_id == current:
+                continue
+            path = self.release_path(base_path, release_id)
+            shutil.rmtree(path, ignore_errors=True)
+            if os.path.exists(path + MANIFEST_SUFFIX):
+                os.remove(path + MANIFEST_SUFFIX)
+            removed.append(release_id)
+        if removed:
+            logger.info(f"Pruned {len(removed)} old code releases in {base_path}")
+        return removed
+
+    def migrate(self, base_path: str) -> Optional[str]:
+        """将旧版本的 app 目录（普通目录）转换为第一个版本，返回新版本 ID"""
+        link = os.path.join(base_path, CURRENT_LINK)
+        if os.path.islink(link) or not os.path.isdir(link):
+            return None
+        release_id = self._next_id(base_path)
+        path = self.release_path(base_path, release_id)
+        os.makedirs(self.releases_dir(base_path), exist_ok=True)
+        os.rename(link, path)
+        legacy_manifest = os.path.join(base_path, LEGACY_MANIFEST)
+        if os.path.exists(legacy_manifest):
+            os.replace(legacy_manifest, path + MANIFEST_SUFFIX)
+        os.symlink(os.path.join(RELEASES_DIR, release_id), link)
+        logger.info(f"Migrated {link} to release {release_id}")
+        return release_id
+
+
+# 单例模式
+releases = ReleaseManager(keep=int(os.getenv("CODE_RELEASES_KEEP", "5")))
@@ -0,0 +1,315 @@
+"""
+预热容器池
+
+每个基础镜像预先启动若干空闲容器，容器内 bootstrap 等待分配用户代码。
+启动服务器时直接认领一个空闲容器，省去容器创建和解释器启动的时间。
+
+每个槽位在宿主机上对应 <DATA_ROOT>/.warm-pool/<slot_id>/ 目录：
+    user_code/  -> 挂载到 /app/user_code（只读），认领时以硬链接方式填充用户代码
+    data/       -> 挂载到 /app/data（读写），认领时把服务器 data 目录的内容移入，
+                   原 data 目录替换为指向该目录的符号链接，释放时再移回
+    control/    -> 挂载到 /app/control（只读），认领时写入 assignment.json
+"""
+import json
+import os
+import shutil
+import threading
+import uuid
+import logging
+from collections import deque
+from typing import Dict, List, Optional
+
+from .docker_manager import docker_manager, CONTAINER_NETWORK
+from .port_allocator import port_allocator
+
+logger = logging.getLogger(__name__)
+
+# 预热容器的命名前缀和标签
+WARM_NAME_PREFIX = "mcp-pool-"
+LABEL_WARM_IMAGE = "mcp-fleet.warm_image"
+LABEL_WARM_SLOT = "mcp-fleet.warm_slot"
+
+ASSIGNMENT_FILE = "assignment.json"
+CLAIM_FILE = "claim.json"
+
+
+def parse_pool_sizes(value: str) -> Dict[str, int]:
+    """解析 WARM_POOL_SIZES，格式如 "corp/mcp-base:latest=2,other/image:tag=1" """
+    sizes = {}
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        image, _, size = item.strip().rpartition("=")
+        try:
+            sizes[image.strip()] = max(0, int(size))
+        except ValueError:
+            logger.warning(f"Invalid warm pool size: {item}")
+    return sizes
+
+
+def _link_tree(src: str, dst: str):
+    """以硬链接复制目录树（跨文件系统时退化为普通复制）"""
+    def link_or_copy(s, d):
+        try:
+            os.link(s, d)
+        except OSError:
+            shutil.copy2(s, d)
+    shutil.copytree(src, dst, symlinks=True, copy_function=link_or_copy, dirs_exist_ok=True)
+
+
+def _move_entries(src: str, dst: str):
+    for entry in os.listdir(src):
+        os.rename(os.path.join(src, entry), os.path.join(dst, entry))
+
+
+class WarmPool:
+    """
+    预热容器池
+
+    - 按镜像维护空闲槽位，认领为 O(1)
+    - 后台线程按 WARM_POOL_SIZES 补齐各镜像的空闲容器
+    - 认领信息写入槽位目录的 claim.json，平台重启后可以恢复或归还数据
+    """
+
+    def __init__(self, sizes: Dict[str, int], refill_interval: float = 5.0):
+        self.sizes = sizes
+        self.refill_interval = refill_interval
+        self.root: Optional[str] = None
+        self._lock = threading.Lock()
+        self._idle: Dict[str, deque] = {image: deque() for image in sizes}
+        self._claimed: Dict[str, Dict] = {}   # container_id -> 槽位信息
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return any(self.sizes.values())
+
+    def start(self, data_root: str):
+        if not self.enabled or not docker_manager.client or self._thread:
+            return
+        self.root = os.path.join(data_root, ".warm-pool")
+        os.makedirs(self.root, exist_ok=True)
+        self._recover()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._refill_loop, name="warm-pool", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "sizes": self.sizes,
+                "idle": {image: len(slots) for image, slots in self._idle.items()},
+                "claimed": len(self._claimed),
+            }
+
+    # ------------------------------------------------------------------
+    # 认领与释放
+    # ------------------------------------------------------------------
+    def is_eligible(self, image: str, command: Optional[List[str]], pinned_ports: Optional[List[int]]) -> bool:
+        """
+        自定义启动命令或用户指定了固定端口的服务器无法使用预热容器
+        自动分配的端口不影响认领，认领后服务器改用预热容器的端口
+        """
+        return self.enabled and self.root is not None and not command and not pinned_ports \
+            and self.sizes.get(image, 0) > 0
+
+    def claim(self,
+              image: str,
+              server_id: str,
+              server_name: str,
+              host_base_path: str,
+              env_vars: Dict[str, str]) -> Optional[Dict]:
+        """
+        认领一个空闲容器并绑定服务器的代码和数据
+        返回与 run_container 相同结构的结果，无可用容器时返回 None
+        """
+        with self._lock:
+            slots = self._idle.get(image)
+            slot = slots.popleft() if slots else None
+        if slot is None:
+            return None
+
+        try:
+            container = docker_manager.client.containers.get(slot["container_id"])
+            if container.status != "running":
+                raise RuntimeError(f"warm container is {container.status}")
+        except Exception as e:
+            logger.warning(f"Discarding warm container {slot['container_id'][:12]}: {e}")
+            self._discard(slot)
+            return None
+
+        host_app_path = os.path.join(host_base_path, "app")
+        host_data_path = os.path.join(host_base_path, "data")
+        os.makedirs(host_app_path, exist_ok=True)
+        os.makedirs(host_data_path, exist_ok=True)
+
+        slot_dir = slot["dir"]
+        slot_data = os.path.join(slot_dir, "data")
+        # 1. 代码：硬链接到槽位目录
+        _link_tree(os.path.realpath(host_app_path), os.path.join(slot_dir, "user_code"))
+        # 2. 数据：内容移入槽位目录，原目录替换为符号链接，平台侧的读写仍然有效
+        if not os.path.islink(host_data_path):
+            _move_entries(host_data_path, slot_data)
+            os.rmdir(host_data_path)
+            os.symlink(slot_data, host_data_path)
+        claim = dict(slot, server_id=server_id, data_path=host_data_path)
+        with open(os.path.join(slot_dir, CLAIM_FILE), "w") as f:
+            json.dump(claim, f)
+        # 3. 写入分配信息，容器内 bootstrap 读取后加载用户代码
+        environment = env_vars.copy()
+        environment["MCP_SERVER_ID"] = server_id
+        assignment_tmp = os.path.join(slot_dir, "control", ASSIGNMENT_FILE + ".tmp")
+        with open(assignment_tmp, "w") as f:
+            json.dump({"server_id": server_id, "server_name": server_name, "env": environment}, f)
+        os.replace(assignment_tmp, os.path.join(slot_dir, "control", ASSIGNMENT_FILE))
+
+        # 端口归属转移给服务器（容器网络模式下没有宿主机端口）
+        if slot["port"]:
+            port_allocator.release(slot["port"])
+            port_allocator.reserve(slot["port"], server_id)
+        with self._lock:
+            self._claimed[slot["container_id"]] = claim
+        logger.info(f"Server {server_name} claimed warm container {slot['container_id'][:12]}")
+        return {
+            "container_id": slot["container_id"],
+            "port": slot["port"],
+            "ports": {8000: slot["port"]} if slot["port"] else {},
+            "ip": slot.get("ip"),
+            "warm": True
+        }
+
+    def release(self, container_id: str):
+        """容器被删除后归还数据目录并清理槽位（非预热容器直接忽略）"""
+        with self._lock:
+            claim = self._claimed.pop(container_id, None)
+        if claim is not None:
+            self._restore(claim)
+
+    def _restore(self, claim: Dict):
+        data_path = claim["data_path"]
+        slot_data = os.path.join(claim["dir"], "data")
+        try:
+            if os.path.islink(data_path):
+                os.unlink(data_path)
+            os.makedirs(data_path, exist_ok=True)
+            if os.path.isdir(slot_data):
+                _move_entries(slot_data, data_path)
+            shutil.rmtree(claim["dir"], ignore_errors=True)
+        except Exception as e:
+            logger.error(f"Failed to restore data of warm slot {claim['slot_id']}: {e}")
+
+    # ------------------------------------------------------------------
+    # 补充与恢复
+    # ------------------------------------------------------------------
+    def _create_slot(self, image: str):
+        slot_id = uuid.uuid4().hex[:12]
+        slot_dir = os.path.join(self.root, slot_id)
+        for sub in ("user_code", "data", "control"):
+            os.makedirs(os.path.join(slot_dir, sub), exist_ok=True)
+        port = None
+        run_kwargs = {}
+        if CONTAINER_NETWORK:
+            run_kwargs["network"] = docker_manager.ensure_network()
+        else:
+            port = port_allocator.allocate(f"warm:{slot_id}")
+            if not port:
+                shutil.rmtree(slot_dir, ignore_errors=True)
+                raise RuntimeError("No free ports available for warm pool")
+            run_kwargs["ports"] = {"8000/tcp": port}
+        try:
+            container = docker_manager.client.containers.run(
+                image=image,
+                name=f"{WARM_NAME_PREFIX}{slot_id}",
+                detach=True,
+                volumes={
+                    **docker_manager.shared_volumes,
+                    os.path.join(slot_dir, "user_code"): {'bind': '/app/user_code', 'mode': 'ro'},
+                    os.path.join(slot_dir, "data"): {'bind': '/app/data', 'mode': 'rw'},
+                    os.path.join(slot_dir, "control"): {'bind': '/app/control', 'mode': 'ro'},
+                },
+                environment={**docker_manager.shared_env, "MCP_WARM_SLOT": slot_id},
+                labels={LABEL_WARM_IMAGE: image, LABEL_WARM_SLOT: slot_id},
+                mem_limit="512m",
+                user="appuser",
+                **run_kwargs
+            )
+            ip = None
+            if CONTAINER_NETWORK:
+                container.reload()
+                ip = docker_manager.container_ip(container.attrs)
+        except Exception:
+            if port:
+                port_allocator.release(port)
+            shutil.rmtree(slot_dir, ignore_errors=True)
+            raise
+        slot = {"slot_id": slot_id, "image": image, "container_id": container.id, "port": port, "ip": ip, "dir": slot_dir}
+        with self._lock:
+            self._idle.setdefault(image, deque()).append(slot)
+        logger.info(f"Warm container ready for {image}: {container.id[:12]} on {ip or port}")
+
+    def _discard(self, slot: Dict):
+        try:
+            docker_manager.client.containers.get(slot["container_id"]).remove(force=True)
+        except Exception:
+            pass
+        if slot["port"]:
+            port_allocator.release(slot["port"])
+        shutil.rmtree(slot["dir"], ignore_errors=True)
+
+    def _refill_loop(self):
+        while not self._stop.is_set():
+            for image, size in self.sizes.items():
+                while not self._stop.is_set():
+                    with self._lock:
+                        missing = size - len(self._idle.get(image, ()))
+                    if missing <= 0:
+                        break
+                    try:
+                        self._create_slot(image)
+                    except Exception as e:
+                        logger.error(f"Failed to create warm container for {image}: {e}")
+                        break
+            self._stop.wait(self.refill_interval)
+
+    def _recover(self):
+        """平台重启后：恢复仍在运行的已认领容器，归还其余槽位的数据，清理空闲容器"""
+        running = {}
+        for summary in docker_manager.client.api.containers(all=True, filters={"label": LABEL_WARM_SLOT}):
+            running[summary["Labels"][LABEL_WARM_SLOT]] = summary
+        for slot_id in os.listdir(self.root):
+            slot_dir = os.path.join(self.root, slot_id)
+            claim_file = os.path.join(slot_dir, CLAIM_FILE)
+            summary = running.pop(slot_id, None)
+            if os.path.exists(claim_file):
+                with open(claim_file) as f:
+                    claim = json.load(f)
+                if summary is not None and summary.get("State") == "running":
+                    self._claimed[claim["container_id"]] = claim
+                    continue
+                self._restore(claim)
+            else:
+                shutil.rmtree(slot_dir, ignore_errors=True)
+            if summary is not None:
+                self._remove_container(summary)
+        # 没有对应槽位目录的孤立容器
+        for summary in running.values():
+            self._remove_container(summary)
+
+    def _remove_container(self, summary: Dict):
+        try:
+            docker_manager.client.api.remove_container(summary["Id"], force=True)
+        except Exception as e:
+            logger.warning(f"Failed to remove warm container {summary['Id'][:12]}: {e}")
+            return
+        for binding in summary.get("Ports") or []:
+            if binding.get("PublicPort"):
+                port_allocator.release(int(binding["PublicPort"]))
+
+
+# 单例模式
+warm_pool = WarmPool(parse_pool_sizes(os.getenv("WARM_POOL_SIZES", "")))
@@ -0,0 +1,289 @@
+"""
+共享 wheelhouse
+
+平台在 <DATA_ROOT>/.wheelhouse/ 维护一个所有容器共用的 wheel 目录，以只读方式挂载到每个容器的
+/app/wheelhouse，并通过 UV_FIND_LINKS / PIP_FIND_LINKS 作为本地包源。容器内 `uv run`、`pip install`
+直接使用已构建好的 wheel，不再各自下载和编译。
+
+- wheel 由平台侧的预取任务写入：汇总所有服务器当前代码版本的依赖，按镜像在一次性容器中执行 pip wheel，
+  新 wheel 先写入临时目录，完成后逐个重命名进 wheelhouse，容器不会读到写了一半的文件
+- 临时目录位于 <DATA_ROOT>/.wheelhouse-work/，不在挂载给服务器容器的目录内（依赖列表可能含带 token 的 URL），
+  与 wheelhouse 同在一个文件系统，重命名保持原子；平台启动时清理上次残留的临时目录
+- 预取时用到的 wheel 会更新修改时间，总大小超过 WHEELHOUSE_MAX_BYTES 时按修改时间淘汰最久未用的 wheel
+- 预取默认关闭（WHEELHOUSE_PREFETCH_ENABLED），开启后平台启动 WHEELHOUSE_PREFETCH_DELAY 秒后首次执行，
+  之后定期执行（WHEELHOUSE_PREFETCH_INTERVAL 秒），代码上传后也会触发一次
+- 预取容器以低 CPU 权重（WHEELHOUSE_PREFETCH_CPU_SHARES）和 nice 19 运行，不与服务器容器争抢 CPU
+
+uv 的缓存目录需要可写，无法以只读方式共享，因此共享的是 wheel 本身，各容器的 UV_CACHE_DIR 保持不变。
+"""
+import hashlib
+import os
+import shutil
+import threading
+import time
+import uuid
+import logging
+from typing import Dict, List, Optional
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11：不解析 pyproject.toml / uv.lock
+    tomllib = None
+
+from .. import models
+from ..database import SessionLocal
+from .docker_manager import docker_manager, BASE_IMAGE
+from .dep_layers import detect_dependencies
+
+logger = logging.getLogger(__name__)
+
+LABEL_WHEEL_PREFETCH = "mcp-fleet.wheel_prefetch"
+
+# 容器内的挂载点
+CONTAINER_WHEELHOUSE_PATH = "/app/wheelhouse"
+
+# 每个依赖集合单独执行 pip wheel，不同服务器之间的版本冲突互不影响
+PREFETCH_SCRIPT = (
+    'for f in /req/*.txt; do '
+    'nice -n 19 pip wheel --disable-pip-version-check --quiet --wheel-dir /out --find-links /wheelhouse -r "$f" '
+    '|| echo "prefetch failed: $f"; '
+    'done'
+)
+
+
+def read_requirements(code_path: str) -> List[str]:
+    """读取代码目录中声明的依赖（requirement 字符串列表），不支持的格式返回空列表"""
+    source = detect_dependencies(code_path)
+    if source == "requirements.txt":
+        requirements = []
+        with open(os.path.join(code_path, source), encoding="utf-8", errors="replace") as f:
+            for line in f:
+                line = line.split(" #", 1)[0].strip()
+                # 跳过注释和 -r/-e/--index-url 等选项
+                if line and not line.startswith(("#", "-")):
+                    requirements.append(line)
+        return requirements
+    if source is None or tomllib is None:
+        return []
+    try:
+        with open(os.path.join(code_path, source), "rb") as f:
+            data = tomllib.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Failed to parse {source} in {code_path}: {e}")
+        return []
+    if source == "pyproject.toml":
+        return [str(dep) for dep in data.get("project", {}).get("dependencies", [])]
+    # uv.lock：只取来自包索引的固定版本，跳过项目自身和本地路径依赖
+    return [
+        f"{package['name']}=={package['version']}"
+        for package in data.get("package", [])
+        if "version" in package and "registry" in package.get("source", {})
+    ]
+
+
+class Wheelhouse:
+    def __init__(
+        self,
+        max_bytes: int,
+        prefetch_interval: float,
+        prefetch_timeout: float,
+        index_url: str = "",
+        enabled: bool = False,
+        prefetch_delay: float = 300,
+        cpu_shares: int = 128,
+    ):
+        self.enabled = enabled
+        self.prefetch_delay = prefetch_delay
+        self.cpu_shares = cpu_shares
+        self.max_bytes = max_bytes
+        self.prefetch_interval = prefetch_interval
+        self.prefetch_timeout = prefetch_timeout
+        self.index_url = index_url
+        self.root: Optional[str] = None
+        self.work_root: Optional[str] = None
+        self._wakeup = threading.Event()
+        self._run_lock = threading.Lock()
+        self._last_prefetch: Optional[Dict] = None
+        self._evicted = 0
+
+    def start(self, data_root: str):
+        """创建目录，注册为所有容器的共享挂载，并启动后台预取（未开启时不做任何事）"""
+        if not self.enabled:
+            logger.info("Wheelhouse prefetch disabled")
+            return
+        self.root = os.path.join(data_root, ".wheelhouse")
+        self.work_root = os.path.join(data_root, ".wheelhouse-work")
+        os.makedirs(self.root, exist_ok=True)
+        # 上次进程退出时未清理的预取临时目录（旧版本放在 wheelhouse 目录内）
+        shutil.rmtree(self.work_root, ignore_errors=True)
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and entry.name.startswith(".prefetch-"):
+                shutil.rmtree(entry.path, ignore_errors=True)
+        os.makedirs(self.work_root, exist_ok=True)
+        docker_manager.add_shared_mount(self.root, CONTAINER_WHEELHOUSE_PATH, {
+            "UV_FIND_LINKS": CONTAINER_WHEELHOUSE_PATH,
+            "PIP_FIND_LINKS": CONTAINER_WHEELHOUSE_PATH,
+        })
+        threading.Thread(target=self._loop, name="wheelhouse-prefetch", daemon=True).start()
+
+    def schedule(self):
+        """请求尽快执行一次预取（多次请求合并为一次）；首次预取仍等到启动延迟结束"""
+        self._wakeup.set()
+
+    def _loop(self):
+        # 平台刚启动时服务器容器集中启动，推迟首次预取
+        time.sleep(max(self.prefetch_delay, 0))
+        while True:
+            try:
+                self.prefetch()
+            except Exception as e:
+                logger.error(f"Wheelhouse prefetch failed: {e}")
+            self._wakeup.wait(self.prefetch_interval if self.prefetch_interval > 0 else None)
+            self._wakeup.clear()
+
+    # ------------------------------------------------------------------
+    # 预取
+    # ------------------------------------------------------------------
+    def _collect(self) -> Dict[str, Dict[str, List[str]]]:
+        """按镜像汇总所有服务器当前代码版本的依赖集合：{image: {集合哈希: requirements}}"""
+        db = SessionLocal()
+        try:
+            servers = db.query(models.MCPServer.source_code_path, models.MCPServer.image).all()
+        finally:
+            db.close()
+        result: Dict[str, Dict[str, List[str]]] = {}
+        for source_code_path, image in servers:
+            code_path = os.path.realpath(os.path.join(source_code_path or "", "app"))
+            if not source_code_path or not os.path.isdir(code_path):
+                continue
+            requirements = sorted(set(read_requirements(code_path)))
+            if requirements:
+                key = hashlib.sha256("\n".join(requirements).encode()).hexdigest()[:16]
+                result.setdefault(image or BASE_IMAGE, {})[key] = requirements
+        return result
+
+    def prefetch(self) -> Dict:
+        """为所有依赖集合构建 wheel 并加入 wheelhouse，然后按大小上限淘汰"""
+        if self.root is None or not docker_manager.client:
+            return {}
+        with self._run_lock:
+            started_at = time.monotonic()
+            summary = {"sets": 0, "added": 0, "reused": 0, "failed_images": []}
+            for image, requirement_sets in self._collect().items():
+                summary["sets"] += len(requirement_sets)
+                try:
+                    added, reused = self._prefetch_image(image, requirement_sets)
+                    summary["added"] += added
+                    summary["reused"] += reused
+                except Exception as e:
+                    logger.warning(f"Wheel prefetch for {image} failed: {e}")
+                    summary["failed_images"].append(image)
+            summary["evicted"] = self.evict()
+            summary["finished_at"] = time.time()
+            summary["duration"] = round(time.monotonic() - started_at, 1)
+            self._last_prefetch = summary
+            if summary["added"] or summary["evicted"]:
+                logger.info(f"Wheelhouse prefetch: {summary}")
+            return summary
+
+    def _prefetch_image(self, image: str, requirement_sets: Dict[str, List[str]]):
+        work_dir = os.path.join(self.work_root, f"prefetch-{uuid.uuid4().hex[:8]}")
+        req_dir = os.path.join(work_dir, "req")
+        out_dir = os.path.join(work_dir, "out")
+        os.makedirs(req_dir)
+        os.makedirs(out_dir)
+        # 预取容器以镜像中的非 root 用户运行
+        os.chmod(out_dir, 0o777)
+        for key, requirements in requirement_sets.items():
+            with open(os.path.join(req_dir, f"{key}.txt"), "w") as f:
+                f.write("\n".join(requirements) + "\n")
+        environment = {"HOME": "/tmp"}
+        if self.index_url:
+            environment["PIP_INDEX_URL"] = self.index_url
+        container = None
+        try:
+            container = docker_manager.client.containers.run(
+                image,
+                command=["sh", "-c", PREFETCH_SCRIPT],
+                volumes={
+                    req_dir: {"bind": "/req", "mode": "ro"},
+                    out_dir: {"bind": "/out", "mode": "rw"},
+                    self.root: {"bind": "/wheelhouse", "mode": "ro"},
+                },
+                environment=environment,
+                labels={LABEL_WHEEL_PREFETCH: image},
+                cpu_shares=self.cpu_shares,
+                detach=True,
+            )
+            try:
+                container.wait(timeout=self.prefetch_timeout)
+            except Exception:
+                raise RuntimeError(f"timed out after {self.prefetch_timeout:g}s")
+            output = container.logs(tail=20).decode("utf-8", errors="replace").strip()
+            if "prefetch failed" in output:
+                logger.warning(f"Some requirement sets for {image} could not be prefetched:\n{output}")
+
+            # pip wheel 会把 find-links 中已有的 wheel 也复制到输出目录，据此更新最近使用时间
+            added = reused = 0
+            for name in os.listdir(out_dir):
+                if not name.endswith(".whl"):
+                    continue
+                target = os.path.join(self.root, name)
+                if os.path.exists(target):
+                    os.utime(target)
+                    reused += 1
+                else:
+                    os.chmod(os.path.join(out_dir, name), 0o444)
+                    os.replace(os.path.join(out_dir, name), target)
+                    added += 1
+            return added, reused
+        finally:
+            if container is not None:
+                try:
+                    container.remove(force=True)
+                except Exception:
+                    pass
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    # ------------------------------------------------------------------
+    # 淘汰与统计
+    # ------------------------------------------------------------------
+    def _wheels(self) -> List[os.DirEntry]:
+        return [entry for entry in os.scandir(self.root) if entry.is_file() and entry.name.endswith(".whl")]
+
+    def evict(self) -> int:
+        """总大小超过上限时，按最近使用时间从旧到新删除 wheel"""
+        wheels = sorted(self._wheels(), key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in wheels)
+        evicted = 0
+        for entry in wheels:
+            if total <= self.max_bytes:
+                break
+            total -= entry.stat().st_size
+            os.remove(entry.path)
+            evicted += 1
+        self._evicted += evicted
+        return evicted
+
+    def stats(self) -> Dict:
+        wheels = self._wheels() if self.root is not None else []
+        return {
+            "enabled": self.enabled,
+            "wheels": len(wheels),
+            "bytes": sum(entry.stat().st_size for entry in wheels),
+            "max_bytes": self.max_bytes,
+            "evicted": self._evicted,
+            "last_prefetch": self._last_prefetch,
+        }
+
+
+# 单例模式
+wheelhouse = Wheelhouse(
+    max_bytes=int(os.getenv("WHEELHOUSE_MAX_BYTES", str(5 * 1024 * 1024 * 1024))),
+    prefetch_interval=float(os.getenv("WHEELHOUSE_PREFETCH_INTERVAL", "21600")),
+    prefetch_timeout=float(os.getenv("WHEELHOUSE_PREFETCH_TIMEOUT", "1800")),
+    index_url=os.getenv("DEPS_INDEX_URL", ""),
+    enabled=os.getenv("WHEELHOUSE_PREFETCH_ENABLED", "false").lower() in ("1", "true", "yes"),
+    prefetch_delay=float(os.getenv("WHEELHOUSE_PREFETCH_DELAY", "300")),
+    cpu_shares=int(os.getenv("WHEELHOUSE_PREFETCH_CPU_SHARES", "128")),
+)
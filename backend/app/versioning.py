@@ -0,0 +1,117 @@
+"""
+资源版本号与条件请求（ETag / If-None-Match）
+
+- 每个服务器有 version 列，服务器本身或其环境变量、配置文件、端口预留在一次 flush 中有修改时递增一次
+- fleet_state 表的单行 version 在任何上述修改时递增，用于列表和"是否有变化"的检查
+- 服务器版本号在 before_flush 中以 SQL 表达式（version = version + 1）递增，并发事务不会丢失递增，
+  递增与修改在同一事务中提交
+- fleet_state 是所有写操作共用的一行，不在业务事务中更新（否则每个写事务都持有该行锁直到提交），
+  而是在 after_commit 中用单独的短事务递增。递增发生在提交之后：先读版本号再读数据的请求
+  最多得到"旧版本号 + 新数据"，下一次请求因版本号已变化会重新获取，不会长期缓存旧数据
+- 客户端带 If-None-Match 请求时只需查询版本号，一致则返回 304，不加载服务器及其关联数据
+"""
+import hashlib
+import logging
+from typing import Optional
+
+from fastapi import Request, Response
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+FLEET_STATE_ID = 1
+
+# 修改时需要递增所属服务器版本号的关联对象
+SERVER_CHILDREN = (models.EnvironmentVariable, models.ConfigFile, models.PortReservation)
+
+
+def _owning_server(session: Session, obj) -> Optional[models.MCPServer]:
+    if isinstance(obj, models.MCPServer):
+        return obj
+    server = obj.server
+    if server is None and obj.server_id:
+        server = session.get(models.MCPServer, obj.server_id)
+    return server
+
+
+@event.listens_for(Session, "before_flush")
+def bump_versions(session: Session, flush_context, instances):
+    changed = set()
+    fleet_changed = False
+    with session.no_autoflush:
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if not isinstance(obj, (models.MCPServer,) + SERVER_CHILDREN):
+                continue
+            if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+                continue
+            fleet_changed = True
+            server = _owning_server(session, obj)
+            if server is not None and server not in session.new and server not in session.deleted:
+                changed.add(server)
+    for server in changed:
+        server.version = models.MCPServer.version + 1
+    if fleet_changed:
+        session.info["fleet_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def bump_fleet_version(session: Session):
+    if not session.info.pop("fleet_changed", False):
+        return
+    try:
+        with session.get_bind().begin() as connection:
+            connection.execute(
+                update(models.FleetState)
+                .where(models.FleetState.id == FLEET_STATE_ID)
+                .values(version=models.FleetState.version + 1)
+            )
+    except Exception as e:
+        logger.warning(f"Failed to bump fleet version: {e}")
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def discard_fleet_change(session: Session, previous_transaction):
+    # 回滚的修改不递增 fleet 版本号
+    if previous_transaction.parent is None:
+        session.info.pop("fleet_changed", None)
+
+
+def ensure_fleet_state(db: Session):
+    if db.get(models.FleetState, FLEET_STATE_ID) is None:
+        db.add(models.FleetState(id=FLEET_STATE_ID, version=0))
+        db.commit()
+
+
+def fleet_version(db: Session) -> int:
+    return db.query(models.FleetState.version).filter(models.FleetState.id == FLEET_STATE_ID).scalar() or 0
+
+
+def server_version(db: Session, server_id: str) -> Optional[int]:
+    """只查询版本号列；服务器不存在时返回 None"""
+    return db.query(models.MCPServer.version).filter(models.MCPServer.id == server_id).scalar()
+
+
+def make_etag(*parts) -> str:
+    """强 ETag"""
+    return '"' + "-".join(str(part) for part in parts) + '"'
+
+
+def query_digest(request: Request) -> str:
+    """查询参数摘要，同一版本下不同过滤/分页条件的列表使用不同的 ETag"""
+    query = "&".join(sorted(request.url.query.split("&"))) if request.url.query else ""
+    return hashlib.sha1(query.encode()).hexdigest()[:12]
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """If-None-Match 与 etag 匹配时返回 304 响应，否则返回 None"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    # If-None-Match 使用弱比较，忽略 W/ 前缀
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    if "*" in tags or etag in tags:
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
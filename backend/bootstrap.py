@@ -1,5 +1,7 @@
 import sys
 import importlib
+import json
+import time
 import uvicorn
 import os
 import logging
@@ -8,6 +10,24 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("bootstrap")
 
+# 预热模式：容器先启动并完成 Python/uvicorn 的初始化，等待平台写入分配信息后再加载用户代码
+ASSIGNMENT_PATH = "/app/control/assignment.json"
+
+def wait_for_assignment():
+    """等待平台分配服务器，并应用分配的环境变量"""
+    logger.info(f"Warm slot {os.environ.get('MCP_WARM_SLOT')} waiting for assignment...")
+    try:
+        # 预先导入 MCP SDK，认领后无需再付出导入开销
+        importlib.import_module("mcp.server.fastmcp")
+    except Exception:
+        pass
+    while not os.path.exists(ASSIGNMENT_PATH):
+        time.sleep(0.05)
+    with open(ASSIGNMENT_PATH) as f:
+        assignment = json.load(f)
+    os.environ.update(assignment.get("env", {}))
+    logger.info(f"Assigned to server {assignment.get('server_name')}")
+
 def load_user_code():
     """
     动态加载用户代码
@@ -62,6 +82,9 @@ if __name__ == "__main__":
     # 我们直接启动它。FastMCP.run() 使用 uvicorn。
     # 但我们需要在这里显式控制 uvicorn，以便绑定 0.0.0.0 和端口。
     
+    if os.environ.get("MCP_WARM_SLOT"):
+        wait_for_assignment()
+
     app = load_user_code()
     
     # 如果 app 是 FastMCP 实例，它可能没有直接暴露 ASGI 接口
@@ -0,0 +1,43 @@
+import os
+import tempfile
+
+import pytest
+
+# 测试使用独立的数据库和数据目录，需在导入 app 之前设置
+TEST_ROOT = tempfile.mkdtemp(prefix="mcp-fleet-test-")
+os.environ.setdefault("SQLALCHEMY_DATABASE_URL", f"sqlite:///{os.path.join(TEST_ROOT, 'test.db')}")
+
+
+@pytest.fixture(scope="session")
+def client():
+    """已登录的 TestClient（无需 Docker，启动相关接口不在这里测试）"""
+    from fastapi.testclient import TestClient
+    from app import main
+
+    main.DATA_ROOT = os.path.join(TEST_ROOT, "data")
+    os.makedirs(main.DATA_ROOT, exist_ok=True)
+    with TestClient(main.app) as test_client:
+        token = test_client.post(
+            "/api/auth/token", data={"username": "admin", "password": "admin123"}
+        ).json()["access_token"]
+        test_client.headers["Authorization"] = f"Bearer {token}"
+        yield test_client
+
+
+@pytest.fixture
+def create_server(client):
+    """创建服务器并返回其 JSON，测试结束后删除"""
+    created = []
+
+    def create(name, ports=None, code=b"mcp = None\n"):
+        data = {"name": name}
+        if ports:
+            data["ports"] = ports
+        response = client.post("/api/servers", data=data, files={"file": ("server.py", code)})
+        assert response.status_code == 200, response.text
+        created.append(response.json()["id"])
+        return response.json()
+
+    yield create
+    for server_id in created:
+        client.delete(f"/api/servers/{server_id}")
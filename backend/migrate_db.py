@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 """
 数据库迁移脚本
-添加 ports 和 host_ports 字段到 mcp_servers 表
+添加 ports、host_ports、exit_code、exited_at、container_ip、start_timings、version 字段到 mcp_servers 表，
+并将 ports 字符串转换为 port_reservations 表中的端口预留
 """
 import sqlite3
 import os
@@ -71,6 +72,18 @@ def migrate_database(db_path):
         else:
             print("ℹ️  host_ports 字段已存在")
         
+        # 检查并添加容器退出信息字段（状态对账使用）、容器网络地址字段、启动耗时字段和版本号字段（ETag）
+        for column, column_type in (
+            ("exit_code", "INTEGER"), ("exited_at", "DATETIME"), ("container_ip", "TEXT"), ("start_timings", "TEXT"),
+            ("version", "INTEGER NOT NULL DEFAULT 1")
+        ):
+            if not check_column_exists(cursor, 'mcp_servers', column):
+                print(f"➕ 添加 {column} 字段...")
+                cursor.execute(f"ALTER TABLE mcp_servers ADD COLUMN {column} {column_type}")
+                print(f"✅ {column} 字段添加成功")
+            else:
+                print(f"ℹ️  {column} 字段已存在")
+        
         # 迁移旧的 port 数据到 ports 字段（如果存在）
         if check_column_exists(cursor, 'mcp_servers', 'port'):
             print("🔄 迁移旧的 port 数据到 ports 字段...")
@@ -85,6 +98,45 @@ def migrate_database(db_path):
             else:
                 print("ℹ️  没有需要迁移的数据")
         
+        # 创建端口预留表，并将 ports 字符串转换为端口预留（转换后清空 ports，只执行一次）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS port_reservations (
+                id INTEGER NOT NULL PRIMARY KEY,
+                port INTEGER NOT NULL,
+                server_id VARCHAR NOT NULL REFERENCES mcp_servers (id),
+                kind VARCHAR,
+                container_port INTEGER,
+                auto_assigned BOOLEAN NOT NULL DEFAULT 0,
+                created_at DATETIME
+            )
+        """)
+        if not check_column_exists(cursor, 'port_reservations', 'auto_assigned'):
+            print("➕ 添加 port_reservations.auto_assigned 字段...")
+            cursor.execute("ALTER TABLE port_reservations ADD COLUMN auto_assigned BOOLEAN NOT NULL DEFAULT 0")
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_port_reservations_port ON port_reservations (port)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_port_reservations_server_id ON port_reservations (server_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_port_reservations_id ON port_reservations (id)")
+        cursor.execute("SELECT id, ports FROM mcp_servers WHERE ports IS NOT NULL AND ports != ''")
+        converted = 0
+        for server_id, ports in cursor.fetchall():
+            try:
+                port_list = [int(p.strip()) for p in ports.split(',') if p.strip()]
+            except ValueError:
+                print(f"⚠️  无法解析服务器 {server_id} 的端口: {ports}")
+                continue
+            for index, port in enumerate(port_list):
+                cursor.execute(
+                    "INSERT OR IGNORE INTO port_reservations (port, server_id, kind, container_port, created_at) "
+                    "VALUES (?, ?, 'configured', ?, datetime('now'))",
+                    (port, server_id, 8000 + index)
+                )
+                if cursor.rowcount:
+                    converted += 1
+                else:
+                    print(f"⚠️  端口 {port} 已被其他服务器预留，跳过服务器 {server_id} 的该端口")
+        cursor.execute("UPDATE mcp_servers SET ports = NULL WHERE ports IS NOT NULL")
+        print(f"✅ 已转换 {converted} 个端口预留")
+        
         # 提交更改
         conn.commit()
         print("\n✅ 数据库迁移完成！")
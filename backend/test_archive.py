@@ -0,0 +1,89 @@
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from app.services import archive
+from app.services.archive import ArchiveError, extract_upload
+
+
+def make_tar(files, symlinks=()):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+        for name, target in symlinks:
+            info = tarfile.TarInfo(name)
+            info.type = tarfile.SYMTYPE
+            info.linkname = target
+            tar.addfile(info)
+    buffer.seek(0)
+    return buffer
+
+
+def make_zip(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, content in files.items():
+            zf.writestr(name, content)
+    buffer.seek(0)
+    return buffer
+
+
+def test_extracts_tar_and_zip(tmp_path):
+    files = {"server.py": b"mcp = 1\n", "lib/util.py": b"X = 2\n"}
+    assert extract_upload(make_tar(files), "code.tar.gz", str(tmp_path / "t")) == {"files": 2, "bytes": 14}
+    assert extract_upload(make_zip(files), "code.zip", str(tmp_path / "z"))["files"] == 2
+    assert (tmp_path / "t" / "lib" / "util.py").read_bytes() == b"X = 2\n"
+    assert (tmp_path / "z" / "server.py").read_bytes() == b"mcp = 1\n"
+
+
+def test_plain_file_keeps_basename(tmp_path):
+    extract_upload(io.BytesIO(b"mcp = 1\n"), "../../server.py", str(tmp_path))
+    assert os.listdir(tmp_path) == ["server.py"]
+
+
+@pytest.mark.parametrize("name", ["../evil.py", "/etc/evil.py", "a/../../evil.py"])
+def test_rejects_path_traversal(tmp_path, name):
+    with pytest.raises(ArchiveError):
+        extract_upload(make_tar({name: b"x"}), "code.tar", str(tmp_path / "t"))
+    with pytest.raises(ArchiveError):
+        extract_upload(make_zip({name: b"x"}), "code.zip", str(tmp_path / "z"))
+    assert not (tmp_path / "evil.py").exists()
+
+
+def test_rejects_escaping_symlink(tmp_path):
+    with pytest.raises(ArchiveError):
+        extract_upload(make_tar({}, symlinks=[("link", "../../etc/passwd")]), "code.tar", str(tmp_path))
+
+
+def test_file_count_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "MAX_FILES", 2)
+    files = {f"f{i}.py": b"x" for i in range(3)}
+    with pytest.raises(ArchiveError):
+        extract_upload(make_tar(files), "code.tgz", str(tmp_path / "t"))
+    with pytest.raises(ArchiveError):
+        extract_upload(make_zip(files), "code.zip", str(tmp_path / "z"))
+
+
+def test_size_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "MAX_EXTRACTED_BYTES", 1000)
+    with pytest.raises(ArchiveError):
+        extract_upload(make_tar({"big.bin": os.urandom(2000)}), "code.tar.gz", str(tmp_path / "t"))
+    with pytest.raises(ArchiveError):
+        extract_upload(make_zip({"big.bin": os.urandom(2000)}), "code.zip", str(tmp_path / "z"))
+    with pytest.raises(ArchiveError):
+        extract_upload(io.BytesIO(os.urandom(2000)), "big.bin", str(tmp_path / "p"))
+
+
+def test_compression_ratio_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "MAX_COMPRESSION_RATIO", 10)
+    bomb = {"zeros.bin": bytes(4 * 1024 * 1024)}
+    with pytest.raises(ArchiveError):
+        extract_upload(make_tar(bomb), "code.tar.gz", str(tmp_path / "t"))
+    with pytest.raises(ArchiveError):
+        extract_upload(make_zip(bomb), "code.zip", str(tmp_path / "z"))
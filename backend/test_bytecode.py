@@ -0,0 +1,93 @@
+import compileall
+import glob
+import py_compile
+import time
+
+import pytest
+
+from app.services.bytecode import COMPILE_COMMAND, BytecodeCompiler
+from app.services.docker_manager import docker_manager
+
+
+class FakeContainer:
+    """在本地执行容器中的 compileall"""
+
+    def __init__(self, volumes, hang):
+        self.code_path = next(path for path, bind in volumes.items() if bind["bind"] == "/app/user_code")
+        self.hang = hang
+        self.removed = False
+
+    def wait(self, timeout=None):
+        if self.hang:
+            raise TimeoutError()
+        ok = compileall.compile_dir(
+            self.code_path, quiet=1, invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH
+        )
+        return {"StatusCode": 0 if ok else 1}
+
+    def logs(self, tail=None):
+        return b"SyntaxError"
+
+    def remove(self, force=False):
+        self.removed = True
+
+
+class FakeContainers:
+    def __init__(self):
+        self.runs = []
+        self.hang = False
+
+    def run(self, image, **kwargs):
+        container = FakeContainer(kwargs["volumes"], self.hang)
+        self.runs.append((image, kwargs, container))
+        return container
+
+
+class FakeClient:
+    def __init__(self):
+        self.containers = FakeContainers()
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(docker_manager, "client", client)
+    return client
+
+
+def wait_idle(compiler):
+    deadline = time.monotonic() + 5
+    while compiler.stats()["pending"]:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_compiles_release_with_checked_hash(tmp_path, fake_client):
+    (tmp_path / "server.py").write_text("VALUE = 1\n")
+    (tmp_path / "broken.py").write_text("def (:\n")
+    compiler = BytecodeCompiler()
+    compiler.submit(str(tmp_path), "img")
+    wait_idle(compiler)
+
+    image, kwargs, container = fake_client.containers.runs[0]
+    assert image == "img" and kwargs["command"] == COMPILE_COMMAND
+    assert COMPILE_COMMAND[COMPILE_COMMAND.index("--invalidation-mode") + 1] == "checked-hash"
+    assert kwargs["volumes"] == {str(tmp_path): {"bind": "/app/user_code", "mode": "rw"}}
+    assert kwargs["network_disabled"] and container.removed
+    # 有语法错误的文件跳过，其余文件照常编译，不算失败
+    assert len(glob.glob(str(tmp_path / "__pycache__" / "server.*.pyc"))) == 1
+    assert compiler.stats()["compiled"] == 1 and compiler.stats()["failed"] == 0
+
+
+def test_timeout_counts_as_failure(tmp_path, fake_client):
+    fake_client.containers.hang = True
+    compiler = BytecodeCompiler(timeout=1)
+    compiler.submit(str(tmp_path), "img")
+    wait_idle(compiler)
+    assert compiler.stats()["failed"] == 1
+    assert fake_client.containers.runs[0][2].removed
+
+
+def test_disabled_does_nothing(tmp_path, fake_client):
+    BytecodeCompiler(enabled=False).submit(str(tmp_path), "img")
+    assert fake_client.containers.runs == []
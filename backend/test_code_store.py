@@ -0,0 +1,103 @@
+import os
+import time
+
+import pytest
+
+from app.services import code_store as code_store_module
+from app.services.code_store import CodeStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = CodeStore()
+    store.root = str(tmp_path / ".cas")
+    os.makedirs(store.objects_dir)
+    os.makedirs(store.manifests_dir)
+    return store
+
+
+def write_tree(root, files):
+    for rel, content in files.items():
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+    return str(root)
+
+
+def age(path, seconds=7200):
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_identical_files_are_stored_once(store, tmp_path):
+    shared = b"import mcp\n" * 100
+    a = write_tree(tmp_path / "a", {"server.py": shared, "a.py": b"A"})
+    b = write_tree(tmp_path / "b", {"server.py": shared, "lib/b.py": b"B"})
+    manifest_a = store.ingest(a)
+    manifest_b = store.ingest(b)
+
+    digest = manifest_a["files"]["server.py"]["sha256"]
+    assert manifest_b["files"]["server.py"]["sha256"] == digest
+    assert os.path.samefile(os.path.join(a, "server.py"), os.path.join(b, "server.py"))
+    assert os.path.samefile(os.path.join(a, "server.py"), store.object_path(digest))
+    stats = store.stats()
+    assert stats["objects"] == 3
+    assert stats["logical_bytes"] - stats["stored_bytes"] == len(shared)
+    assert store.load_manifest(a)["digest"] == manifest_a["digest"]
+
+
+def test_executable_bit_is_stored_separately(store, tmp_path):
+    a = write_tree(tmp_path / "a", {"run.sh": b"echo hi\n"})
+    b = write_tree(tmp_path / "b", {"run.sh": b"echo hi\n"})
+    os.chmod(os.path.join(b, "run.sh"), 0o755)
+    digest = store.ingest(a)["files"]["run.sh"]["sha256"]
+    assert store.ingest(b)["files"]["run.sh"]["exec"] is True
+    assert store.has(digest, False) and store.has(digest, True)
+    assert not os.path.samefile(os.path.join(a, "run.sh"), os.path.join(b, "run.sh"))
+
+
+def test_checkout_links_objects(store, tmp_path):
+    source = write_tree(tmp_path / "src", {"server.py": b"mcp = 1\n", "pkg/util.py": b"X = 1\n"})
+    os.symlink("pkg/util.py", os.path.join(source, "util.py"))
+    manifest = store.ingest(source)
+    assert manifest["symlinks"] == {"util.py": "pkg/util.py"}
+
+    dest = str(tmp_path / "dest")
+    assert store.checkout(dest, manifest)["digest"] == manifest["digest"]
+    assert os.path.samefile(os.path.join(source, "pkg/util.py"), os.path.join(dest, "pkg/util.py"))
+    assert os.readlink(os.path.join(dest, "util.py")) == "pkg/util.py"
+
+
+def test_gc_removes_only_unreferenced_objects_after_grace(store, tmp_path):
+    kept = write_tree(tmp_path / "kept", {"server.py": b"kept"})
+    dropped = write_tree(tmp_path / "dropped", {"server.py": b"dropped"})
+    kept_digest = store.ingest(kept)["files"]["server.py"]["sha256"]
+    dropped_digest = store.ingest(dropped)["files"]["server.py"]["sha256"]
+    os.remove(os.path.join(dropped, "server.py"))
+
+    # 保留期内无引用的对象不回收
+    assert store.gc()["removed"] == 0
+    for digest in (kept_digest, dropped_digest):
+        age(store.object_path(digest))
+    assert store.gc() == {"removed": 1, "freed_bytes": len(b"dropped")}
+    assert store.has(kept_digest) and not store.has(dropped_digest)
+
+
+def test_gc_keeps_recently_uploaded_blobs(store, monkeypatch):
+    monkeypatch.setattr(code_store_module, "UNREFERENCED_GRACE_SECONDS", 60)
+    tmp = store.new_blob_path()
+    with open(tmp, "wb") as f:
+        f.write(b"blob")
+    digest = "ab" * 32
+    store.put_blob(tmp, digest)
+    assert store.gc()["removed"] == 0
+    age(store.object_path(digest))
+    # 再次确认上传（如 sync 时对象已存在）会重新开始保留期
+    assert store.touch_content(digest)
+    assert store.gc()["removed"] == 0
+
+    stale = store.new_blob_path()
+    open(stale, "wb").close()
+    age(stale)
+    store.gc()
+    assert not os.path.exists(stale)
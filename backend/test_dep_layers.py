@@ -0,0 +1,158 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from app.services.dep_layers import DependencyLayers, detect_dependencies
+from app.services.docker_manager import docker_manager
+
+
+class FakeImage:
+    id = "sha256:base"
+
+
+class FakeImages:
+    def get(self, name):
+        return FakeImage()
+
+
+class FakeContainer:
+    def __init__(self, client, volumes):
+        self.client = client
+        self.deps_dir = next(path for path, bind in volumes.items() if bind["bind"] == "/deps")
+
+    def wait(self, timeout=None):
+        self.client.started.set()
+        if not self.client.gate.wait(timeout=5):
+            raise TimeoutError()
+        with open(os.path.join(self.deps_dir, "pkg.py"), "w") as f:
+            f.write("VALUE = 1\n")
+        return {"StatusCode": self.client.status_code}
+
+    def logs(self, tail=None):
+        return b"install failed"
+
+    def remove(self, force=False):
+        pass
+
+
+class FakeServerContainer:
+    def __init__(self, deps_source):
+        self.attrs = {"Mounts": [{"Destination": "/app/deps", "Source": deps_source}]}
+
+
+class FakeContainers:
+    def __init__(self, client):
+        self.client = client
+        self.mounted = []
+
+    def run(self, image, volumes=None, **kwargs):
+        self.client.builds += 1
+        return FakeContainer(self.client, volumes)
+
+    def list(self, all=False, filters=None):
+        return [FakeServerContainer(source) for source in self.mounted]
+
+
+class FakeClient:
+    def __init__(self):
+        self.images = FakeImages()
+        self.containers = FakeContainers(self)
+        self.builds = 0
+        self.status_code = 0
+        self.started = threading.Event()
+        self.gate = threading.Event()
+        self.gate.set()
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(docker_manager, "client", client)
+    yield client
+    client.gate.set()
+
+
+@pytest.fixture
+def layers(tmp_path, fake_client):
+    layers = DependencyLayers(enabled=True, start_timeout=5)
+    layers.root = str(tmp_path / ".deps")
+    os.makedirs(layers.cache_dir)
+    return layers
+
+
+def code_dir(tmp_path, name, files):
+    path = tmp_path / name
+    path.mkdir()
+    for file_name, content in files.items():
+        (path / file_name).write_text(content)
+    return str(path)
+
+
+def test_detect_dependencies(tmp_path):
+    assert detect_dependencies(code_dir(tmp_path, "none", {"server.py": ""})) is None
+    assert detect_dependencies(code_dir(tmp_path, "req", {"requirements.txt": "httpx\n"})) == "requirements.txt"
+    # uv.lock 需要配合 pyproject.toml 使用
+    assert detect_dependencies(code_dir(tmp_path, "lock", {"uv.lock": ""})) is None
+    assert detect_dependencies(code_dir(tmp_path, "uv", {"uv.lock": "", "pyproject.toml": ""})) == "uv.lock"
+
+
+def test_same_dependencies_share_one_layer(tmp_path, layers, fake_client):
+    a = code_dir(tmp_path, "a", {"requirements.txt": "httpx\n", "server.py": "a"})
+    b = code_dir(tmp_path, "b", {"requirements.txt": "httpx\n", "server.py": "b"})
+    c = code_dir(tmp_path, "c", {"requirements.txt": "requests\n"})
+    fake_client.gate.clear()
+    results = []
+    threads = [threading.Thread(target=lambda p=p: results.append(layers.ensure(p, "img"))) for p in (a, b)]
+    for thread in threads:
+        thread.start()
+    assert fake_client.started.wait(5)
+    fake_client.gate.set()
+    for thread in threads:
+        thread.join()
+
+    # 并发请求同一个依赖层只构建一次
+    assert len(set(results)) == 1 and fake_client.builds == 1
+    assert os.path.isfile(os.path.join(results[0], "pkg.py"))
+    assert layers.ensure(c, "img") != results[0] and fake_client.builds == 2
+    assert layers.stats()["hits"] == 1 and layers.stats()["layers"] == 2
+
+
+def test_failed_build_starts_without_layer(tmp_path, layers, fake_client):
+    fake_client.status_code = 1
+    path = code_dir(tmp_path, "bad", {"requirements.txt": "missing-package\n"})
+    with pytest.raises(RuntimeError):
+        layers.ensure(path, "img")
+    assert asyncio.run(layers.prepare(path, "img")) is None
+    assert [name for name in os.listdir(layers.root) if name != ".uv-cache"] == []
+    assert layers.stats()["failures"] == 2
+
+
+def test_prepare_timeout_keeps_building_in_background(tmp_path, layers, fake_client):
+    layers.start_timeout = 0.05
+    fake_client.gate.clear()
+    path = code_dir(tmp_path, "slow", {"requirements.txt": "httpx\n"})
+    assert asyncio.run(layers.prepare(path, "img")) is None
+    fake_client.gate.set()
+    deadline = time.monotonic() + 5
+    while layers.stats()["builds"] == 0:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    layers.start_timeout = 5
+    assert asyncio.run(layers.prepare(path, "img")) is not None
+    assert fake_client.builds == 1
+
+
+def test_gc_keeps_recent_and_mounted_layers(tmp_path, layers, fake_client):
+    paths = [
+        layers.ensure(code_dir(tmp_path, name, {"requirements.txt": f"{name}\n"}), "img")
+        for name in ("old", "mounted", "recent")
+    ]
+    past = time.time() - 40 * 86400
+    for path in paths[:2]:
+        os.utime(path + ".json", (past, past))
+    fake_client.containers.mounted = [paths[1]]
+    assert layers.gc()["removed"] == 1
+    assert [os.path.isdir(path) for path in paths] == [False, True, True]
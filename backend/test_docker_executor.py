@@ -0,0 +1,83 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.services.docker_executor import DockerBusyError, DockerExecutor, DockerTimeoutError
+
+
+@pytest.fixture
+def executor():
+    executor = DockerExecutor(max_workers=2, max_queue=3, default_timeout=5)
+    yield executor
+    executor.shutdown()
+
+
+@pytest.fixture
+def release():
+    """阻塞任务的开关，测试结束时放行，避免线程池无法退出"""
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+def wait_running(executor, count):
+    deadline = time.monotonic() + 5
+    while executor.stats()["running"] < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_run_returns_result_and_counts(executor):
+    def fail():
+        raise ValueError("boom")
+
+    async def run():
+        assert await executor.run(lambda a, b=0: a + b, 1, b=2) == 3
+        with pytest.raises(ValueError):
+            await executor.run(fail)
+
+    asyncio.run(run())
+    stats = executor.stats()
+    assert (stats["completed"], stats["failed"], stats["queue_depth"], stats["running"]) == (1, 1, 0, 0)
+
+
+def test_rejects_when_queue_is_full(executor, release):
+    futures = [executor.submit(release.wait) for _ in range(2)]
+    wait_running(executor, 2)
+    # 只限制排队中的任务数，执行中的任务不计入
+    futures += [executor.submit(release.wait) for _ in range(3)]
+    assert executor.stats()["queue_depth"] == 3
+    with pytest.raises(DockerBusyError):
+        executor.submit(release.wait)
+    assert executor.stats()["rejected"] == 1
+    release.set()
+    for future in futures:
+        future.result(timeout=5)
+    # 排队的任务执行完后可以继续提交
+    assert executor.submit(lambda: "ok").result(timeout=5) == "ok"
+
+
+def test_timeout_does_not_block_loop(executor):
+    async def run():
+        started = time.monotonic()
+        with pytest.raises(DockerTimeoutError):
+            await executor.run(time.sleep, 0.5, timeout=0.05)
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) < 0.4
+    assert executor.stats()["timeouts"] == 1
+
+
+def test_cancelled_queued_task_releases_slot(executor, release):
+    running = [executor.submit(release.wait) for _ in range(2)]
+    wait_running(executor, 2)
+    queued = executor.submit(release.wait)
+    assert executor.stats()["queue_depth"] == 1
+    assert queued.cancel()
+    assert executor.stats()["queue_depth"] == 0
+    release.set()
+    for future in running:
+        future.result(timeout=5)
+    assert executor.stats()["completed"] == 2
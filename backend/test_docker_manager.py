@@ -0,0 +1,84 @@
+import docker
+import pytest
+
+from app import models
+from app.services import docker_manager as docker_manager_module
+from app.services.docker_manager import DockerManager
+from app.services.gateway import RouteTable
+from app.services.port_allocator import port_allocator
+
+
+class FakeContainer:
+    id = "container-1"
+
+    def __init__(self, network):
+        self.network = network
+        self.attrs = {}
+
+    def start(self):
+        pass
+
+    def reload(self):
+        if self.network:
+            self.attrs = {"NetworkSettings": {"Networks": {self.network: {"IPAddress": "172.30.0.5"}}}}
+
+
+class FakeContainers:
+    def __init__(self):
+        self.created = []
+
+    def create(self, **kwargs):
+        self.created.append(kwargs)
+        return FakeContainer(kwargs.get("network"))
+
+
+class FakeNetworks:
+    def __init__(self):
+        self.names = set()
+
+    def get(self, name):
+        if name not in self.names:
+            raise docker.errors.NotFound(name)
+
+    def create(self, name, driver=None):
+        self.names.add(name)
+
+
+class FakeClient:
+    def __init__(self):
+        self.containers = FakeContainers()
+        self.networks = FakeNetworks()
+
+
+@pytest.fixture
+def manager():
+    manager = DockerManager()
+    manager.client = FakeClient()
+    return manager
+
+
+def test_network_mode_skips_host_ports(manager, tmp_path, monkeypatch):
+    monkeypatch.setattr(docker_manager_module, "CONTAINER_NETWORK", "mcp-net")
+    result = manager.run_container("net-a", "net-a", str(tmp_path), {})
+
+    kwargs = manager.client.containers.created[0]
+    assert kwargs["network"] == "mcp-net" and kwargs["ports"] == {}
+    assert "mcp-net" in manager.client.networks.names
+    assert (result["port"], result["ports"], result["ip"]) == (None, {}, "172.30.0.5")
+    assert port_allocator.ports_of("net-a") == []
+
+
+def test_network_mode_still_publishes_pinned_ports(manager, tmp_path, monkeypatch):
+    monkeypatch.setattr(docker_manager_module, "CONTAINER_NETWORK", "mcp-net")
+    monkeypatch.setattr(DockerManager, "_is_port_free", lambda self, port: True)
+    result = manager.run_container("net-b", "net-b", str(tmp_path), {}, requested_ports=[30931])
+    assert manager.client.containers.created[0]["ports"] == {"8000/tcp": 30931}
+    assert (result["port"], result["ip"]) == (30931, "172.30.0.5")
+    port_allocator.release(30931, "net-b")
+
+
+def test_route_prefers_container_ip():
+    server = models.MCPServer(name="net-c", host_port=30932, container_ip="172.30.0.6")
+    assert RouteTable.upstream_of(server) == ("172.30.0.6", 8000)
+    server.container_ip = None
+    assert RouteTable.upstream_of(server) == ("127.0.0.1", 30932)
@@ -0,0 +1,62 @@
+from app.services.docker_state import DockerStateCache
+
+
+class FakeAPI:
+    def containers(self, all=False, filters=None):
+        return [{
+            "Id": "c" * 64,
+            "Names": ["/mcp-server-1"],
+            "Image": "sha256:" + "a" * 64,
+            "ImageID": "sha256:" + "a" * 64,
+            "State": "running",
+            "Created": 1700000000,
+            "Ports": [
+                {"PrivatePort": 8000, "PublicPort": 30001, "Type": "tcp", "IP": "0.0.0.0"},
+                {"PrivatePort": 9000, "Type": "tcp"},
+            ],
+        }]
+
+    def images(self):
+        return [
+            {"Id": "sha256:" + "a" * 64, "RepoTags": ["mcp-base:latest"], "Size": 123, "Created": 1700000000},
+            {"Id": "sha256:" + "b" * 64, "RepoTags": ["<none>:<none>"], "Size": 1, "Created": 1600000000},
+        ]
+
+
+class FakeClient:
+    api = FakeAPI()
+
+    def version(self):
+        return {"Version": "24.0.0"}
+
+
+class FakeManager:
+    client = FakeClient()
+
+
+def test_snapshot_shape():
+    cache = DockerStateCache(FakeManager())
+    cache.resync()
+    snapshot = cache.snapshot()
+
+    assert cache.ready and snapshot["version"] == {"Version": "24.0.0"}
+    assert snapshot["containers"] == [{
+        "id": "c" * 12,
+        "name": "mcp-server-1",
+        "image": "mcp-base:latest",
+        "status": "running",
+        "created": "2023-11-14T22:13:20Z",
+        "ports": {"8000/tcp": [{"HostIp": "0.0.0.0", "HostPort": "30001"}], "9000/tcp": None},
+    }]
+    images = sorted(snapshot["images"], key=lambda img: img["id"])
+    assert images == [
+        {"id": "a" * 12, "tags": ["mcp-base:latest"], "size": 123, "created": "2023-11-14T22:13:20Z"},
+        {"id": "b" * 12, "tags": [], "size": 1, "created": "2020-09-13T12:26:40Z"},
+    ]
+
+
+def test_destroy_event_drops_container():
+    cache = DockerStateCache(FakeManager())
+    cache.resync()
+    cache._handle_event({"Type": "container", "Action": "destroy", "Actor": {"ID": "c" * 64}})
+    assert cache.snapshot()["containers"] == []
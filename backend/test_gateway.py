@@ -0,0 +1,34 @@
+import httpx
+import pytest
+
+from app.services.gateway import gateway
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """替换上游容器，记录收到的请求"""
+    received = []
+
+    def handler(request: httpx.Request):
+        received.append(request)
+        return httpx.Response(200, json={"ok": True})
+
+    monkeypatch.setattr(gateway.routes, "get", lambda name: ("upstream", 8000) if name == "demo" else None)
+    monkeypatch.setattr(gateway, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    return received
+
+
+def test_proxy_strips_platform_credentials(client, upstream):
+    response = client.post(
+        "/api/demo/messages?session_id=1",
+        json={"jsonrpc": "2.0"},
+        headers={"Cookie": "session=secret", "X-Custom": "kept"},
+    )
+    assert response.status_code == 200 and response.json() == {"ok": True}
+
+    request = upstream[0]
+    assert str(request.url) == "http://upstream:8000/messages?session_id=1"
+    assert "authorization" not in request.headers
+    assert "cookie" not in request.headers
+    assert request.headers["x-custom"] == "kept"
+    assert request.headers["x-forwarded-prefix"] == "/api/demo"
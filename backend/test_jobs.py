@@ -0,0 +1,157 @@
+import asyncio
+import time
+
+import pytest
+from sqlalchemy.orm import Session
+
+from app import models
+from app.database import SessionLocal
+from app.services import jobs, leases, lifecycle
+from app.services.docker_manager import docker_manager
+from app.services.jobs import JobManager, JobState
+
+
+def server_status(server_id):
+    db = SessionLocal()
+    try:
+        return db.get(models.MCPServer, server_id).status
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def actions(monkeypatch):
+    """替换 perform_action，记录执行顺序；gate 未放行时操作一直阻塞"""
+    calls = []
+    gate = {}
+
+    async def perform_action(db, server, action, progress=None, options=None):
+        calls.append(("begin", server.id, action))
+        event = gate.get(action)
+        if event is not None:
+            await event.wait()
+        else:
+            await asyncio.sleep(0.05)
+        calls.append(("end", server.id, action))
+        return {"message": f"{action} done"}
+
+    monkeypatch.setattr(lifecycle, "perform_action", perform_action)
+    monkeypatch.setattr(jobs, "LEASE_POLL_INTERVAL", 0.01)
+    return calls, gate
+
+
+def test_same_action_is_coalesced(create_server, actions):
+    server_id = create_server("jobs-a")["id"]
+
+    async def run():
+        manager = JobManager(workers=2)
+        first, coalesced = manager.submit(server_id, "stop")
+        assert not coalesced
+        second, coalesced = manager.submit(server_id, "stop")
+        assert coalesced and second is first
+        other, coalesced = manager.submit(server_id, "start", {"wait_ready": True})
+        assert not coalesced
+        await manager.wait(first)
+        await manager.wait(other)
+        return first, other
+
+    first, other = asyncio.run(run())
+    assert first.state == other.state == JobState.SUCCEEDED
+    assert first.result == {"message": "stop done"}
+
+
+def test_actions_on_one_server_run_in_order(create_server, actions):
+    calls, _ = actions
+    a = create_server("jobs-b")["id"]
+    b = create_server("jobs-c")["id"]
+
+    async def run():
+        manager = JobManager(workers=4)
+        submitted = [manager.submit(a, "stop")[0], manager.submit(a, "restart")[0], manager.submit(b, "stop")[0]]
+        await asyncio.gather(*(manager.wait(job) for job in submitted))
+
+    asyncio.run(run())
+    on_a = [call for call in calls if call[1] == a]
+    assert on_a == [("begin", a, "stop"), ("end", a, "stop"), ("begin", a, "restart"), ("end", a, "restart")]
+    # 不同服务器并行执行：b 在 a 的第一个操作结束之前开始
+    assert calls.index(("begin", b, "stop")) < calls.index(("end", a, "stop"))
+
+
+def test_running_job_task_is_referenced(create_server, actions):
+    _, gate = actions
+    server_id = create_server("jobs-d")["id"]
+
+    async def run():
+        gate["stop"] = asyncio.Event()
+        manager = JobManager()
+        job, _ = manager.submit(server_id, "stop")
+        await asyncio.sleep(0.05)
+        assert job.task in manager._tasks and not job.task.done()
+        gate["stop"].set()
+        await manager.wait(job)
+        await asyncio.sleep(0)
+        assert manager._tasks == set()
+
+    asyncio.run(run())
+
+
+def test_shutdown_cancels_jobs_and_restores_status(create_server, actions):
+    _, gate = actions
+    server_id = create_server("jobs-e")["id"]
+
+    async def run():
+        gate["start"] = asyncio.Event()  # 永不放行
+        manager = JobManager()
+        job, _ = manager.submit(server_id, "start")
+        while job.state != JobState.RUNNING:
+            await asyncio.sleep(0.01)
+        assert server_status(server_id) == models.ServerStatus.BUILDING
+        await manager.shutdown()
+        return job
+
+    job = asyncio.run(run())
+    assert job.state == JobState.FAILED and job.done.is_set()
+    assert server_status(server_id) == models.ServerStatus.STOPPED
+    assert leases.current(server_id) is None
+
+
+def test_lifecycle_db_writes_do_not_block_event_loop(create_server, monkeypatch):
+    server_id = create_server("jobs-f")["id"]
+    commit = Session.commit
+
+    def slow_commit(self):
+        # 模拟等待数据库写锁
+        time.sleep(0.2)
+        commit(self)
+
+    def run_container(server_id, server_name, host_base_path, env_vars, requested_ports=None, **kwargs):
+        return {"container_id": "fake-container", "port": requested_ports[0], "ports": {8000: requested_ports[0]}}
+
+    async def remove_container(server, reason="stop"):
+        pass
+
+    monkeypatch.setattr(docker_manager, "run_container", run_container)
+    monkeypatch.setattr(lifecycle, "remove_container", remove_container)
+    monkeypatch.setattr(Session, "commit", slow_commit)
+
+    async def run(action):
+        """执行操作，返回任务和期间事件循环的最长停顿（秒）"""
+        manager = JobManager()
+        job, _ = manager.submit(server_id, action)
+        longest = 0.0
+        last = time.monotonic()
+        while not job.done.is_set():
+            await asyncio.sleep(0.01)
+            now = time.monotonic()
+            longest = max(longest, now - last)
+            last = now
+        return job, longest
+
+    job, longest = asyncio.run(run("start"))
+    assert job.state == JobState.SUCCEEDED, job.error
+    assert longest < 0.15
+    assert server_status(server_id) == models.ServerStatus.RUNNING
+    job, longest = asyncio.run(run("stop"))
+    assert job.state == JobState.SUCCEEDED, job.error
+    assert longest < 0.15
+    assert server_status(server_id) == models.ServerStatus.STOPPED
@@ -0,0 +1,114 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import models
+from app.database import SessionLocal
+from app.services import jobs, leases, lifecycle
+from app.services.jobs import JobManager, JobState
+
+
+@pytest.fixture
+def other_worker(monkeypatch):
+    """以另一个 worker 的身份执行 fn"""
+    def run_as(fn, *args):
+        original = leases.WORKER_ID
+        monkeypatch.setattr(leases, "WORKER_ID", "other-worker")
+        try:
+            return fn(*args)
+        finally:
+            monkeypatch.setattr(leases, "WORKER_ID", original)
+    return run_as
+
+
+def expire(server_id):
+    db = SessionLocal()
+    try:
+        db.query(models.ServerLease).filter(models.ServerLease.server_id == server_id).update(
+            {"expires_at": datetime.utcnow() - timedelta(seconds=1)}
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_lease_is_exclusive_until_released(create_server, other_worker):
+    server_id = create_server("lease-a")["id"]
+    assert leases.try_acquire(server_id, "start")
+    assert leases.try_acquire(server_id, "start")  # 同一 worker 可以重入
+    assert not other_worker(leases.try_acquire, server_id, "stop")
+    assert not other_worker(leases.renew, server_id)
+    assert leases.current(server_id).owner == leases.WORKER_ID
+    assert leases.renew(server_id)
+    leases.release(server_id)
+    assert leases.current(server_id) is None
+    assert other_worker(leases.try_acquire, server_id, "stop")
+    other_worker(leases.release, server_id)
+
+
+def test_expired_lease_is_taken_over(create_server, other_worker):
+    server_id = create_server("lease-b")["id"]
+    assert other_worker(leases.try_acquire, server_id, "start")
+    expire(server_id)
+    assert leases.current(server_id) is None
+    assert leases.try_acquire(server_id, "stop")
+    assert leases.current(server_id).action == "stop"
+    assert not other_worker(leases.renew, server_id)
+    leases.release(server_id)
+
+
+def test_job_joins_same_action_on_other_worker(create_server, other_worker, monkeypatch):
+    server_id = create_server("lease-c")["id"]
+    executed = []
+
+    async def perform_action(db, server, action, progress=None, options=None):
+        executed.append(action)
+        return {"message": "done"}
+
+    monkeypatch.setattr(lifecycle, "perform_action", perform_action)
+    monkeypatch.setattr(jobs, "LEASE_POLL_INTERVAL", 0.01)
+    assert other_worker(leases.try_acquire, server_id, "stop")
+
+    async def run():
+        manager = JobManager()
+        job, _ = manager.submit(server_id, "stop")
+        await asyncio.sleep(0.1)
+        assert job.phase.startswith("waiting: stop")
+        other_worker(leases.release, server_id)
+        return await manager.wait(job)
+
+    job = asyncio.run(run())
+    # 另一个 worker 已执行过相同操作，不再重复执行
+    assert job.state == JobState.SUCCEEDED and job.result["joined"]
+    assert executed == []
+
+
+def test_lease_calls_do_not_block_event_loop(create_server, monkeypatch):
+    server_id = create_server("lease-d")["id"]
+    current = leases.current
+
+    def slow_current(server_id):
+        # 模拟等待 SQLite 写锁
+        time.sleep(0.3)
+        return current(server_id)
+
+    async def perform_action(db, server, action, progress=None, options=None):
+        return {"message": "done"}
+
+    monkeypatch.setattr(leases, "current", slow_current)
+    monkeypatch.setattr(lifecycle, "perform_action", perform_action)
+
+    async def run():
+        manager = JobManager()
+        job, _ = manager.submit(server_id, "stop")
+        ticks = 0
+        while not job.done.is_set():
+            await asyncio.sleep(0.01)
+            ticks += 1
+        return job, ticks
+
+    job, ticks = asyncio.run(run())
+    assert job.state == JobState.SUCCEEDED
+    assert ticks >= 10
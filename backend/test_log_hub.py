@@ -0,0 +1,123 @@
+import asyncio
+import queue
+
+import pytest
+
+from app.services.docker_manager import docker_manager
+from app.services.log_hub import LogHub
+
+
+def line(second, text):
+    return f"2024-01-01T00:00:{second:02d}.000000000Z {text}\n".encode()
+
+
+class FollowStream:
+    """跟随模式的日志流，由测试推送数据"""
+
+    def __init__(self):
+        self.chunks = queue.Queue()
+
+    def push(self, chunk):
+        self.chunks.put(chunk)
+
+    def __iter__(self):
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                return
+            yield chunk
+
+    def close(self):
+        self.chunks.put(None)
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """记录打开的 Docker 日志流；历史为 3 行，跟随流由测试推送"""
+    opened = []
+    stream = FollowStream()
+
+    def open_log_stream(container_id, tail="all", since=None, follow=True):
+        opened.append({"tail": tail, "since": since, "follow": follow})
+        if not follow:
+            return iter([line(1, "a") + line(2, "b"), line(3, "c")])
+        return stream
+
+    monkeypatch.setattr(docker_manager, "open_log_stream", open_log_stream)
+    yield opened, stream
+    stream.close()
+
+
+async def collect(subscription, count):
+    return [(await asyncio.wait_for(subscription.get(), 2))[2] for _ in range(count)]
+
+
+def test_subscribers_share_one_upstream_stream(upstream):
+    opened, follow = upstream
+
+    async def run():
+        hub = LogHub(buffer_lines=10, queue_size=10, idle_timeout=60)
+        first = await hub.subscribe("c1", tail=2)
+        second = await hub.subscribe("c1", tail=None)
+        assert await collect(first, 2) == ["b", "c"]
+        assert await collect(second, 3) == ["a", "b", "c"]
+        # 跟随流从最后一条历史日志的时间开始，重复的行被跳过
+        follow.push(line(3, "c") + line(4, "d"))
+        assert await collect(first, 1) == ["d"]
+        assert await collect(second, 1) == ["d"]
+        assert hub.stats() == {"streams": 1, "subscribers": 2, "sinks": 0}
+        follow.close()
+        assert await asyncio.wait_for(first.get(), 2) is None
+        assert hub.stats()["streams"] == 0
+
+    asyncio.run(run())
+    assert [stream["follow"] for stream in opened] == [False, True]
+
+
+def test_slow_subscriber_drops_lines(upstream):
+    _, follow = upstream
+
+    async def run():
+        hub = LogHub(buffer_lines=10, queue_size=3, idle_timeout=60)
+        subscription = await hub.subscribe("c1", tail=0)
+        follow.push(b"".join(line(10 + i, f"n{i}") for i in range(6)))
+        while subscription.dropped == 0:
+            await asyncio.sleep(0.01)
+        assert await collect(subscription, 3) == ["n0", "n1", "n2"]
+        # 队列有空位后先插入丢弃提示
+        follow.push(line(30, "later"))
+        assert await collect(subscription, 2) == ["[3 log lines dropped: viewer too slow]", "later"]
+
+    asyncio.run(run())
+
+
+def test_idle_stream_closes_after_last_viewer(upstream):
+    async def run():
+        hub = LogHub(buffer_lines=10, queue_size=10, idle_timeout=0.05)
+        subscription = await hub.subscribe("c1")
+        hub.unsubscribe(subscription)
+        assert hub.stats()["streams"] == 1
+        await asyncio.sleep(0.2)
+        assert hub.stats()["streams"] == 0
+
+    asyncio.run(run())
+
+
+def test_sink_receives_history_and_end(upstream):
+    _, follow = upstream
+    written = []
+    ended = asyncio.Event()
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        hub = LogHub(buffer_lines=10, queue_size=10, idle_timeout=0.01)
+        sink = (lambda entries: written.extend(e[2] for e in entries), lambda: loop.call_soon_threadsafe(ended.set))
+        assert hub.attach("c1", "capture", sink)
+        assert not hub.attach("c1", "capture", (lambda entries: True, lambda: None))
+        follow.push(line(5, "e"))
+        follow.close()
+        await asyncio.wait_for(ended.wait(), 2)
+
+    asyncio.run(run())
+    # 历史日志可能在 attach 返回前就已读完，也必须写入 sink
+    assert written == ["a", "b", "c", "e"]
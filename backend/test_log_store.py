@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+from app.services import log_store
+from app.services.log_hub import parse_log_line
+from app.services.log_store import ServerLogStore
+
+
+def entries(start, count, text="line"):
+    """从 start 秒开始、每秒一行的日志"""
+    return [parse_log_line(f"2024-01-01T00:00:{start + i:02d}.000000000Z {text} {start + i}") for i in range(count)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    base = tmp_path / "server"
+    os.makedirs(base)
+    return ServerLogStore(str(base), segment_bytes=300, block_bytes=100, retention_bytes=1 << 20)
+
+
+def test_append_seal_and_search(store):
+    assert store.append("c1", entries(0, 10))
+    store.seal()
+    assert store.append("c1", entries(10, 5))
+    stats = store.stats()
+    assert stats["segments"] >= 1 and stats["active_bytes"] > 0
+
+    result = store.search("line 1", since=entries(3, 1)[0][0])
+    assert [m["line"] for m in result["matches"]] == [f"line {i}" for i in range(10, 15)]
+    assert not result["truncated"]
+    result = store.search(since=entries(2, 1)[0][0], until=entries(11, 1)[0][0], limit=5)
+    assert [m["line"] for m in result["matches"]] == [f"line {i}" for i in range(2, 7)]
+    assert result["truncated"]
+
+
+def test_index_is_not_rewritten_for_every_batch(store, monkeypatch):
+    saves = []
+    save = ServerLogStore._save_index
+
+    def counting_save(self):
+        saves.append(1)
+        save(self)
+
+    monkeypatch.setattr(ServerLogStore, "_save_index", counting_save)
+    monkeypatch.setattr(log_store, "INDEX_SAVE_INTERVAL", 3600)
+    store.append("c1", entries(0, 1))  # 首次写入该容器
+    for i in range(1, 4):
+        store.append("c1", entries(i, 1))
+    assert len(saves) == 1
+    store.flush()
+    assert len(saves) == 2
+    store.flush()  # 没有新变化时不写入
+    assert len(saves) == 2
+
+
+def test_last_captured_recovers_after_unclean_exit(store, monkeypatch):
+    monkeypatch.setattr(log_store, "INDEX_SAVE_INTERVAL", 3600)
+    store.append("c1", entries(0, 1))
+    store.append("c1", entries(1, 3))
+    # 模拟平台异常退出：索引中的时间落后于 current.log
+    reopened = ServerLogStore(store.base_path, store.segment_bytes, store.block_bytes, store.retention_bytes)
+    assert reopened.last_captured("c1") == entries(3, 1)[0][0]
+    assert reopened.last_captured("c2") is None
+
+
+def test_append_after_server_deleted(tmp_path):
+    store = ServerLogStore(str(tmp_path / "gone"), 300, 100, 1 << 20)
+    assert not store.append("c1", entries(0, 1))
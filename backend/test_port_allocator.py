@@ -0,0 +1,123 @@
+import random
+import threading
+
+import pytest
+
+from app.services.port_allocator import FreeRunTree, PortAllocator
+
+
+def brute_force_runs(bitmap):
+    """朴素实现：返回 (最长连续空闲长度, 空闲段数)"""
+    best = runs = current = 0
+    for used in bitmap:
+        if used:
+            current = 0
+        else:
+            if current == 0:
+                runs += 1
+            current += 1
+            best = max(best, current)
+    return best, runs
+
+
+@pytest.fixture
+def allocator(monkeypatch):
+    monkeypatch.setattr(PortAllocator, "probe", staticmethod(lambda port: True))
+    allocator = PortAllocator(40000, 40010)
+    allocator.rebuild([])
+    return allocator
+
+
+@pytest.mark.parametrize("size", [1, 7, 64, 100])
+def test_free_run_tree_matches_brute_force(size):
+    rng = random.Random(size)
+    bitmap = bytearray(rng.randint(0, 1) for _ in range(size))
+    tree = FreeRunTree(size)
+    tree.build(bitmap)
+    for _ in range(200):
+        index = rng.randrange(size)
+        bitmap[index] ^= 1
+        tree.update(index, not bitmap[index])
+        assert (tree.largest_free_run, tree.free_runs) == brute_force_runs(bitmap)
+        free = [i for i, used in enumerate(bitmap) if not used]
+        start = rng.randrange(size)
+        assert tree.first_free(start) == next((i for i in free if i >= start), None)
+
+
+def test_allocate_skips_reserved_ports(allocator):
+    assert allocator.reserve(40000, "a")
+    assert not allocator.reserve(40000, "b")
+    assert allocator.allocate("b") == 40001
+    assert allocator.owner_of(40000) == "a"
+    assert allocator.ports_of("b") == [40001]
+
+
+def test_allocate_marks_busy_ports_as_system(allocator, monkeypatch):
+    monkeypatch.setattr(PortAllocator, "probe", staticmethod(lambda port: port != 40000))
+    assert allocator.allocate("a") == 40001
+    assert allocator.owner_of(40000) == PortAllocator.SYSTEM_OWNER
+
+
+def test_release_and_exhaustion(allocator):
+    ports = [allocator.allocate("a") for _ in range(10)]
+    assert ports == list(range(40000, 40010))
+    assert allocator.allocate("a") is None
+    allocator.release(40005, owner="other")
+    assert allocator.owner_of(40005) == "a"
+    allocator.release(40005, owner="a")
+    assert allocator.allocate("b") == 40005
+    allocator.release_owner("a")
+    assert allocator.ports_of("a") == []
+
+
+def test_free_list_has_no_duplicates(allocator):
+    for _ in range(1000):
+        allocator.reserve(40003, "a")
+        allocator.release(40003)
+    assert len(allocator._free) <= 10
+    assert len(set(allocator._free)) == len(allocator._free)
+    assert sorted(allocator.allocate("b") for _ in range(10)) == list(range(40000, 40010))
+
+
+def test_stats_are_incremental(allocator):
+    allocator.reserve(40002, "a")
+    allocator.reserve(40006, "b")
+    allocator.reserve(8080, "c")  # 端口池之外只记录归属
+    stats = allocator.stats()
+    assert stats["allocated_ports_count"] == 2
+    assert stats["available_ports_count"] == 8
+    assert stats["largest_free_run"] == 3
+    assert stats["free_runs"] == 3
+    allocator.release_owner("b")
+    assert allocator.stats()["largest_free_run"] == 7
+
+
+def test_rebuild_keeps_first_owner(allocator):
+    allocator.rebuild([(40001, "db"), (40001, "docker:x"), (40002, "db")])
+    assert allocator.owner_of(40001) == "db"
+    assert allocator.ports_of("db") == [40001, 40002]
+    assert allocator.allocate("a") == 40000
+    assert allocator.allocate("a") == 40003
+
+
+def test_concurrent_allocations_are_unique(monkeypatch):
+    monkeypatch.setattr(PortAllocator, "probe", staticmethod(lambda port: True))
+    allocator = PortAllocator(41000, 41400)
+    allocator.rebuild([])
+    results = {}
+    start = threading.Barrier(8)
+
+    def worker(owner):
+        start.wait()
+        results[owner] = [allocator.allocate(owner) for _ in range(50)]
+
+    threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    ports = [port for owned in results.values() for port in owned]
+    assert None not in ports and len(set(ports)) == 400
+    assert allocator.allocate("late") is None
+    for owner, owned in results.items():
+        assert sorted(allocator.ports_of(owner)) == sorted(owned)
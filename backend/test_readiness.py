@@ -0,0 +1,67 @@
+import asyncio
+
+import httpx
+
+from app.services import readiness
+
+
+async def serve(handler, probe):
+    """在随机端口启动 TCP 服务，执行 probe(port) 并返回结果"""
+    server = await asyncio.start_server(handler, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        return await probe(port)
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+async def close_immediately(reader, writer):
+    # docker-proxy 在后端没有进程监听时的行为：接受连接后立即关闭
+    writer.close()
+
+
+async def hold_open(reader, writer):
+    await asyncio.sleep(1)
+    writer.close()
+
+
+async def http_ok(reader, writer):
+    await reader.readuntil(b"\r\n\r\n")
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nContent-Length: 0\r\n\r\n")
+    await writer.drain()
+    writer.close()
+
+
+def probe_http(port):
+    async def run():
+        async with httpx.AsyncClient(timeout=1.0) as client:
+            return await readiness._probe_http(client, "127.0.0.1", port)
+    return run()
+
+
+def probe_tcp(port):
+    return readiness._probe_tcp("127.0.0.1", port)
+
+
+def test_http_probe_requires_response():
+    assert asyncio.run(serve(http_ok, probe_http)) is True
+    assert asyncio.run(serve(close_immediately, probe_http)) is False
+    # 连接保持打开但没有响应（响应头超时）同样不算就绪
+    assert asyncio.run(serve(hold_open, probe_http)) is False
+
+
+def test_tcp_probe_requires_open_connection():
+    assert asyncio.run(serve(hold_open, probe_tcp)) is True
+    assert asyncio.run(serve(close_immediately, probe_tcp)) is False
+
+
+def test_probes_fail_when_nothing_listens():
+    async def closed_port():
+        server = await asyncio.start_server(close_immediately, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        server.close()
+        await server.wait_closed()
+        return await probe_http(port), await probe_tcp(port)
+
+    assert asyncio.run(closed_port()) == (False, False)
@@ -0,0 +1,108 @@
+import pytest
+
+from app import models
+from app.database import SessionLocal
+from app.services.docker_manager import LABEL_SERVER_ID, docker_manager
+from app.services.gateway import gateway
+from app.services.port_allocator import port_allocator
+from app.services.reconciler import Reconciler
+
+
+def update_server(server_id, **values):
+    db = SessionLocal()
+    try:
+        db.query(models.MCPServer).filter(models.MCPServer.id == server_id).update(values)
+        db.commit()
+    finally:
+        db.close()
+
+
+def load_server(server_id):
+    db = SessionLocal()
+    try:
+        return db.get(models.MCPServer, server_id)
+    finally:
+        db.close()
+
+
+class FakeAPI:
+    def __init__(self):
+        self.labeled = []
+        self.by_id = {}
+        self.on_id_query = None
+        self.queries = []
+
+    def containers(self, all=False, filters=None):
+        self.queries.append(filters)
+        if "label" in filters:
+            return self.labeled
+        if self.on_id_query:
+            self.on_id_query()
+        return [self.by_id[cid] for cid in filters["id"] if cid in self.by_id]
+
+
+class FakeClient:
+    def __init__(self):
+        self.api = FakeAPI()
+
+
+@pytest.fixture
+def api(monkeypatch):
+    fake = FakeClient()
+    monkeypatch.setattr(docker_manager, "client", fake)
+    return fake.api
+
+
+def test_reconcile_lists_containers_by_server_label(create_server, api):
+    server_id = create_server("reconcile-a")["id"]
+    api.labeled = [{
+        "Id": "a" * 64, "Labels": {LABEL_SERVER_ID: server_id}, "State": "running",
+        "Ports": [{"PrivatePort": 8000, "PublicPort": 30777, "Type": "tcp"}],
+    }]
+    Reconciler().reconcile_all()
+
+    assert api.queries == [{"label": LABEL_SERVER_ID}]
+    server = load_server(server_id)
+    assert server.status == models.ServerStatus.RUNNING
+    assert (server.container_id, server.host_port) == ("a" * 64, 30777)
+    assert port_allocator.owner_of(30777) == server_id
+    gateway.routes.remove(server.name)
+    update_server(server_id, status=models.ServerStatus.STOPPED, container_id=None, host_port=None)
+    port_allocator.release(30777)
+
+
+def test_unlabeled_container_is_found_by_id(create_server, api):
+    server_id = create_server("reconcile-b")["id"]
+    update_server(server_id, status=models.ServerStatus.RUNNING, container_id="b" * 64)
+    api.by_id = {"b" * 64: {"Id": "b" * 64, "Labels": {}, "State": "exited", "Status": "Exited (1) 2 seconds ago"}}
+    Reconciler().reconcile_all()
+
+    assert api.queries[1] == {"id": ["b" * 64]}
+    server = load_server(server_id)
+    assert (server.status, server.exit_code) == (models.ServerStatus.ERROR, 1)
+    update_server(server_id, status=models.ServerStatus.STOPPED, container_id=None)
+
+
+def test_reconcile_does_not_overwrite_building(create_server, api):
+    server_id = create_server("reconcile-c")["id"]
+    update_server(server_id, status=models.ServerStatus.RUNNING, container_id="c" * 64)
+    # 对账读取服务器之后，生命周期任务把状态改为 BUILDING
+    api.on_id_query = lambda: update_server(server_id, status=models.ServerStatus.BUILDING)
+    Reconciler().reconcile_all()
+
+    server = load_server(server_id)
+    assert server.status == models.ServerStatus.BUILDING
+    assert server.container_id == "c" * 64
+    update_server(server_id, status=models.ServerStatus.STOPPED, container_id=None)
+
+
+def test_die_event_keeps_building_status(create_server, api):
+    server_id = create_server("reconcile-d")["id"]
+    update_server(server_id, status=models.ServerStatus.BUILDING, container_id="d" * 64)
+    Reconciler().apply_events([
+        {"Action": "die", "Actor": {"ID": "d" * 64, "Attributes": {LABEL_SERVER_ID: server_id, "exitCode": "3"}}},
+    ])
+
+    server = load_server(server_id)
+    assert (server.status, server.exit_code) == (models.ServerStatus.BUILDING, 3)
+    update_server(server_id, status=models.ServerStatus.STOPPED, container_id=None)
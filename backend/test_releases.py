@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+from app.services.releases import ReleaseError, ReleaseManager
+
+
+def new_release(manager, base, content):
+    release_id, path = manager.create(base)
+    with open(os.path.join(path, "server.py"), "w") as f:
+        f.write(content)
+    return release_id
+
+
+def current_code(base):
+    with open(os.path.join(base, "app", "server.py")) as f:
+        return f.read()
+
+
+def test_activate_and_rollback(tmp_path):
+    manager = ReleaseManager(keep=5)
+    base = str(tmp_path)
+    first = new_release(manager, base, "v1")
+    manager.activate(base, first)
+    second = new_release(manager, base, "v2")
+    assert current_code(base) == "v1"
+    manager.activate(base, second)
+    assert current_code(base) == "v2"
+    assert not os.path.isabs(os.readlink(os.path.join(base, "app")))
+
+    assert manager.rollback(base) == first and current_code(base) == "v1"
+    with pytest.raises(ReleaseError):
+        manager.rollback(base)  # 已是最早的版本
+    assert manager.rollback(base, second) == second
+    assert [release["current"] for release in manager.list(base)] == [True, False]
+
+
+def test_prune_keeps_current(tmp_path):
+    manager = ReleaseManager(keep=2)
+    base = str(tmp_path)
+    ids = [new_release(manager, base, f"v{i}") for i in range(3)]
+    manager.activate(base, ids[0])
+    manager.activate(base, ids[2])
+    # 保留最新的两个版本，当前版本之外的旧版本被清理
+    assert manager.ids(base) == [ids[2], ids[1]]
+    manager.activate(base, ids[1])
+    new_release(manager, base, "v3")
+    extra = new_release(manager, base, "v4")
+    manager.activate(base, extra)
+    assert ids[1] not in manager.ids(base) and manager.current(base) == extra
+
+
+def test_migrate_legacy_app_dir(tmp_path):
+    manager = ReleaseManager()
+    base = str(tmp_path)
+    os.makedirs(tmp_path / "app")
+    (tmp_path / "app" / "server.py").write_text("legacy")
+    release_id = manager.migrate(base)
+    assert os.path.islink(os.path.join(base, "app")) and manager.current(base) == release_id
+    assert current_code(base) == "legacy"
+    assert manager.migrate(base) is None
+
+
+@pytest.mark.parametrize("release_id", ["", "../x", ".hidden", "000001.manifest.json"])
+def test_invalid_release_id(tmp_path, release_id):
+    with pytest.raises(ReleaseError):
+        ReleaseManager().activate(str(tmp_path), release_id)
@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+import json
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from app import models
+from app.main import decode_server_cursor, encode_server_cursor
+from app.services import lifecycle
+
+
+def test_bulk_action_streams_progress_with_bounded_parallelism(client, create_server, monkeypatch):
+    for i in range(5):
+        create_server(f"bulk-{i}")
+    create_server("other-bulk")
+    running = {"now": 0, "peak": 0}
+
+    async def perform_action(db, server, action, progress=None, options=None):
+        running["now"] += 1
+        running["peak"] = max(running["peak"], running["now"])
+        await asyncio.sleep(0.05)
+        running["now"] -= 1
+        if server.name == "bulk-3":
+            raise HTTPException(status_code=500, detail="boom")
+        return {"message": f"{action} done"}
+
+    monkeypatch.setattr(lifecycle, "perform_action", perform_action)
+    response = client.post("/api/servers/bulk-action", json={"action": "stop", "name_pattern": "bulk-*", "parallelism": 2})
+    assert response.status_code == 200
+    events = [json.loads(line) for line in response.text.splitlines()]
+
+    assert events[0]["event"] == "accepted" and events[0]["total"] == 5 and events[0]["parallelism"] == 2
+    assert [server["name"] for server in events[0]["servers"]] == [f"bulk-{i}" for i in range(5)]
+    assert sum(event["event"] == "started" for event in events) == 5
+    failed = [event for event in events if event["event"] == "failed"]
+    assert [(event["name"], event["status_code"], event["message"]) for event in failed] == [("bulk-3", 500, "boom")]
+    assert events[-1] == {"event": "finished", "succeeded": 4, "failed": 1}
+    assert running["peak"] == 2
+
+
+def test_bulk_action_requires_selector(client):
+    assert client.post("/api/servers/bulk-action", json={"action": "stop"}).status_code == 400
+    assert client.post("/api/servers/bulk-action", json={"action": "explode", "ids": ["x"]}).status_code == 400
+
+
+def test_delete_server(client, create_server):
+    server = create_server("delete-a", ports="30911")
+    assert client.delete(f"/api/servers/{server['id']}").status_code == 200
+    assert client.get(f"/api/servers/{server['id']}").status_code == 404
+    assert client.delete(f"/api/servers/{server['id']}").status_code == 404
+    # 端口已归还
+    create_server("delete-b", ports="30911")
+
+
+def code_manifest(files):
+    return {"files": {
+        path: {"sha256": hashlib.sha256(content).hexdigest(), "size": len(content)} for path, content in files.items()
+    }}
+
+
+def test_code_sync_and_commit(client, create_server):
+    server = create_server("code-a")
+    base = f"/api/servers/{server['id']}"
+    files = {"server.py": b"mcp = 'v2'\n", "lib/util.py": b"VALUE = '" + server["id"].encode() + b"'\n"}
+    manifest = code_manifest(files)
+    digests = {hashlib.sha256(content).hexdigest(): content for content in files.values()}
+
+    response = client.post(f"{base}/code/sync", json=manifest)
+    assert response.status_code == 200
+    assert sorted(response.json()["changed"]) == ["lib/util.py", "server.py"]
+    assert response.json()["removed"] == []
+    missing = response.json()["missing"]
+    # lib/util.py 的内容包含服务器 id，对象库中一定没有
+    assert hashlib.sha256(files["lib/util.py"]).hexdigest() in missing
+
+    # 对象缺失时不能提交
+    assert client.post(f"{base}/code/commit", json=manifest).status_code == 409
+
+    assert client.put(f"/api/servers/missing/code/blobs/{missing[0]}", content=digests[missing[0]]).status_code == 404
+    assert client.put(f"{base}/code/blobs/{missing[0]}", content=b"wrong").status_code == 400
+    for digest in missing:
+        response = client.put(f"{base}/code/blobs/{digest}", content=digests[digest])
+        assert response.status_code == 200 and response.json()["stored"] is True
+    # 未提交的对象在 gc 保留期内不会被回收
+    client.post("/api/system/code-store/gc")
+    assert client.post(f"{base}/code/sync", json=manifest).json()["missing"] == []
+
+    response = client.post(f"{base}/code/commit", json=manifest)
+    assert response.status_code == 200
+    assert client.post(f"{base}/code/sync", json=manifest).json()["changed"] == []
+    assert client.post(f"{base}/code/sync", json=code_manifest({"server.py": files["server.py"]})).json()["removed"] == [
+        "lib/util.py"
+    ]
+
+
+def test_release_rollback(client, create_server):
+    server = create_server("release-a", code=b"mcp = 'v1'\n")
+    base = f"/api/servers/{server['id']}"
+    files = {"server.py": b"mcp = 'v2'\n"}
+    manifest = code_manifest(files)
+    digest = manifest["files"]["server.py"]["sha256"]
+    client.put(f"{base}/code/blobs/{digest}", content=files["server.py"])
+    committed = client.post(f"{base}/code/commit", json=manifest).json()["release_id"]
+
+    releases = client.get(f"{base}/releases").json()
+    assert [release["current"] for release in releases] == [True, False]
+    response = client.post(f"{base}/releases/rollback", json={})
+    assert response.status_code == 200 and response.json()["release_id"] == releases[1]["id"]
+    assert client.post(f"{base}/code/sync", json=manifest).json()["changed"] == ["server.py"]
+    assert client.post(f"{base}/releases/rollback", json={"release_id": committed}).json()["release_id"] == committed
+    assert client.post(f"{base}/code/sync", json=manifest).json()["changed"] == []
+    assert client.post(f"{base}/releases/rollback", json={"release_id": "missing"}).status_code == 400
+
+
+def test_cursor_round_trip():
+    server = models.MCPServer(
+        id="abc", name="demo", status=models.ServerStatus.RUNNING, created_at=datetime(2026, 1, 2, 3, 4, 5)
+    )
+    for field in ("name", "created_at", "status"):
+        assert decode_server_cursor(encode_server_cursor(server, field), field) == (getattr(server, field), "abc")
+
+
+@pytest.mark.parametrize("cursor", ["not-base64!", "bnVsbA", "WzEsIDJd"])
+def test_invalid_cursor(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_server_cursor(cursor, "created_at")
+    assert error.value.status_code == 400
+
+
+def test_list_pagination(client, create_server):
+    names = {create_server(f"page-{i}")["name"] for i in range(5)}
+    seen = []
+    cursor = None
+    while True:
+        params = {"name_prefix": "page-", "sort": "-name", "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/api/servers", params=params)
+        assert response.status_code == 200
+        seen += [server["name"] for server in response.json()]
+        assert "env_vars" not in response.json()[0]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == sorted(names, reverse=True)
+    assert client.get("/api/servers", params={"cursor": "bad!"}).status_code == 400
+
+
+def test_port_conflict(client, create_server):
+    create_server("port-a", ports="30901")
+    response = client.post("/api/servers", data={"name": "port-b", "ports": "30901"}, files={"file": ("server.py", b"")})
+    assert response.status_code == 409
+    other = create_server("port-c")
+    assert client.put(f"/api/servers/{other['id']}", json={"ports": "30901"}).status_code == 409
+    response = client.put(f"/api/servers/{other['id']}", json={"ports": "30902,30903"})
+    assert response.status_code == 200
+    assert response.json()["ports"] == "30902,30903"
+
+
+def test_etags(client, create_server):
+    server = create_server("etag-a")
+    url = f"/api/servers/{server['id']}"
+    etag = client.get(url).headers["ETag"]
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(url, headers={"If-None-Match": f'"other", W/{etag}'}).status_code == 304
+
+    list_etag = client.get("/api/servers").headers["ETag"]
+    assert client.get("/api/servers", headers={"If-None-Match": list_etag}).status_code == 304
+    # 查询参数不同的列表使用不同的 ETag
+    assert client.get("/api/servers?view=full", headers={"If-None-Match": list_etag}).status_code == 200
+    fleet = client.get("/api/system/fleet-version").json()["version"]
+
+    assert client.put(url, json={"description": "changed"}).status_code == 200
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 200
+    assert client.get("/api/servers", headers={"If-None-Match": list_etag}).status_code == 200
+    assert client.get("/api/system/fleet-version").json()["version"] > fleet
+
+    # 没有实际修改的更新不改变版本号
+    etag = client.get(url).headers["ETag"]
+    client.put(url, json={"description": "changed"})
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
@@ -0,0 +1,89 @@
+import os
+from collections import deque
+
+import pytest
+
+from app.services import lifecycle
+from app.services.docker_manager import BASE_IMAGE, docker_manager
+from app.services.port_allocator import port_allocator
+from app.services.warm_pool import warm_pool
+
+
+class FakeContainer:
+    status = "running"
+
+    def __init__(self, container_id):
+        self.id = container_id
+
+    def stop(self, timeout=None):
+        self.status = "exited"
+
+    def remove(self, force=False):
+        self.status = "removed"
+
+
+class FakeContainers:
+    def __init__(self):
+        self.items = {}
+
+    def get(self, container_id):
+        return self.items.setdefault(container_id, FakeContainer(container_id))
+
+
+class FakeClient:
+    def __init__(self):
+        self.containers = FakeContainers()
+
+
+@pytest.fixture
+def warm_slot(tmp_path, monkeypatch):
+    """一个空闲的预热槽位（不启动真实容器）"""
+    monkeypatch.setattr(docker_manager, "client", FakeClient())
+    monkeypatch.setattr(lifecycle.log_capture, "capture", lambda server_id, container_id: None)
+    monkeypatch.setattr(warm_pool, "sizes", {BASE_IMAGE: 1})
+    monkeypatch.setattr(warm_pool, "root", str(tmp_path))
+    monkeypatch.setattr(warm_pool, "_idle", {BASE_IMAGE: deque()})
+    slot_dir = tmp_path / "slot1"
+    for sub in ("user_code", "data", "control"):
+        os.makedirs(slot_dir / sub)
+    port = port_allocator.allocate("warm:slot1")
+    slot = {
+        "slot_id": "slot1", "image": BASE_IMAGE, "container_id": "warm-container-1",
+        "port": port, "ip": None, "dir": str(slot_dir),
+    }
+    warm_pool._idle[BASE_IMAGE].append(slot)
+    yield slot
+    warm_pool._claimed.pop(slot["container_id"], None)
+    port_allocator.release(port)
+
+
+def test_start_claims_warm_slot_for_auto_port(client, create_server, warm_slot):
+    server = create_server("warm-a")
+    auto_port = int(server["ports"])
+    assert auto_port != warm_slot["port"]
+
+    response = client.post(f"/api/servers/{server['id']}/action", json={"action": "start"})
+    assert response.status_code == 200, response.text
+    assert response.json()["details"]["container_id"] == warm_slot["container_id"]
+    assert warm_slot["container_id"] in warm_pool._claimed
+
+    # 自动分配的端口改为预热容器的端口，原端口归还
+    server = client.get(f"/api/servers/{server['id']}").json()
+    assert server["ports"] == str(warm_slot["port"])
+    assert server["host_port"] == warm_slot["port"]
+    assert port_allocator.owner_of(warm_slot["port"]) == server["id"]
+    assert port_allocator.owner_of(auto_port) is None
+
+    assert client.post(f"/api/servers/{server['id']}/action", json={"action": "stop"}).status_code == 200
+    assert warm_slot["container_id"] not in warm_pool._claimed
+
+
+def test_pinned_port_does_not_claim(client, create_server, warm_slot, monkeypatch):
+    def run_container(*args, **kwargs):
+        raise RuntimeError("Docker not running")
+
+    monkeypatch.setattr(docker_manager, "run_container", run_container)
+    server = create_server("warm-b", ports="30921")
+    response = client.post(f"/api/servers/{server['id']}/action", json={"action": "start"})
+    assert response.status_code == 503
+    assert len(warm_pool._idle[BASE_IMAGE]) == 1
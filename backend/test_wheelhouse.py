@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+from app.services import wheelhouse as wheelhouse_module
+from app.services.docker_manager import docker_manager
+from app.services.wheelhouse import Wheelhouse, read_requirements
+
+
+class FakeContainer:
+    def __init__(self, volumes):
+        self.volumes = volumes
+
+    def wait(self, timeout=None):
+        out_dir = next(path for path, bind in self.volumes.items() if bind["bind"] == "/out")
+        with open(os.path.join(out_dir, "demo-1.0-py3-none-any.whl"), "wb") as f:
+            f.write(b"wheel")
+
+    def logs(self, tail=None):
+        return b""
+
+    def remove(self, force=False):
+        pass
+
+
+class FakeContainers:
+    def __init__(self):
+        self.runs = []
+
+    def run(self, image, volumes=None, **kwargs):
+        self.runs.append(volumes)
+        return FakeContainer(volumes)
+
+
+class FakeClient:
+    def __init__(self):
+        self.containers = FakeContainers()
+
+
+@pytest.fixture
+def house(tmp_path, monkeypatch):
+    mounts = []
+    monkeypatch.setattr(docker_manager, "add_shared_mount", lambda *args: mounts.append(args))
+    monkeypatch.setattr(docker_manager, "client", FakeClient())
+    # 后台预取在测试期间不会开始
+    house = Wheelhouse(max_bytes=1 << 20, prefetch_interval=0, prefetch_timeout=10, enabled=True, prefetch_delay=3600)
+    return house, mounts
+
+
+def test_start_removes_stale_work_dirs(tmp_path, house):
+    house, mounts = house
+    os.makedirs(tmp_path / ".wheelhouse-work" / "prefetch-old" / "req")
+    os.makedirs(tmp_path / ".wheelhouse" / ".prefetch-old" / "req")
+    house.start(str(tmp_path))
+    assert os.listdir(house.work_root) == []
+    assert os.listdir(house.root) == []
+    assert mounts[0][0] == house.root
+
+
+def test_prefetch_work_dir_is_outside_mounted_root(tmp_path, house):
+    house, _ = house
+    house.start(str(tmp_path))
+    added, reused = house._prefetch_image("mcp-base:latest", {"k": ["demo @ https://token@example.com/demo.whl"]})
+    assert (added, reused) == (1, 0)
+    volumes = docker_manager.client.containers.runs[0]
+    root = os.path.realpath(house.root)
+    for path, bind in volumes.items():
+        if bind["bind"] != "/wheelhouse":
+            assert not os.path.realpath(path).startswith(root + os.sep)
+    # 新 wheel 移入 wheelhouse，临时目录已清理
+    assert os.listdir(house.root) == ["demo-1.0-py3-none-any.whl"]
+    assert os.listdir(house.work_root) == []
+
+
+def test_read_requirements(tmp_path):
+    (tmp_path / "requirements.txt").write_text(
+        "# comment\nhttpx==0.27.0  # pinned\n-r other.txt\n--index-url https://example.com\n\nmcp[cli]\n"
+    )
+    assert read_requirements(str(tmp_path)) == ["httpx==0.27.0", "mcp[cli]"]
+
+
+@pytest.mark.skipif(wheelhouse_module.tomllib is None, reason="tomllib requires Python 3.11")
+def test_read_requirements_from_uv_lock(tmp_path):
+    (tmp_path / "pyproject.toml").write_text('[project]\nname = "demo"\ndependencies = ["httpx"]\n')
+    (tmp_path / "uv.lock").write_text(
+        '[[package]]\nname = "demo"\nversion = "0.1.0"\nsource = { editable = "." }\n\n'
+        '[[package]]\nname = "httpx"\nversion = "0.27.0"\nsource = { registry = "https://pypi.org/simple" }\n'
+    )
+    assert read_requirements(str(tmp_path)) == ["httpx==0.27.0"]